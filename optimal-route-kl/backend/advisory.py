@@ -0,0 +1,222 @@
+"""
+LLM travel advisory (OpenRouter) shared by the Flask and FastAPI apps.
+
+Advisories are cached in `cache.advisory_cache` under `advisory_key`: the
+normalized stop sequence plus a weekday/weekend hour-of-day bucket, so the same
+commute in the same hour is answered once. Concurrent requests for the same
+key are coalesced into a single upstream call (one thread or task fetches, the
+rest wait for its result). Failures are cached briefly so an outage is not
+hammered by retries.
+
+The async app can also run the advisory in the background: `start_advisory`
+schedules the fetch and returns its id at once, and `advisory_status` reports
+the result once it is ready.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import threading
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+import http_client
+from cache import KL_TZ, advisory_cache, normalize_address
+from geocoding import parse_coordinate
+from resilience import UpstreamUnavailable
+
+OPENROUTER_BASE_URL = os.environ.get("OPENROUTER_BASE_URL", "https://openrouter.ai")
+OPENROUTER_URL = f"{OPENROUTER_BASE_URL}/api/v1/chat/completions"
+ADVISORY_MODEL = "openai/gpt-4"
+
+# The LLM is the slowest upstream call; give it a longer budget than routing.
+ADVISORY_TIMEOUT = float(os.environ.get("ADVISORY_TIMEOUT", 20))
+
+# Seconds a failed advisory is cached before the upstream is tried again.
+ADVISORY_FAILURE_TTL = int(os.environ.get("ADVISORY_FAILURE_TTL", 60))
+
+NO_ROUTE = {"analysis": "No route provided for analysis.", "buffer_minutes": 0}
+UNAVAILABLE = {"analysis": "Could not retrieve travel advisory at this time.", "buffer_minutes": 0}
+
+
+def _stop_key(location: str) -> str:
+    coord = parse_coordinate(location)
+    if coord is not None:
+        # ~100 m: pickups a few doors apart get the same advisory
+        return f"{coord['lat']:.3f},{coord['lng']:.3f}"
+    return normalize_address(location)
+
+
+def advisory_key(route_sequence: List[str], now: Optional[datetime] = None) -> str:
+    """Cache key (and background advisory id) for a stop sequence at a time of day."""
+    now = (now or datetime.now(KL_TZ)).astimezone(KL_TZ)
+    bucket = f"{'weekday' if now.weekday() < 5 else 'weekend'}-{now.hour:02d}"
+    text = json.dumps([_stop_key(stop) for stop in route_sequence] + [bucket])
+    return hashlib.sha1(text.encode()).hexdigest()
+
+
+def _store(key: str, result: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    if result is None:
+        advisory_cache.set(key, UNAVAILABLE, ttl=ADVISORY_FAILURE_TTL)
+        return dict(UNAVAILABLE)
+    advisory_cache.set(key, result)
+    return result
+
+
+def _request_body(route_sequence: List[str]) -> Dict[str, Any]:
+    # Instruct the LLM to return a JSON object for robust parsing
+    prompt = f"""
+    Given the following optimized travel route in Kuala Lumpur: {json.dumps(route_sequence)},
+    provide a concise travel advisory. The advisory should highlight potential traffic hotspots,
+suggest ideal travel times, and mention any interesting landmarks.
+
+    Your response MUST be a valid JSON object with two keys:
+    1. "analysis" (string): The travel advisory text.
+    2. "buffer_minutes" (integer): A suggested travel time buffer in minutes based on potential delays.
+
+    Example response:
+    {{"analysis": "Your route through the city center may experience congestion around Merdeka Square, especially during peak hours. Consider leaving before 4 PM. You'll pass by the historic Sultan Abdul Samad Building.", "buffer_minutes": 15}}
+    """
+    return {
+        "model": ADVISORY_MODEL,
+        "messages": [{"role": "user", "content": prompt}],
+        "response_format": {"type": "json_object"}  # Request JSON output
+    }
+
+
+def _headers() -> Dict[str, str]:
+    return {
+        "Authorization": f"Bearer {os.environ.get('OPENROUTER_API_KEY')}",
+        "Content-Type": "application/json"
+    }
+
+
+def _parse(response_json: dict) -> Dict[str, Any]:
+    # Safely parse the JSON response from the LLM
+    llm_response_text = response_json['choices'][0]['message']['content']
+    llm_data = json.loads(llm_response_text)
+    return {
+        "analysis": llm_data.get("analysis", "Advisory not available."),
+        "buffer_minutes": int(llm_data.get("buffer_minutes", 0))
+    }
+
+
+def _fetch(route_sequence: List[str]) -> Optional[Dict[str, Any]]:
+    try:
+        response = http_client.post_blocking(
+            OPENROUTER_URL,
+            headers=_headers(),
+            json=_request_body(route_sequence),
+            timeout=ADVISORY_TIMEOUT,
+        )
+        return _parse(response.json())
+    except (http_client.UpstreamHTTPError, UpstreamUnavailable, KeyError, IndexError,
+            ValueError) as e:
+        print(f"Error getting LLM analysis: {e}")
+        return None
+
+
+class _Flight:
+    """One in-progress blocking fetch that other threads can wait on."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Optional[Dict[str, Any]] = None
+
+
+_flights: Dict[str, _Flight] = {}
+_flights_lock = threading.Lock()
+
+
+def get_llm_analysis_and_buffer(route_sequence: List[str]) -> Dict[str, Any]:
+    """Calls the LLM to get a travel advisory and a suggested time buffer."""
+    if not route_sequence:
+        return dict(NO_ROUTE)
+    key = advisory_key(route_sequence)
+    cached = advisory_cache.get(key)
+    if cached is not None:
+        return dict(cached)
+
+    with _flights_lock:
+        flight = _flights.get(key)
+        leader = flight is None
+        if leader:
+            flight = _flights[key] = _Flight()
+    if not leader:
+        flight.done.wait(ADVISORY_TIMEOUT)
+        return dict(flight.result or UNAVAILABLE)
+
+    try:
+        flight.result = _store(key, _fetch(route_sequence))
+    finally:
+        with _flights_lock:
+            del _flights[key]
+        flight.done.set()
+    return dict(flight.result)
+
+
+async def _fetch_async(key: str, route_sequence: List[str]) -> Dict[str, Any]:
+    try:
+        response = await http_client.post(
+            OPENROUTER_URL,
+            headers=_headers(),
+            json=_request_body(route_sequence),
+            timeout=ADVISORY_TIMEOUT,
+        )
+        result = _parse(response.json())
+    except (http_client.UpstreamHTTPError, UpstreamUnavailable, KeyError, IndexError,
+            ValueError) as e:
+        print(f"Error getting LLM analysis: {e}")
+        result = None
+    return _store(key, result)
+
+
+_tasks: Dict[str, asyncio.Task] = {}
+
+
+def _start(key: str, route_sequence: List[str]) -> asyncio.Task:
+    """The running fetch for `key`, starting one if there is none on this loop."""
+    task = _tasks.get(key)
+    if task is None or task.get_loop() is not asyncio.get_running_loop():
+        task = asyncio.ensure_future(_fetch_async(key, route_sequence))
+        _tasks[key] = task
+        task.add_done_callback(lambda t: _tasks.pop(key) if _tasks.get(key) is t else None)
+    return task
+
+
+async def get_llm_analysis_and_buffer_async(route_sequence: List[str]) -> Dict[str, Any]:
+    """`get_llm_analysis_and_buffer` over the shared async client."""
+    if not route_sequence:
+        return dict(NO_ROUTE)
+    key = advisory_key(route_sequence)
+    cached = advisory_cache.get(key)
+    if cached is not None:
+        return dict(cached)
+    # Shielded: a caller giving up must not cancel the fetch other callers share
+    return dict(await asyncio.shield(_start(key, route_sequence)))
+
+
+def start_advisory(route_sequence: List[str]) -> Tuple[str, Optional[Dict[str, Any]]]:
+    """
+    Background variant for the async app. Returns (advisory id, cached result or
+    None); when None, the fetch has been started and `advisory_status` will
+    report it.
+    """
+    if not route_sequence:
+        return "", dict(NO_ROUTE)
+    key = advisory_key(route_sequence)
+    cached = advisory_cache.get(key)
+    if cached is not None:
+        return key, dict(cached)
+    _start(key, route_sequence)
+    return key, None
+
+
+def advisory_status(advisory_id: str) -> Optional[Dict[str, Any]]:
+    """{"status": "ready", ...advisory} or {"status": "pending"}; None if unknown or expired."""
+    cached = advisory_cache.get(advisory_id)
+    if cached is not None:
+        return {"status": "ready", **cached}
+    if advisory_id in _tasks:
+        return {"status": "pending"}
+    return None
@@ -1,93 +1,202 @@
-
-from flask import Flask, jsonify, request
+from flask import Flask, Response, g, jsonify, request
 from flask_cors import CORS
-import googlemaps
 import os
-from dotenv import load_dotenv
-import requests
-import re
-import json
-
-# Load environment variables from .env file (for local development)
-load_dotenv()
+import threading
+
+import solver
+import startup
+import cache
+import http_client
+import metrics
+import resilience
+import responses
+from advisory import get_llm_analysis_and_buffer
+from resilience import UpstreamUnavailable
+from routes_api import (DEGRADED_NOTICE, ROUTES_MAX_INTERMEDIATES, compute_routes,
+                        degraded_fields, fallback_route, fetch_travel_time_matrix,
+                        parse_duration, resolve_stop, summarize_matrix_route, summarize_route)
+
+# Load environment variables from .env file (for local development; Cloud Run sets K_SERVICE)
+if not os.environ.get("K_SERVICE"):
+    from dotenv import load_dotenv
+    load_dotenv()
 
 app = Flask(__name__)
 # Enable CORS for all domains on all routes
 CORS(app)
 
-# Initialize Google Maps client
-try:
-    gmaps = googlemaps.Client(key=os.environ.get("MAPS_API_KEY"))
-except Exception as e:
-    print(f"Error initializing Google Maps client: {e}")
-    gmaps = None
-
-def get_llm_analysis_and_buffer(route_sequence):
-    """Calls the LLM to get a travel advisory and a suggested time buffer."""
-    if not route_sequence:
-        return {"analysis": "No route provided for analysis.", "buffer_minutes": 0}
-
-    # Instruct the LLM to return a JSON object for robust parsing
-    prompt = f"""
-    Given the following optimized travel route in Kuala Lumpur: {json.dumps(route_sequence)},
-    provide a concise travel advisory. The advisory should highlight potential traffic hotspots,
-suggest ideal travel times, and mention any interesting landmarks. 
-    
-    Your response MUST be a valid JSON object with two keys:
-    1. "analysis" (string): The travel advisory text.
-    2. "buffer_minutes" (integer): A suggested travel time buffer in minutes based on potential delays.
-
-    Example response:
-    {{"analysis": "Your route through the city center may experience congestion around Merdeka Square, especially during peak hours. Consider leaving before 4 PM. You'll pass by the historic Sultan Abdul Samad Building.", "buffer_minutes": 15}}
+# Google Maps client, built on first use (googlemaps and requests are slow imports)
+_gmaps = None
+_gmaps_loaded = False
+_gmaps_lock = threading.Lock()
+
+
+def get_gmaps():
+    """The Google Maps client, or None if it failed to initialize."""
+    global _gmaps, _gmaps_loaded
+    if not _gmaps_loaded:
+        with _gmaps_lock:
+            if not _gmaps_loaded:
+                try:
+                    import googlemaps
+                    _gmaps = googlemaps.Client(key=os.environ.get("MAPS_API_KEY"))
+                except Exception as e:
+                    print(f"Error initializing Google Maps client: {e}")
+                    _gmaps = None
+                _gmaps_loaded = True
+    return _gmaps
+
+
+startup.start(imports=("requests",), clients=(get_gmaps, http_client.blocking_session))
+
+def solve_waypoint_order(start_location, waypoints, final_destination):
+    """
+    Returns (waypoint indices in optimal visiting order, resolved Routes API waypoints
+    for start + waypoints + destination, matrix tiles estimated rather than fetched).
+    Geocodes and legs come from the caches.
+    """
+    locations = [start_location, *waypoints, final_destination]
+    with metrics.stage("geocode"):
+        stops = [resolve_stop(get_gmaps(), loc) for loc in locations]
+    if len(waypoints) < 2:
+        return list(range(len(waypoints))), [wp for _, wp in stops], 0
+    with metrics.stage("matrix"):
+        durations, _, estimated = fetch_travel_time_matrix(stops, os.environ.get("MAPS_API_KEY"))
+    with metrics.stage("solve"):
+        order = solver.solve(durations)
+    return [idx - 1 for idx in order[1:-1]], [wp for _, wp in stops], estimated
+
+def matrix_summary(locations):
     """
+    Route built from the travel-time matrix alone, for stop counts a single
+    computeRoutes call does not accept (more than ROUTES_MAX_INTERMEDIATES waypoints).
+    Returns (summary, matrix tiles estimated rather than fetched)
+    """
+    with metrics.stage("geocode"):
+        stops = [resolve_stop(get_gmaps(), loc) for loc in locations]
+    with metrics.stage("matrix"):
+        durations, distances, estimated = fetch_travel_time_matrix(stops, os.environ.get("MAPS_API_KEY"))
+    with metrics.stage("solve"):
+        order = solver.solve(durations)
+    with metrics.stage("summarize"):
+        return summarize_matrix_route(locations, stops, order, durations, distances), estimated
+
+
+def summary_route_response(summary, compact, **extra):
+    """/api/optimize_route body from a matrix summary: no computeRoutes directions"""
+    optimized_sequence = [point['input'] for point in summary['route']]
+    with metrics.stage("advisory"):
+        llm_result = get_llm_analysis_and_buffer(optimized_sequence)
+    if compact:
+        body = responses.compact_from_summary(summary)
+    else:
+        body = {'optimal_sequence': optimized_sequence,
+                'total_time_minutes': summary['total_time_minutes'], 'directions': None}
+    return respond({
+        'status': 'success',
+        **body,
+        'llm_analysis': llm_result['analysis'],
+        'llm_buffer_minutes': llm_result['buffer_minutes'],
+        **extra,
+    }, compact)
+
+
+def degraded(estimated_tiles, route):
+    """routes_api.degraded_fields, counting the response in DEGRADED when it is flagged"""
+    if estimated_tiles:
+        metrics.DEGRADED.inc(app="flask", route=route)
+    return degraded_fields(estimated_tiles)
+
+
+def upstream_error(http_err):
+    """500 for an upstream call that failed outright, passing on the API's error body"""
+    if http_err.response is None:
+        error_details = str(http_err)
+    else:
+        try:
+            error_details = http_err.response.json()
+        except ValueError:
+            error_details = http_err.response.text
+    return jsonify({
+        'error': "An HTTP error occurred while calling the Routes API.",
+        'details': error_details
+    }), 500
 
-    try:
-        response = requests.post(
-            "https://openrouter.ai/api/v1/chat/completions",
-            headers={
-                "Authorization": f"Bearer {os.environ.get('OPENROUTER_API_KEY')}",
-                "Content-Type": "application/json"
-            },
-            json={
-                "model": "openai/gpt-4",
-                "messages": [{"role": "user", "content": prompt}],
-                "response_format": {"type": "json_object"} # Request JSON output
-            }
-        )
-        response.raise_for_status()
-        
-        # Safely parse the JSON response from the LLM
-        llm_response_text = response.json()['choices'][0]['message']['content']
-        llm_data = json.loads(llm_response_text)
 
-        return {
-            "analysis": llm_data.get("analysis", "Advisory not available."),
-            "buffer_minutes": int(llm_data.get("buffer_minutes", 0))
-        }
+def fallback_summary(locations, route):
+    """Straight-line route for when an upstream is unavailable (see routes_api.fallback_route)"""
+    metrics.DEGRADED.inc(app="flask", route=route)
+    with metrics.stage("fallback"):
+        return fallback_route(locations)
+
+
+@app.before_request
+def start_request_timer():
+    # Shed load before taking on more work than the worker threads can finish
+    if request.path not in ('/metrics', '/api/status', '/api/ready') and \
+            resilience.overloaded(metrics.IN_FLIGHT.value(app="flask")):
+        metrics.SHED.inc(app="flask")
+        return jsonify({'error': 'Server is busy, retry shortly.'}), 503, {'Retry-After': '1'}
+    g.request_timer = metrics.RequestTimer("flask", request.method)
+    g.deadline = resilience.start_deadline()
+
+
+@app.after_request
+def record_status(response):
+    g.status_code = response.status_code
+    return response
+
+
+@app.teardown_request
+def finish_request_timer(exc):
+    deadline = g.pop('deadline', None)
+    if deadline is not None:
+        resilience.end_deadline(deadline)
+    timer = g.pop('request_timer', None)
+    if timer is not None:
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        timer.finish(route, g.get('status_code', 500))
+
 
-    except (requests.exceptions.RequestException, KeyError, IndexError, json.JSONDecodeError) as e:
-        print(f"Error getting LLM analysis: {e}")
-        return {"analysis": "Could not retrieve travel advisory at this time.", "buffer_minutes": 0}
+@app.route('/metrics')
+def get_metrics():
+    """Prometheus scrape endpoint"""
+    return Response(metrics.render(), mimetype=metrics.CONTENT_TYPE)
+
+@app.route('/api/ready')
+def ready():
+    """Readiness probe: 503 until startup warm-up has finished (see startup.py)"""
+    return jsonify(startup.status()), 200 if startup.is_ready() else 503
 
 @app.route('/api/status')
 def status():
-    if gmaps is None:
+    if get_gmaps() is None:
         return jsonify({
             "status": "Backend is running, but Google Maps client failed to initialize.",
             "error": "Check the MAPS_API_KEY environment variable. It is likely missing or invalid."
         }), 500
     return jsonify({
-        "status": "Backend is running and Google Maps client initialized successfully."
+        "status": "Backend is running and Google Maps client initialized successfully.",
+        "cache": cache.all_stats(),
+        "upstream": http_client.breaker_states()
     })
 
 
+def respond(body, compact=False):
+    """Serialize with orjson and compress when the client accepts it (see responses.py)"""
+    with metrics.stage("serialize"):
+        data, headers = responses.encode(body, request.headers.get('Accept-Encoding', ''), compact)
+    return Response(data, headers=headers)
+
+
 @app.route('/api/optimize', methods=['POST'])
 def optimize():
-    """Optimized route endpoint - uses Google Routes API to find best order for waypoints"""
-    if gmaps is None:
+    """Optimized route endpoint - orders waypoints locally, then fetches legs from the Routes API"""
+    compact = responses.wants_compact(request.args, request.headers)
+    if get_gmaps() is None:
         return jsonify({'error': 'Google Maps client is not initialized. Check API Key.'}), 500
-
-    data = request.get_json()
+    with metrics.stage("parse_request"):
+        data = request.get_json()
     locations = data.get('locations', [])
 
     if not locations or len(locations) < 2:
@@ -99,126 +208,58 @@ def optimize():
     waypoints = locations[1:-1] if len(locations) > 2 else []
 
     try:
-        headers = {
-            "Content-Type": "application/json",
-            "X-Goog-Api-Key": os.environ.get("MAPS_API_KEY"),
-            "X-Goog-FieldMask": "routes.optimizedIntermediateWaypointIndex,routes.duration,routes.distanceMeters,routes.legs"
-        }
+        if len(waypoints) > ROUTES_MAX_INTERMEDIATES:
+            summary, estimated = matrix_summary(locations)
+            body = responses.compact_from_summary(summary) if compact else summary
+            return respond({**body, **degraded(estimated, '/api/optimize')}, compact)
+
+        optimized_order, resolved, estimated = solve_waypoint_order(start_location, waypoints, final_destination)
 
         payload = {
-            "origin": {"address": start_location},
-            "destination": {"address": final_destination},
+            "origin": resolved[0],
+            "destination": resolved[-1],
             "travelMode": "DRIVE",
         }
 
-        # Only add intermediates if there are waypoints
+        # Only add intermediates if there are waypoints, already in solved order
         if waypoints:
-            payload["intermediates"] = [{"address": loc} for loc in waypoints]
-            payload["optimizeWaypointOrder"] = True
+            payload["intermediates"] = [resolved[idx + 1] for idx in optimized_order]
 
-        response = requests.post(
-            "https://routes.googleapis.com/directions/v2:computeRoutes",
-            json=payload,
-            headers=headers
-        )
-        response.raise_for_status()
-
-        directions_result = response.json()
+        with metrics.stage("compute_routes"):
+            directions_result = compute_routes(
+                payload,
+                responses.COMPACT_FIELD_MASK if compact else responses.OPTIMIZE_FIELD_MASK,
+                os.environ.get("MAPS_API_KEY")
+            )
 
         if not directions_result or 'routes' not in directions_result or not directions_result['routes']:
             return jsonify({'error': 'Could not calculate the route using Routes API'}), 500
 
-        route_data = directions_result['routes'][0]
-        
-        # Get duration and distance
-        duration_str = route_data.get('duration', "0s")
-        total_time_seconds = int(re.sub(r's$', '', duration_str))
-        total_time_minutes = round(total_time_seconds / 60, 1)
-        
-        distance_meters = route_data.get('distanceMeters', 0)
-        distance_km = round(distance_meters / 1000, 2)
-
-        # Build optimized route sequence
-        optimized_order = route_data.get('optimizedIntermediateWaypointIndex', [])
-        
-        route = []
-        # Add starting point
-        route.append({'input': start_location, 'coord': None})
-        
-        # Add optimized waypoints
-        if waypoints:
-            for idx in optimized_order:
-                route.append({'input': waypoints[idx], 'coord': None})
-        
-        # Add destination
-        route.append({'input': final_destination, 'coord': None})
-
-        # Extract actual coordinates from route legs and build detailed breakdown
-        legs = route_data.get('legs', [])
-        leg_details = []
-        
-        if legs:
-            coord_idx = 0
-            for i, leg in enumerate(legs):
-                # Add start location coordinate
-                if coord_idx < len(route) and 'startLocation' in leg:
-                    loc = leg['startLocation']['latLng']
-                    route[coord_idx]['coord'] = {'lat': loc['latitude'], 'lng': loc['longitude']}
-                
-                # Extract leg details
-                leg_duration = leg.get('duration', '0s')
-                leg_time_seconds = int(re.sub(r's$', '', leg_duration))
-                leg_time_minutes = round(leg_time_seconds / 60, 1)
-                
-                leg_distance_meters = leg.get('distanceMeters', 0)
-                leg_distance_km = round(leg_distance_meters / 1000, 2)
-                
-                # Determine from/to locations
-                from_location = route[coord_idx]['input'] if coord_idx < len(route) else "Unknown"
-                to_location = route[coord_idx + 1]['input'] if coord_idx + 1 < len(route) else "Unknown"
-                
-                leg_details.append({
-                    'step': i + 1,
-                    'from': from_location,
-                    'to': to_location,
-                    'distance_km': leg_distance_km,
-                    'time_minutes': leg_time_minutes
-                })
-                
-                coord_idx += 1
-            
-            # Add final destination coordinate
-            if legs and 'endLocation' in legs[-1] and coord_idx < len(route):
-                loc = legs[-1]['endLocation']['latLng']
-                route[coord_idx]['coord'] = {'lat': loc['latitude'], 'lng': loc['longitude']}
-
-        return jsonify({
-            'route': route,
-            'legs': leg_details,
-            'summary': f'Optimized route: {distance_km}km, {total_time_minutes} mins',
-            'total_distance_km': distance_km,
-            'total_time_minutes': total_time_minutes
-        })
-
-    except requests.exceptions.HTTPError as http_err:
-        try:
-            error_details = http_err.response.json()
-        except ValueError:
-            error_details = http_err.response.text
-        return jsonify({
-            'error': "An HTTP error occurred while calling the Routes API.",
-            'details': error_details
-        }), 500
+        # Visiting order: start, solved waypoints, destination
+        inputs = [start_location, *(waypoints[idx] for idx in optimized_order), final_destination]
+        route = directions_result['routes'][0]
+        with metrics.stage("summarize"):
+            body = (responses.compact_from_directions(route, inputs) if compact
+                    else summarize_route(route, inputs))
+        return respond({**body, **degraded(estimated, '/api/optimize')}, compact)
+
+    except UpstreamUnavailable:
+        summary = fallback_summary(locations, '/api/optimize')
+        body = responses.compact_from_summary(summary) if compact else summary
+        return respond({**body, 'degraded': True, 'notice': DEGRADED_NOTICE}, compact)
+    except http_client.UpstreamHTTPError as http_err:
+        return upstream_error(http_err)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 
 @app.route('/api/optimize_route', methods=['POST'])
 def optimize_route():
-    if gmaps is None:
+    compact = responses.wants_compact(request.args, request.headers)
+    if get_gmaps() is None:
         return jsonify({'error': 'Google Maps client is not initialized. Check API Key.'}), 500
-
-    data = request.get_json()
+    with metrics.stage("parse_request"):
+        data = request.get_json()
     start_location = data.get('start_location')
     final_destination = data.get('final_destination')
     friend_locations = data.get('friend_locations', []) # Defaults to an empty list
@@ -229,40 +270,33 @@ def optimize_route():
     waypoints = friend_locations
 
     try:
-        headers = {
-            "Content-Type": "application/json",
-            "X-Goog-Api-Key": os.environ.get("MAPS_API_KEY"),
-            "X-Goog-FieldMask": "routes.optimizedIntermediateWaypointIndex,routes.duration,routes.distanceMeters"
-        }
+        if len(waypoints) > ROUTES_MAX_INTERMEDIATES:
+            summary, estimated = matrix_summary([start_location, *waypoints, final_destination])
+            return summary_route_response(summary, compact, **degraded(estimated, '/api/optimize_route'))
+
+        optimized_order, resolved, estimated = solve_waypoint_order(start_location, waypoints, final_destination)
 
         payload = {
-            "origin": {"address": start_location},
-            "destination": {"address": final_destination},
-            "intermediates": [{"address": loc} for loc in waypoints],
+            "origin": resolved[0],
+            "destination": resolved[-1],
+            "intermediates": [resolved[i + 1] for i in optimized_order],
             "travelMode": "DRIVE",
-            "optimizeWaypointOrder": True,
         }
 
-        response = requests.post(
-            "https://routes.googleapis.com/directions/v2:computeRoutes",
-            json=payload,
-            headers=headers
-        )
-        response.raise_for_status()
-
-        directions_result = response.json()
+        with metrics.stage("compute_routes"):
+            directions_result = compute_routes(
+                payload,
+                responses.TOTALS_FIELD_MASK,
+                os.environ.get("MAPS_API_KEY")
+            )
 
         if not directions_result or 'routes' not in directions_result or not directions_result['routes']:
             return jsonify({'error': 'Could not calculate the route using Routes API'}), 500
 
         route = directions_result['routes'][0]
         
-        duration_str = route.get('duration', "0s")
-        total_time_seconds = int(re.sub(r's$', '', duration_str))
-        total_time_minutes = round(total_time_seconds / 60, 1)
+        total_time_minutes = round(parse_duration(route.get('duration', "0s")) / 60, 1)
 
-        optimized_order = route.get('optimizedIntermediateWaypointIndex', [])
-        
         optimized_sequence = []
         optimized_sequence.append(start_location)
         for i in optimized_order:
@@ -270,26 +304,34 @@ def optimize_route():
         optimized_sequence.append(final_destination)
 
         # Get LLM analysis and buffer
-        llm_result = get_llm_analysis_and_buffer(optimized_sequence)
-        
-        return jsonify({
+        with metrics.stage("advisory"):
+            llm_result = get_llm_analysis_and_buffer(optimized_sequence)
+
+        degraded_body = degraded(estimated, '/api/optimize_route')
+        if compact:
+            # Polylines instead of the raw directions payload
+            return respond({
+                'status': 'success',
+                **responses.compact_from_directions(route, optimized_sequence),
+                'llm_analysis': llm_result['analysis'],
+                'llm_buffer_minutes': llm_result['buffer_minutes'],
+                **degraded_body,
+            }, True)
+        return respond({
             'status': 'success',
             'optimal_sequence': optimized_sequence,
             'total_time_minutes': total_time_minutes,
             'llm_analysis': llm_result['analysis'],
             'llm_buffer_minutes': llm_result['buffer_minutes'],
+            **degraded_body,
             'directions': directions_result # Keep raw data for frontend map rendering
         })
 
-    except requests.exceptions.HTTPError as http_err:
-        try:
-            error_details = http_err.response.json()
-        except ValueError:
-            error_details = http_err.response.text
-        return jsonify({
-            'error': "An HTTP error occurred while calling the Routes API.",
-            'details': error_details
-        }), 500
+    except UpstreamUnavailable:
+        summary = fallback_summary([start_location, *waypoints, final_destination], '/api/optimize_route')
+        return summary_route_response(summary, compact, degraded=True, notice=DEGRADED_NOTICE)
+    except http_client.UpstreamHTTPError as http_err:
+        return upstream_error(http_err)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
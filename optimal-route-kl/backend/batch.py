@@ -0,0 +1,123 @@
+"""
+Batch optimization for many independent pickup groups in one request.
+
+Every distinct location across the batch is geocoded once. Each job's
+travel-time sub-matrix is then fetched concurrently; because legs are cached
+per stop pair (`cache.leg_cache`), pairs shared between jobs are only fetched
+from computeRouteMatrix once. Orders are solved on a process pool and results
+are yielded as NDJSON lines in completion order, so the first groups come back
+while the rest are still being solved.
+
+Batch results are built from the matrix alone (no per-job computeRoutes call).
+Jobs whose stops could not be geocoded, or whose matrix could not be fetched
+at all, are ordered on straight-line estimates and flagged degraded.
+Addresses are geocoded and jobs are run BULK_CONCURRENCY at a time under
+`resilience.bulk()`, so a batch larger than the upstream quota is paced at the
+quota rather than turned into rate-limit errors.
+"""
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import Executor, ProcessPoolExecutor
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+import resilience
+import responses
+import solver
+from resilience import UpstreamUnavailable
+from routes_api import (UNREACHABLE_SECONDS, Stop, degraded_fields,
+                        fetch_travel_time_matrix_async, resolve_stops_async,
+                        straight_line_matrix, summarize_matrix_route, tile_count)
+
+# Process pool size for solving; 0 solves on a thread in the API process instead.
+BATCH_WORKERS = int(os.environ.get("BATCH_WORKERS", min(4, os.cpu_count() or 1)))
+BATCH_MAX_JOBS = int(os.environ.get("BATCH_MAX_JOBS", 1000))
+
+_pool: Optional[Executor] = None
+
+
+def _get_pool() -> Optional[Executor]:
+    """
+    The solver pool, started on first use. By then the process runs threads
+    (startup warming, `asyncio.to_thread` workers), and a forked child could
+    inherit one of their locks held, so workers come from a forkserver (spawn
+    where there is none) that has only imported the solver.
+    """
+    global _pool
+    if _pool is None and BATCH_WORKERS > 0:
+        method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+        context = multiprocessing.get_context(method)
+        if method == "forkserver":
+            context.set_forkserver_preload(["solver"])
+        _pool = ProcessPoolExecutor(max_workers=BATCH_WORKERS, mp_context=context)
+    return _pool
+
+
+def shutdown():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+async def _solve_job(index: int, inputs: List[str], stops: List[Stop], api_key: str,
+                     unavailable: bool = False) -> Dict[str, Any]:
+    """
+    One job's NDJSON line. When a stop could not be geocoded (`unavailable`) or
+    no matrix tile could be fetched, the job is ordered on `straight_line_matrix`
+    and flagged degraded, as the single-route endpoints do.
+    """
+    if len(inputs) < 2:
+        return {'index': index, 'error': 'Provide at least two locations'}
+    try:
+        durations = None
+        if not unavailable:
+            try:
+                durations, distances, estimated = await fetch_travel_time_matrix_async(stops, api_key)
+            except UpstreamUnavailable:
+                pass
+        if durations is None:
+            durations, distances = straight_line_matrix(stops)
+            estimated = tile_count(len(stops), len(stops))
+        if len(inputs) < 4:
+            order = list(range(len(inputs)))
+        else:
+            loop = asyncio.get_running_loop()
+            order = await loop.run_in_executor(_get_pool(), solver.solve, durations)
+        if (durations[order[:-1], order[1:]] >= UNREACHABLE_SECONDS).any():
+            return {'index': index, 'error': 'Could not calculate the route using Routes API'}
+        return {'index': index, **summarize_matrix_route(inputs, stops, order, durations, distances),
+                **degraded_fields(estimated)}
+    except Exception as e:
+        return {'index': index, 'error': str(e)}
+
+
+async def stream_batch(jobs: List[List[str]], api_key: str,
+                       compact: bool = False) -> AsyncIterator[bytes]:
+    """
+    Yield one NDJSON line per job (tagged with its `index`) as each finishes.
+    With `compact`, successful jobs use the `responses.compact_from_summary` shape.
+    """
+    unique = list(dict.fromkeys(loc for job in jobs if len(job) >= 2 for loc in job))
+    failures: Dict[int, Exception] = {}
+    stop_by_location = dict(zip(unique, await resolve_stops_async(unique, api_key, failures)))
+    unavailable = {unique[i] for i in failures}
+    slots = asyncio.Semaphore(resilience.BULK_CONCURRENCY)
+
+    async def run(i: int, job: List[str]) -> Dict[str, Any]:
+        async with slots:
+            with resilience.bulk():
+                return await _solve_job(i, job, [stop_by_location[loc] for loc in job
+                                                  if loc in stop_by_location], api_key,
+                                        unavailable=any(loc in unavailable for loc in job))
+
+    tasks = [asyncio.ensure_future(run(i, job)) for i, job in enumerate(jobs)]
+    try:
+        for finished in asyncio.as_completed(tasks):
+            result = await finished
+            if compact and 'error' not in result:
+                result = responses.compact_from_summary(result)
+            yield responses.dumps(result) + b"\n"
+    finally:
+        for task in tasks:
+            task.cancel()
@@ -0,0 +1,73 @@
+"""
+Bulk geocoding throughput: import a synthetic customer CSV offline.
+
+    python benchmarks/bench_geocoding.py [--rows 100000]
+
+Half the rows are pasted "lat,lng" strings (with GPS jitter, so many share a
+cache key once snapped onto a known point) and half are addresses from a local
+gazetteer. No API key is used.
+"""
+import argparse
+import csv
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import geocoding  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--places", type=int, default=5000)
+    args = parser.parse_args()
+
+    rng = random.Random(7)
+    places = {f"No. {i}, Jalan {i % 97}, Kuala Lumpur": (3.0 + rng.random() * 0.3,
+                                                      101.5 + rng.random() * 0.3)
+              for i in range(args.places)}
+    names = list(places)
+    homes = [(3.0 + rng.random() * 0.3, 101.5 + rng.random() * 0.3) for _ in range(args.rows // 10)]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        src, dst = os.path.join(tmp, "customers.csv"), os.path.join(tmp, "geocoded.csv")
+        with open(src, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["address"])
+            for i in range(args.rows):
+                if i % 2:
+                    lat, lng = rng.choice(homes)
+                    writer.writerow([f"{lat + rng.gauss(0, 3e-5):.6f},{lng + rng.gauss(0, 3e-5):.6f}"])
+                else:
+                    writer.writerow([rng.choice(names).upper()])
+
+        geocoding._gazetteer = geocoding.Gazetteer(places)
+        started = time.perf_counter()
+        rows, resolved, _ = geocoding.import_csv(src, dst, api_key=None)
+        elapsed = time.perf_counter() - started
+        with open(dst, newline="") as f:
+            points = [(float(row["lat"]), float(row["lng"])) for row in csv.DictReader(f) if row["lat"]]
+
+    index = geocoding.PointIndex()
+    started = time.perf_counter()
+    keys = {index.snap(lat, lng) for lat, lng in points}
+    snap_elapsed = time.perf_counter() - started
+
+    print(json.dumps({
+        "rows": rows,
+        "resolved": resolved,
+        "seconds": round(elapsed, 3),
+        "rows_per_second": round(rows / elapsed),
+        "distinct_points": len(set(points)),
+        "distinct_cache_keys": len(keys),
+        "snap_seconds": round(snap_elapsed, 3),
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+"""
+Large-N matrix build and solve: tiled computeRouteMatrix fetches against the fake upstream.
+
+    python benchmarks/bench_matrix.py [--stops 1000] [--latency-ms 20] [--error-rate 0.02]
+                                      [--limits default none]
+
+The fake upstream runs in its own process so its JSON encoding does not share
+this process's GIL. Each build runs under one request's deadline, once with
+the default UPSTREAM_RATE_LIMITS (tiles past the route_matrix quota are
+estimated, as in production) and once with no limits (the fake upstream's own
+throughput). Reports how many tiles were fetched or estimated, build and solve
+times, the matrix dtype and size, and the Python heap peak (tracemalloc, which
+also slows the build down) while building.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import httpx
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND)
+
+
+def _start_upstream(latency_ms: float, error_rate: float):
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    process = subprocess.Popen([sys.executable, os.path.join(BACKEND, "benchmarks", "fake_upstream.py"),
+                                "--port", str(port), "--latency-ms", str(latency_ms), "--jitter-ms", "0",
+                                "--error-rate", str(error_rate)],
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    url = f"http://127.0.0.1:{port}"
+    for _ in range(100):
+        try:
+            httpx.get(url, timeout=0.5)
+            return process, url
+        except httpx.TransportError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError("fake upstream did not start")
+
+
+def _run(stops, limits: str) -> dict:
+    """Build and solve the matrix once under `limits` (UPSTREAM_RATE_LIMITS syntax)."""
+    import cache
+    import http_client
+    import metrics
+    import resilience
+    import routes_api
+    import solver
+
+    http_client._rate_limits = resilience.parse_rate_limits(limits)
+    http_client.configure(None)
+    cache.leg_cache.clear()
+    fetched = metrics.MATRIX_TILES.value(result="fetched")
+    estimated = metrics.MATRIX_TILES.value(result="estimated")
+
+    async def build():
+        try:
+            # Planned against the rate limit within one request's deadline, as the API does
+            with resilience.deadline():
+                return await routes_api.fetch_travel_time_matrix_async(stops, "bench")
+        finally:
+            await http_client.aclose()
+
+    tracemalloc.start()
+    started = time.perf_counter()
+    durations, _, _ = asyncio.run(build())
+    build_seconds = time.perf_counter() - started
+    _, heap_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    started = time.perf_counter()
+    order = solver.solve(durations)
+    solve_seconds = time.perf_counter() - started
+    return {
+        "rate_limits": limits or "none",
+        "tiles_fetched": metrics.MATRIX_TILES.value(result="fetched") - fetched,
+        "tiles_estimated": metrics.MATRIX_TILES.value(result="estimated") - estimated,
+        "build_seconds": round(build_seconds, 2),
+        "solve_seconds": round(solve_seconds, 2),
+        "matrix_dtype": str(durations.dtype),
+        "matrix_mb": round(durations.nbytes / 2 ** 20, 1),
+        "build_heap_peak_mb": round(heap_peak / 2 ** 20, 1),
+        "route_hours": round(solver.route_cost(durations, order) / 3600, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--stops", type=int, default=1000)
+    parser.add_argument("--latency-ms", type=float, default=20)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--limits", nargs="+", choices=["default", "none"], default=["default", "none"])
+    args = parser.parse_args()
+
+    upstream, url = _start_upstream(args.latency_ms, args.error_rate)
+    try:
+        # Read at import time, so set before the first import
+        os.environ["ROUTES_BASE_URL"] = url
+        import resilience
+        import routes_api
+
+        rng = random.Random(3)
+        stops = [routes_api.resolve_stop(None, f"{3.0 + rng.random() * 0.3:.6f},"
+                                               f"{101.5 + rng.random() * 0.3:.6f}")
+                 for _ in range(args.stops)]
+        results = []
+        for limits in args.limits:
+            results.append(_run(stops, resilience.UPSTREAM_RATE_LIMITS if limits == "default" else ""))
+            print(f"limits={results[-1]['rate_limits']} fetched={results[-1]['tiles_fetched']} "
+                  f"estimated={results[-1]['tiles_estimated']} build={results[-1]['build_seconds']}s",
+                  file=sys.stderr)
+    finally:
+        upstream.terminate()
+        upstream.wait()
+
+    print(json.dumps({"stops": args.stops, "upstream_latency_ms": args.latency_ms,
+                      "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
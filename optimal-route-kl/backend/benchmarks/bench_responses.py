@@ -0,0 +1,114 @@
+"""
+Payload size and encode time of the full and compact views, per endpoint.
+
+    python benchmarks/bench_responses.py [--stops 25] [--repeat 200]
+
+Builds a synthetic computeRoutes result (legs with turn-by-turn steps, as
+Google returns them), trims it to the field mask each endpoint and view
+actually requests, and prints one JSON report with the upstream and response
+sizes. /api/optimize_route only asks for the route totals in either view, so
+its compact body is not expected to be smaller.
+"""
+import argparse
+import gzip
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import responses  # noqa: E402
+from routes_api import summarize_route  # noqa: E402
+
+
+def synthetic_directions(stops: int, steps_per_leg: int = 12) -> dict:
+    line = responses.encode_polyline([(3.1 + i / 1e4, 101.6 + i / 1e4) for i in range(40)])
+    step = {"distanceMeters": 240, "staticDuration": "29s",
+            "polyline": {"encodedPolyline": line},
+            "startLocation": {"latLng": {"latitude": 3.1391, "longitude": 101.6869}},
+            "endLocation": {"latLng": {"latitude": 3.1402, "longitude": 101.6881}},
+            "navigationInstruction": {"maneuver": "TURN_LEFT",
+                                      "instructions": "Turn left onto Jalan Sultan Ismail"}}
+    leg = {"duration": "412s", "staticDuration": "380s", "distanceMeters": 2880,
+           "polyline": {"encodedPolyline": line * 3},
+           "startLocation": step["startLocation"], "endLocation": step["endLocation"],
+           "steps": [step] * steps_per_leg}
+    return {"routes": [{"duration": f"{412 * (stops - 1)}s", "distanceMeters": 2880 * (stops - 1),
+                        "polyline": {"encodedPolyline": line * 3 * (stops - 1)},
+                        "legs": [leg] * (stops - 1)}]}
+
+
+def apply_field_mask(value, mask: str):
+    """What computeRoutes returns for `value` under the X-Goog-FieldMask `mask`."""
+    return _select(value, [path.split(".") for path in mask.split(",")])
+
+
+def _select(value, paths):
+    if any(not path for path in paths):
+        return value
+    if isinstance(value, list):
+        return [_select(item, paths) for item in value]
+    out = {}
+    for key in dict.fromkeys(path[0] for path in paths):
+        if key in value:
+            out[key] = _select(value[key], [path[1:] for path in paths if path[0] == key])
+    return out
+
+
+def _time(fn, repeat: int) -> float:
+    started = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - started) / repeat * 1000
+
+
+def bodies(directions: dict, sequence):
+    """{endpoint: {view: (field mask, response body)}} as app.py and main.py build them."""
+    llm = {'llm_analysis': "Expect traffic near KLCC.", 'llm_buffer_minutes': 10}
+    optimize = apply_field_mask(directions, responses.OPTIMIZE_FIELD_MASK)
+    compact = apply_field_mask(directions, responses.COMPACT_FIELD_MASK)
+    totals = apply_field_mask(directions, responses.TOTALS_FIELD_MASK)
+    return {
+        "/api/optimize": {
+            "full": (responses.OPTIMIZE_FIELD_MASK, summarize_route(optimize['routes'][0], sequence)),
+            "compact": (responses.COMPACT_FIELD_MASK,
+                        responses.compact_from_directions(compact['routes'][0], sequence)),
+        },
+        "/api/optimize_route": {
+            "full": (responses.TOTALS_FIELD_MASK,
+                     {'status': 'success', 'optimal_sequence': sequence, 'total_time_minutes': 164.8,
+                      **llm, 'directions': totals}),
+            "compact": (responses.TOTALS_FIELD_MASK,
+                        {'status': 'success',
+                         **responses.compact_from_directions(totals['routes'][0], sequence), **llm}),
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--stops", type=int, default=25)
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    directions = synthetic_directions(args.stops)
+    sequence = [f"Stop {i}" for i in range(args.stops)]
+    report = {"stops": args.stops, "orjson": responses.orjson is not None}
+    for endpoint, views in bodies(directions, sequence).items():
+        report[endpoint] = {}
+        for name, (mask, body) in views.items():
+            raw = responses.dumps(body)
+            report[endpoint][name] = {
+                "upstream_bytes": len(json.dumps(apply_field_mask(directions, mask))),
+                "bytes": len(raw),
+                "gzip_bytes": len(gzip.compress(raw, compresslevel=5)),
+                "json_dumps_ms": round(_time(lambda: json.dumps(body), args.repeat), 3),
+                "encode_ms": round(_time(lambda: responses.dumps(body), args.repeat), 3),
+                "encode_gzip_ms": round(_time(lambda: responses.encode(body, "gzip"), args.repeat), 3),
+            }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
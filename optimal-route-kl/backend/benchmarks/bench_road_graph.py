@@ -0,0 +1,84 @@
+"""
+Offline routing: contraction-hierarchy build, stop snapping and matrix times.
+
+    python benchmarks/bench_road_graph.py [--size 120] [--stops 50] [--osm extract.osm.bz2]
+
+Without --osm the graph is a synthetic size x size street grid (~220 m blocks
+around KLCC, random speeds, a fifth of the streets one-way). With --osm it is
+built from a real extract, as `python road_graph.py build` does. The index is
+saved and memory-mapped back, then `--stops` random points in the graph's
+bounding box are snapped and routed stops x stops. Prints one JSON report.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import road_graph  # noqa: E402
+from road_graph import RoadGraph  # noqa: E402
+
+
+def grid_edges(size: int, seed: int = 3):
+    rng = np.random.default_rng(seed)
+    lat = np.repeat(3.10 + np.arange(size) * 0.002, size)
+    lng = np.tile(101.65 + np.arange(size) * 0.002, size)
+    v = np.arange(size * size).reshape(size, size)
+    a = np.concatenate([v[:, :-1].ravel(), v[:-1, :].ravel()])
+    b = np.concatenate([v[:, 1:].ravel(), v[1:, :].ravel()])
+    both = rng.random(len(a)) >= 0.2
+    src, dst = np.concatenate([a, b[both]]), np.concatenate([b, a[both]])
+    dist = road_graph.haversine_m(lat[src], lng[src], lat[dst], lng[dst])
+    return lat, lng, src, dst, dist / rng.uniform(4, 20, len(src)), dist
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--size", type=int, default=120)
+    parser.add_argument("--stops", type=int, default=50)
+    parser.add_argument("--osm")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    edges = road_graph.read_osm(args.osm) if args.osm else grid_edges(args.size)
+    read_s = time.perf_counter() - started
+    started = time.perf_counter()
+    graph = RoadGraph.from_edges(*edges)
+    build_s = time.perf_counter() - started
+
+    with tempfile.TemporaryDirectory() as tmp:
+        graph.save(tmp)
+        graph = RoadGraph.load(tmp)
+        rng = np.random.default_rng(11)
+        lats = rng.uniform(graph.lat.min(), graph.lat.max(), args.stops)
+        lngs = rng.uniform(graph.lng.min(), graph.lng.max(), args.stops)
+
+        started = time.perf_counter()
+        nodes, snap = graph.nearest_nodes(lats, lngs)
+        snap_ms = (time.perf_counter() - started) * 1000
+        started = time.perf_counter()
+        durations, _ = graph.matrix(nodes, nodes)
+        matrix_ms = (time.perf_counter() - started) * 1000
+
+    print(json.dumps({
+        "source": args.osm or f"grid {args.size}x{args.size}",
+        "nodes": graph.n,
+        "edges": len(edges[2]),
+        "ch_edges": len(graph.up_indices) + len(graph.down_indices),
+        "read_seconds": round(read_s, 2),
+        "contract_seconds": round(build_s, 2),
+        "stops": args.stops,
+        "snap_ms": round(snap_ms, 2),
+        "max_snap_m": round(float(snap.max()), 1),
+        "matrix_ms": round(matrix_ms, 1),
+        "unreachable_pairs": int(np.isinf(durations).sum()),
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
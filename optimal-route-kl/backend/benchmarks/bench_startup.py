@@ -0,0 +1,74 @@
+"""
+Cold start: time to listen, time to ready, and the first requests' latency per app.
+
+    python benchmarks/bench_startup.py [--apps fastapi flask gunicorn] [--runs 3] [--warm background off]
+
+Each run launches the app fresh (see `load_test.AppServer`) against the fake
+upstream, polls /api/ready every 10 ms, then sends three /api/optimize_route
+requests one after another with new coordinates, so caches stay cold and only
+first-use work differs between them. STARTUP_WARM=off shows what the first
+request pays when nothing is preloaded. Reports the median of each number
+across runs as JSON.
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import time
+
+import httpx
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND)
+
+from benchmarks.fake_upstream import FakeUpstream  # noqa: E402
+from benchmarks.load_test import APPS, AppServer, _payload  # noqa: E402
+
+ENDPOINT = "/api/optimize_route"
+REQUESTS_PER_RUN = 3
+STOPS = 5
+
+
+def _one_run(app_name: str, upstream_url: str, warm: str, rng: random.Random) -> dict:
+    with AppServer(app_name, upstream_url, ready_path="/api/ready", poll_interval=0.01,
+                   extra_env={"STARTUP_WARM": warm}) as server:
+        latencies = []
+        with httpx.Client(timeout=30) as client:
+            for _ in range(REQUESTS_PER_RUN):
+                started = time.perf_counter()
+                r = client.post(server.url + ENDPOINT, json=_payload(ENDPOINT, STOPS, rng))
+                r.raise_for_status()
+                latencies.append((time.perf_counter() - started) * 1000)
+        return {"listening_ms": server.listening_seconds * 1000,
+                "ready_ms": server.ready_seconds * 1000,
+                **{f"request_{i + 1}_ms": ms for i, ms in enumerate(latencies)}}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--apps", nargs="+", choices=sorted(APPS), default=["fastapi", "flask"])
+    parser.add_argument("--warm", nargs="+", choices=["background", "off"],
+                        default=["background", "off"])
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--latency-ms", type=float, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    results = []
+    with FakeUpstream(latency_ms=args.latency_ms, jitter_ms=0) as upstream:
+        for app_name in args.apps:
+            for warm in args.warm:
+                runs = [_one_run(app_name, upstream.url, warm, rng) for _ in range(args.runs)]
+                results.append({"app": app_name, "startup_warm": warm, "runs": args.runs,
+                                **{key: round(statistics.median(r[key] for r in runs), 1)
+                                   for key in runs[0]}})
+                print(f"{app_name:8} warm={warm:10} ready={results[-1]['ready_ms']}ms "
+                      f"first={results[-1]['request_1_ms']}ms", file=sys.stderr)
+    print(json.dumps({"stops": STOPS, "upstream_latency_ms": args.latency_ms,
+                      "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+"""
+Local stand-in for routes.googleapis.com, the Geocoding API and openrouter.ai.
+
+Serves computeRoutes, computeRouteMatrix, geocode/json and chat/completions
+with straight-line travel times, after a configurable latency, and fails a
+configurable share of requests with 503s. Point the apps at it with
+ROUTES_BASE_URL / GEOCODE_BASE_URL / OPENROUTER_BASE_URL.
+
+    python benchmarks/fake_upstream.py --port 9100 --latency-ms 80 --error-rate 0.01
+"""
+import json
+import math
+import os
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from geocoding import stable_coordinate  # noqa: E402
+
+# Straight-line distance is stretched to look like road distance.
+ROAD_FACTOR = 1.3
+SPEED_MPS = 8.0
+
+
+def _point(waypoint: dict) -> Tuple[float, float]:
+    if "location" in waypoint:
+        lat_lng = waypoint["location"]["latLng"]
+        return lat_lng["latitude"], lat_lng["longitude"]
+    coord = stable_coordinate(waypoint.get("address", ""))
+    return coord["lat"], coord["lng"]
+
+
+def _leg(a: Tuple[float, float], b: Tuple[float, float]) -> Tuple[int, int]:
+    """(seconds, metres) between two points."""
+    dlat = math.radians(b[0] - a[0])
+    dlng = math.radians(b[1] - a[1]) * math.cos(math.radians((a[0] + b[0]) / 2))
+    meters = int(6371000 * math.hypot(dlat, dlng) * ROAD_FACTOR)
+    return int(meters / SPEED_MPS), meters
+
+
+class FakeUpstream:
+    """Threaded HTTP server in the background; `url` is its base URL."""
+
+    def __init__(self, port: int = 0, latency_ms: float = 50, jitter_ms: float = 10,
+                 error_rate: float = 0.0, seed: int = 0):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.requests: Dict[str, int] = {}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", port), self._handler())
+        self._server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "FakeUpstream":
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _delay_and_fail(self, kind: str) -> bool:
+        """Sleep for the configured latency; True if this request should fail."""
+        with self._lock:
+            self.requests[kind] = self.requests.get(kind, 0) + 1
+            delay = max(0.0, self.latency_ms + self._random.uniform(-1, 1) * self.jitter_ms)
+            fail = self._random.random() < self.error_rate
+        time.sleep(delay / 1000)
+        return fail
+
+    def _handler(self):
+        upstream = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _send(self, status: int, body):
+                data = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _body(self) -> dict:
+                length = int(self.headers.get("Content-Length") or 0)
+                return json.loads(self.rfile.read(length) or b"{}")
+
+            def _unavailable(self):
+                self._send(503, {"error": {"code": 503, "status": "UNAVAILABLE",
+                                           "message": "Injected upstream failure"}})
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                if not url.path.endswith("/geocode/json"):
+                    return self._send(404, {"error": "not found"})
+                if upstream._delay_and_fail("geocode"):
+                    return self._unavailable()
+                address = parse_qs(url.query).get("address", [""])[0]
+                self._send(200, {"status": "OK", "results": [
+                    {"geometry": {"location": stable_coordinate(address)}}
+                ]})
+
+            def do_POST(self):
+                path = urlparse(self.path).path
+                body = self._body()
+                if path.endswith(":computeRouteMatrix"):
+                    if upstream._delay_and_fail("matrix"):
+                        return self._unavailable()
+                    origins = [_point(o["waypoint"]) for o in body["origins"]]
+                    destinations = [_point(d["waypoint"]) for d in body["destinations"]]
+                    elements = []
+                    for i, a in enumerate(origins):
+                        for j, b in enumerate(destinations):
+                            seconds, meters = _leg(a, b)
+                            elements.append({"originIndex": i, "destinationIndex": j,
+                                             "condition": "ROUTE_EXISTS",
+                                             "duration": f"{seconds}s", "distanceMeters": meters})
+                    return self._send(200, elements)
+                if path.endswith(":computeRoutes"):
+                    if upstream._delay_and_fail("routes"):
+                        return self._unavailable()
+                    points = [_point(body["origin"]),
+                              *(_point(w) for w in body.get("intermediates", [])),
+                              _point(body["destination"])]
+                    legs = [_leg(a, b) for a, b in zip(points, points[1:])]
+                    return self._send(200, {"routes": [{
+                        "duration": f"{sum(s for s, _ in legs)}s",
+                        "distanceMeters": sum(m for _, m in legs),
+                        "polyline": {"encodedPolyline": ""},
+                        "legs": [{"duration": f"{s}s", "distanceMeters": m,
+                                  "polyline": {"encodedPolyline": ""}} for s, m in legs],
+                    }]})
+                if path.endswith("/chat/completions"):
+                    if upstream._delay_and_fail("advisory"):
+                        return self._unavailable()
+                    content = json.dumps({"analysis": "Light traffic expected on this route.",
+                                          "buffer_minutes": 5})
+                    return self._send(200, {"choices": [{"message": {"content": content}}]})
+                self._send(404, {"error": "not found"})
+
+        return Handler
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--latency-ms", type=float, default=50)
+    parser.add_argument("--jitter-ms", type=float, default=10)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    server = FakeUpstream(args.port, args.latency_ms, args.jitter_ms, args.error_rate)
+    print(f"Fake upstream on {server.url}")
+    try:
+        server.start()._thread.join()
+    except KeyboardInterrupt:
+        server.stop()
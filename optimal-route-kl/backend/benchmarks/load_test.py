@@ -0,0 +1,255 @@
+"""
+Load test for the Flask (`app.py`) and FastAPI (`main.py`) apps.
+
+Starts `fake_upstream.FakeUpstream`, launches each app as a subprocess pointed
+at it, and drives /api/optimize and /api/optimize_route with concurrent
+clients at each stop count. Every request uses fresh random coordinates so the
+caches stay cold. Reports p50/p95/p99 latency, requests per second, error count
+and the server's peak RSS, and writes them as JSON (sorted keys, rounded
+values) so a committed results file diffs cleanly between runs.
+
+    python benchmarks/load_test.py --stops 2 10 25 50 100 --requests 40 --concurrency 8 \\
+        --out benchmarks/results/baseline.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+from typing import Dict, List, Optional
+
+import httpx
+import numpy as np
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND)
+
+from benchmarks.fake_upstream import FakeUpstream  # noqa: E402
+
+APPS = {
+    "fastapi": [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1",
+                "--port", "{port}", "--log-level", "warning"],
+    # Flask's threaded development server, as started by `python app.py`
+    "flask": [sys.executable, "app.py"],
+    # The container's command: preloaded, warmed master forking uvicorn workers
+    "gunicorn": [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "main:app",
+                 "--bind", "127.0.0.1:{port}", "--log-level", "warning"],
+}
+ENDPOINTS = ("/api/optimize", "/api/optimize_route")
+DEFAULT_STOPS = (2, 5, 10, 25, 50, 100)
+
+# googlemaps.Client only checks the key's prefix.
+BENCH_API_KEY = "AIza-load-test"
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _rss_mb(pid: int) -> Optional[float]:
+    """Resident set size of `pid` in MB (Linux /proc; None elsewhere)."""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+class MemorySampler:
+    """Tracks the peak RSS of a process while a load step runs."""
+
+    def __init__(self, pid: int, interval: float = 0.05):
+        self.pid = pid
+        self.interval = interval
+        self.peak: Optional[float] = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            rss = _rss_mb(self.pid)
+            if rss is not None:
+                self.peak = rss if self.peak is None else max(self.peak, rss)
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+class AppServer:
+    """One backend app in a subprocess, configured against the fake upstream."""
+
+    def __init__(self, name: str, upstream_url: str, ready_path: str = "/api/status",
+                 poll_interval: float = 0.2, extra_env: Optional[Dict[str, str]] = None):
+        self.name = name
+        self.ready_path = ready_path
+        self.poll_interval = poll_interval
+        # Seconds from launch until the port first answered, and until `ready_path` gave 200
+        self.listening_seconds: Optional[float] = None
+        self.ready_seconds: Optional[float] = None
+        self.port = _free_port()
+        self.url = f"http://127.0.0.1:{self.port}"
+        self.env = {
+            **os.environ,
+            "PORT": str(self.port),
+            "MAPS_API_KEY": BENCH_API_KEY,
+            "OPENROUTER_API_KEY": "load-test",
+            "ROUTES_BASE_URL": upstream_url,
+            "GEOCODE_BASE_URL": upstream_url,
+            "OPENROUTER_BASE_URL": upstream_url,
+            **(extra_env or {}),
+        }
+        self.env.pop("ROUTE_CACHE_DB", None)
+        self.process: Optional[subprocess.Popen] = None
+
+    def __enter__(self):
+        command = [arg.format(port=self.port) for arg in APPS[self.name]]
+        started = time.monotonic()
+        self.process = subprocess.Popen(command, cwd=BACKEND, env=self.env,
+                                        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        deadline = started + 30
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"{self.name} exited with code {self.process.returncode}")
+            try:
+                status_code = httpx.get(f"{self.url}{self.ready_path}", timeout=1).status_code
+                if self.listening_seconds is None:
+                    self.listening_seconds = time.monotonic() - started
+                if status_code == 200:
+                    self.ready_seconds = time.monotonic() - started
+                    return self
+            except httpx.TransportError:
+                pass
+            time.sleep(self.poll_interval)
+        self.__exit__()
+        raise RuntimeError(f"{self.name} did not become ready")
+
+    def __exit__(self, *exc):
+        if self.process and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+
+
+def _payload(endpoint: str, stops: int, rng: random.Random) -> dict:
+    points = [f"{3.0 + rng.random() * 0.3:.6f},{101.5 + rng.random() * 0.3:.6f}"
+              for _ in range(stops)]
+    if endpoint == "/api/optimize":
+        return {"locations": points}
+    return {"start_location": points[0], "friend_locations": points[1:-1],
+            "final_destination": points[-1]}
+
+
+def summarize(latencies_ms: List[float], errors: int, elapsed: float,
+              peak_rss_mb: Optional[float]) -> Dict[str, object]:
+    """Percentiles are over successful requests only, and None when there were none."""
+    percentiles = [None] * 3
+    if latencies_ms:
+        percentiles = [round(float(p), 1) for p in np.percentile(latencies_ms, [50, 95, 99])]
+    return {
+        "requests": len(latencies_ms) + errors,
+        "errors": errors,
+        **dict(zip(("p50_ms", "p95_ms", "p99_ms"), percentiles)),
+        "rps": round((len(latencies_ms) + errors) / elapsed, 2) if elapsed else 0.0,
+        "peak_rss_mb": None if peak_rss_mb is None else round(peak_rss_mb, 1),
+    }
+
+
+async def _drive(url: str, payloads: List[dict], concurrency: int):
+    """POST every payload with at most `concurrency` in flight; returns (latencies, errors, elapsed)."""
+    latencies, errors = [], 0
+    semaphore = asyncio.Semaphore(concurrency)
+    limits = httpx.Limits(max_connections=concurrency)
+
+    async with httpx.AsyncClient(timeout=120, limits=limits) as client:
+        async def one(payload):
+            nonlocal errors
+            async with semaphore:
+                started = time.perf_counter()
+                try:
+                    r = await client.post(url, json=payload)
+                    ok = r.status_code == 200
+                except httpx.HTTPError:
+                    ok = False
+                if ok:
+                    latencies.append((time.perf_counter() - started) * 1000)
+                else:
+                    errors += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(one(p) for p in payloads))
+        return latencies, errors, time.perf_counter() - started
+
+
+def run(apps=("fastapi", "flask"), endpoints=ENDPOINTS, stops=DEFAULT_STOPS, requests: int = 40,
+        concurrency: int = 8, latency_ms: float = 50, jitter_ms: float = 10,
+        error_rate: float = 0.0, seed: int = 0) -> dict:
+    config = {"apps": list(apps), "endpoints": list(endpoints), "stops": list(stops),
+              "requests": requests, "concurrency": concurrency, "latency_ms": latency_ms,
+              "jitter_ms": jitter_ms, "error_rate": error_rate, "seed": seed}
+    results = []
+    rng = random.Random(seed)
+    with FakeUpstream(latency_ms=latency_ms, jitter_ms=jitter_ms,
+                      error_rate=error_rate, seed=seed) as upstream:
+        for app_name in apps:
+            with AppServer(app_name, upstream.url) as server:
+                for endpoint in endpoints:
+                    for n in stops:
+                        # One warm-up request so imports and pools are not measured
+                        asyncio.run(_drive(server.url + endpoint, [_payload(endpoint, n, rng)], 1))
+                        payloads = [_payload(endpoint, n, rng) for _ in range(requests)]
+                        with MemorySampler(server.process.pid) as memory:
+                            latencies, errors, elapsed = asyncio.run(
+                                _drive(server.url + endpoint, payloads, concurrency))
+                        results.append({"app": app_name, "endpoint": endpoint, "stops": n,
+                                        **summarize(latencies, errors, elapsed, memory.peak)})
+                        print(f"{app_name:8} {endpoint:20} stops={n:<4} "
+                              f"p50={results[-1]['p50_ms']}ms p99={results[-1]['p99_ms']}ms "
+                              f"rps={results[-1]['rps']} errors={errors}", file=sys.stderr)
+    return {"config": config, "results": results}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--apps", nargs="+", choices=sorted(APPS), default=["fastapi", "flask"])
+    parser.add_argument("--endpoints", nargs="+", choices=ENDPOINTS, default=list(ENDPOINTS))
+    parser.add_argument("--stops", nargs="+", type=int, default=list(DEFAULT_STOPS))
+    parser.add_argument("--requests", type=int, default=40, help="requests per stop count")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--latency-ms", type=float, default=50)
+    parser.add_argument("--jitter-ms", type=float, default=10)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", help="write the JSON report here (default: stdout)")
+    args = parser.parse_args()
+
+    report = run(args.apps, args.endpoints, args.stops, args.requests, args.concurrency,
+                 args.latency_ms, args.jitter_ms, args.error_rate, args.seed)
+    text = json.dumps(report, indent=2, sort_keys=True) + "\n"
+    if args.out:
+        os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+        with open(args.out, "w") as f:
+            f.write(text)
+    else:
+        sys.stdout.write(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,328 @@
+"""
+In-process caches for upstream lookups (geocodes, route legs, full routes,
+LLM advisories).
+
+Each `TTLCache` is a size-bounded LRU with per-entry expiry. When the
+ROUTE_CACHE_DB environment variable points at a file, entries are also written
+through to SQLite so they survive container restarts; `preload()` reads the
+freshest of them back into memory at startup (see `startup.py`). The SQLite
+connection is reopened in forked children, so a gunicorn master that preloaded
+the caches can hand them to its workers.
+"""
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+# Kuala Lumpur is UTC+8 all year round.
+KL_TZ = timezone(timedelta(hours=8))
+
+# Leg durations are bucketed by departure time so requests a few minutes apart
+# share entries: 15-minute buckets at rush hour, 30 minutes by day and one
+# bucket for the whole night (23:00-06:00), so no bucket is narrower than the
+# TTL its entries get (see `traffic_ttl`).
+RUSH_BUCKET_MINUTES = 15
+DAY_BUCKET_MINUTES = 30
+
+_MISSING = object()
+
+# Keys per SQLite statement in bulk lookups (older SQLite allows 999 parameters).
+_SQL_BATCH = 900
+
+
+def normalize_address(address: str) -> str:
+    """Canonical cache key for a free-text address ("  KLCC, KL " -> "klcc, kl")."""
+    text = re.sub(r'\s+', ' ', str(address).strip().lower())
+    return re.sub(r'\s*,\s*', ', ', text)
+
+
+def _is_rush_hour(now: datetime) -> bool:
+    hour = now.hour + now.minute / 60
+    return now.weekday() < 5 and (7 <= hour < 10 or 16.5 <= hour < 20)
+
+
+def _bucket_bounds(now: datetime) -> Tuple[datetime, datetime]:
+    """Start and end of the departure-time bucket `now` (local KL time) falls in."""
+    if 6 <= now.hour < 23:
+        width = RUSH_BUCKET_MINUTES if _is_rush_hour(now) else DAY_BUCKET_MINUTES
+        start = now.replace(minute=now.minute - now.minute % width, second=0, microsecond=0)
+        return start, start + timedelta(minutes=width)
+    start = now.replace(hour=23, minute=0, second=0, microsecond=0)
+    if now.hour < 23:
+        start -= timedelta(days=1)
+    return start, start + timedelta(hours=7)
+
+
+def time_bucket(now: Optional[datetime] = None) -> str:
+    """Departure-time bucket (local KL time) used in leg and route cache keys."""
+    now = (now or datetime.now(KL_TZ)).astimezone(KL_TZ)
+    return _bucket_bounds(now)[0].strftime('%a%H%M')
+
+
+def traffic_ttl(now: Optional[datetime] = None) -> int:
+    """
+    Seconds a traffic-dependent entry stays fresh: short at rush hour, long at
+    night, and never past the end of its `time_bucket`, after which its key is
+    no longer looked up.
+    """
+    now = (now or datetime.now(KL_TZ)).astimezone(KL_TZ)
+    if _is_rush_hour(now):
+        ttl = 5 * 60
+    elif 6 <= now.hour < 23:
+        ttl = 30 * 60
+    else:
+        ttl = 2 * 60 * 60
+    return max(1, min(ttl, int((_bucket_bounds(now)[1] - now).total_seconds())))
+
+
+class SQLiteStore:
+    """Tiny persistent key/value table shared by all caches in the process."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._connect()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache ("
+                "ns TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, "
+                "expires_at REAL NOT NULL, PRIMARY KEY (ns, key))"
+            )
+
+    def _connect(self):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+
+    def reopen(self):
+        """New connection and lock; a connection must not be shared across a fork."""
+        self._connect()
+
+    def get(self, ns: str, key: str):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, expires_at FROM cache WHERE ns = ? AND key = ?", (ns, key)
+            ).fetchone()
+        if row is None or row[1] < time.time():
+            return _MISSING, 0
+        return json.loads(row[0]), row[1]
+
+    def get_many(self, ns: str, keys: List[str]) -> Dict[str, Tuple[Any, float]]:
+        """{key: (value, expires_at)} for the unexpired `keys`, a few hundred per SELECT."""
+        found = {}
+        now = time.time()
+        for start in range(0, len(keys), _SQL_BATCH):
+            chunk = keys[start:start + _SQL_BATCH]
+            with self._lock:
+                rows = self._conn.execute(
+                    "SELECT key, value, expires_at FROM cache WHERE ns = ? AND expires_at >= ? "
+                    f"AND key IN ({','.join('?' * len(chunk))})", (ns, now, *chunk)
+                ).fetchall()
+            found.update((key, (json.loads(value), expires_at)) for key, value, expires_at in rows)
+        return found
+
+    def items(self, ns: str, limit: int) -> List[Tuple[str, Any, float]]:
+        """Up to `limit` unexpired (key, value, expires_at) rows, longest-lived first."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT key, value, expires_at FROM cache WHERE ns = ? AND expires_at >= ? "
+                "ORDER BY expires_at DESC LIMIT ?", (ns, time.time(), limit)
+            ).fetchall()
+        return [(key, json.loads(value), expires_at) for key, value, expires_at in rows]
+
+    def set(self, ns: str, key: str, value: Any, expires_at: float):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO cache (ns, key, value, expires_at) VALUES (?, ?, ?, ?)",
+                (ns, key, json.dumps(value), expires_at)
+            )
+
+    def set_many(self, ns: str, items: List[Tuple[str, Any]], expires_at: float):
+        """`set` for many keys in one transaction."""
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO cache (ns, key, value, expires_at) VALUES (?, ?, ?, ?)",
+                [(ns, key, json.dumps(value), expires_at) for key, value in items]
+            )
+
+    def delete(self, ns: str, key: str):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM cache WHERE ns = ? AND key = ?", (ns, key))
+
+    def purge_expired(self):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM cache WHERE expires_at < ?", (time.time(),))
+
+
+class TTLCache:
+    """Thread-safe LRU cache with per-entry TTL and hit/miss counters."""
+
+    def __init__(self, name: str, maxsize: int = 1024, ttl: int = 300,
+                 store: Optional[SQLiteStore] = None):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.store = store
+        self._data: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: str, default=None):
+        now = time.time()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return entry[1]
+                del self._data[key]
+        if self.store is not None:
+            value, expires_at = self.store.get(self.name, key)
+            if value is not _MISSING:
+                with self._lock:
+                    self._insert(key, value, expires_at)
+                    self.hits += 1
+                return value
+        with self._lock:
+            self.misses += 1
+        return default
+
+    def set(self, key: str, value: Any, ttl: Optional[int] = None):
+        expires_at = time.time() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._insert(key, value, expires_at)
+        if self.store is not None:
+            self.store.set(self.name, key, value, expires_at)
+
+    def get_many(self, keys: List[str]) -> Dict[str, Any]:
+        """
+        `get` for many keys: {key: value} for those cached. Keys missing from
+        memory are looked up in the store with one query per few hundred keys.
+        """
+        now = time.time()
+        found: Dict[str, Any] = {}
+        absent = []
+        with self._lock:
+            for key in keys:
+                entry = self._data.get(key)
+                if entry is not None and entry[0] > now:
+                    self._data.move_to_end(key)
+                    found[key] = entry[1]
+                else:
+                    if entry is not None:
+                        del self._data[key]
+                    absent.append(key)
+        stored = self.store.get_many(self.name, absent) if self.store is not None and absent else {}
+        with self._lock:
+            for key, (value, expires_at) in stored.items():
+                self._insert(key, value, expires_at)
+                found[key] = value
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        return found
+
+    def set_many(self, items: List[Tuple[str, Any]], ttl: Optional[int] = None):
+        """`set` for many entries sharing one TTL, written to the store in one transaction."""
+        expires_at = time.time() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            for key, value in items:
+                self._insert(key, value, expires_at)
+        if self.store is not None and items:
+            self.store.set_many(self.name, items, expires_at)
+
+    def pop(self, key: str) -> bool:
+        """Remove `key`; returns whether it was cached in memory."""
+        with self._lock:
+            found = self._data.pop(key, None) is not None
+        if self.store is not None:
+            self.store.delete(self.name, key)
+        return found
+
+    def preload(self) -> int:
+        """Copy up to `maxsize` persisted entries into memory; returns how many were loaded."""
+        if self.store is None:
+            return 0
+        rows = self.store.items(self.name, self.maxsize)
+        with self._lock:
+            # Oldest first, so the longest-lived entries end up most recently used
+            for key, value, expires_at in reversed(rows):
+                if key not in self._data:
+                    self._insert(key, value, expires_at)
+        return len(rows)
+
+    def _insert(self, key, value, expires_at):
+        self._data[key] = (expires_at, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / total, 3) if total else 0.0,
+            }
+
+
+def _open_store() -> Optional[SQLiteStore]:
+    path = os.environ.get("ROUTE_CACHE_DB")
+    if not path:
+        return None
+    try:
+        store = SQLiteStore(path)
+        store.purge_expired()
+        return store
+    except sqlite3.Error as e:
+        print(f"Error opening route cache database {path}: {e}")
+        return None
+
+
+_store = _open_store()
+
+
+def _reopen_store():
+    if _store is not None:
+        _store.reopen()
+
+
+os.register_at_fork(after_in_child=_reopen_store)
+
+# Addresses barely move, so geocodes are kept for a week.
+geocode_cache = TTLCache("geocode", maxsize=int(os.environ.get("GEOCODE_CACHE_SIZE", 10000)),
+                         ttl=7 * 24 * 3600, store=_store)
+# Single origin->destination legs; TTL is chosen per entry with traffic_ttl().
+leg_cache = TTLCache("leg", maxsize=int(os.environ.get("LEG_CACHE_SIZE", 50000)),
+                     ttl=30 * 60, store=_store)
+# Full computeRoutes responses for an already-ordered stop sequence.
+route_cache = TTLCache("route", maxsize=int(os.environ.get("ROUTE_CACHE_SIZE", 2000)),
+                       ttl=30 * 60, store=_store)
+
+# LLM travel advisories, keyed on the normalized stop sequence and hour of day.
+advisory_cache = TTLCache("advisory", maxsize=int(os.environ.get("ADVISORY_CACHE_SIZE", 2000)),
+                          ttl=int(os.environ.get("ADVISORY_CACHE_TTL", 3600)), store=_store)
+
+
+def all_stats() -> Dict[str, Dict[str, Any]]:
+    return {c.name: c.stats() for c in (geocode_cache, leg_cache, route_cache, advisory_cache)}
+
+
+def preload_all() -> int:
+    """`TTLCache.preload` for every cache; returns the number of entries loaded."""
+    return sum(c.preload() for c in (geocode_cache, leg_cache, route_cache, advisory_cache))
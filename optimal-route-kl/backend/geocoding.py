@@ -0,0 +1,371 @@
+"""
+Geocoding for single stops and bulk imports.
+
+Locations resolve in this order:
+1. "lat,lng" strings, parsed for a whole column at once by `parse_coordinates`;
+2. the local gazetteer at GAZETTEER_PATH (a `name,lat,lng` CSV of known places);
+3. the geocode cache, then the Google Geocoding API.
+
+Resolved coordinates are returned as found. For cache keys, `known_points`
+maps a pickup within SNAP_METERS of a point already resolved onto that point,
+so near-duplicate addresses share cached legs (see `routes_api.resolve_stop`).
+
+Import a customer CSV (needs an `address` column) with:
+    python geocoding.py import customers.csv geocoded.csv
+"""
+import asyncio
+import csv
+import hashlib
+import math
+import os
+import re
+import threading
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+import http_client
+import metrics
+import resilience
+from cache import geocode_cache, normalize_address
+from resilience import UpstreamUnavailable
+
+GEOCODE_BASE_URL = os.environ.get("GEOCODE_BASE_URL", "https://maps.googleapis.com")
+GEOCODE_URL = f"{GEOCODE_BASE_URL}/maps/api/geocode/json"
+
+# Pickups closer than this to a known point share its cache key (0 disables snapping).
+SNAP_METERS = float(os.environ.get("SNAP_METERS", 15))
+
+# Points remembered for snapping; beyond this the index only answers lookups.
+SNAP_INDEX_LIMIT = int(os.environ.get("SNAP_INDEX_LIMIT", 200000))
+
+_NUMBER = r'-?\d+(?:\.\d+)?'
+COORD_RE = re.compile(rf'^\s*({_NUMBER})\s*,\s*({_NUMBER})\s*$')
+# One match per line: (lat, lng) for coordinate lines, ("", "") for anything else
+_COLUMN_RE = re.compile(rf'^(?:[ \t]*({_NUMBER})[ \t]*,[ \t]*({_NUMBER})[ \t]*|.*)$', re.M)
+
+_METERS_PER_DEGREE = 111320.0
+
+Coord = Dict[str, float]
+
+
+def _in_range(lat, lng):
+    return (np.abs(lat) <= 90) & (np.abs(lng) <= 180)
+
+
+def parse_coordinate(location: str) -> Optional[Coord]:
+    match = COORD_RE.match(location)
+    if match:
+        lat, lng = float(match.group(1)), float(match.group(2))
+        if _in_range(lat, lng):
+            return {'lat': lat, 'lng': lng}
+    return None
+
+
+def parse_coordinates(locations: Sequence[str]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Parse a column of "lat,lng" strings in one regex pass and one array cast.
+    Returns (lat, lng) float arrays with NaN wherever the input is not a coordinate.
+    """
+    if not len(locations):
+        return np.empty(0), np.empty(0)
+    text = "\n".join(str(loc).replace("\n", " ").replace("\r", " ") for loc in locations)
+    pairs = np.array(_COLUMN_RE.findall(text), dtype=str).reshape(-1, 2)
+    values = np.where(pairs == "", "nan", pairs).astype(np.float64)
+    lat, lng = values[:, 0], values[:, 1]
+    bad = ~_in_range(lat, lng)
+    lat[bad] = lng[bad] = np.nan
+    return lat, lng
+
+
+def stable_coordinate(text: str) -> Coord:
+    """
+    Deterministic stand-in coordinate for an address nobody can geocode (mock
+    endpoints and tests). Unlike `hash()`, the digest is not salted per process,
+    so every worker and restart agrees.
+    """
+    digest = hashlib.blake2b(normalize_address(text).encode(), digest_size=8).digest()
+    h = int.from_bytes(digest, "big")
+    return {'lat': 1.0 + (h % 9000) / 1000.0, 'lng': 101.0 + (h % 18000) / 1000.0}
+
+
+class Gazetteer:
+    """Known place names -> coordinates, keyed on the normalized name."""
+
+    def __init__(self, places: Optional[Dict[str, Tuple[float, float]]] = None):
+        self.places = {normalize_address(name): coord for name, coord in (places or {}).items()}
+
+    @classmethod
+    def load(cls, path: str) -> "Gazetteer":
+        gazetteer = cls()
+        with open(path, newline="", encoding="utf-8") as f:
+            for row in csv.DictReader(f):
+                gazetteer.places[normalize_address(row['name'])] = (float(row['lat']),
+                                                                   float(row['lng']))
+        return gazetteer
+
+    def __len__(self):
+        return len(self.places)
+
+    def lookup(self, address: str) -> Optional[Coord]:
+        coord = self.places.get(normalize_address(address))
+        return {'lat': coord[0], 'lng': coord[1]} if coord else None
+
+
+_gazetteer: Optional[Gazetteer] = None
+
+
+def get_gazetteer() -> Gazetteer:
+    """The gazetteer at GAZETTEER_PATH (empty if unset or unreadable), loaded once."""
+    global _gazetteer
+    if _gazetteer is None:
+        path = os.environ.get("GAZETTEER_PATH")
+        _gazetteer = Gazetteer()
+        if path:
+            try:
+                _gazetteer = Gazetteer.load(path)
+            except (OSError, KeyError, ValueError) as e:
+                print(f"Error loading gazetteer {path}: {e}")
+    return _gazetteer
+
+
+class PointIndex:
+    """
+    Geohash-style grid over the points resolved so far, used to give
+    near-duplicate pickups one cache key. Cells are at least `radius_m` wide, so
+    every point within the radius is in the query's cell or one of its 8
+    neighbours. Returned points are the stored ones, never moved.
+    """
+
+    def __init__(self, radius_m: float = SNAP_METERS, limit: int = SNAP_INDEX_LIMIT):
+        self.radius_m = radius_m
+        self.limit = limit
+        self.cell_deg = max(radius_m, 1.0) / _METERS_PER_DEGREE
+        self._cells: Dict[Tuple[int, int], List[Tuple[float, float]]] = {}
+        self._lock = threading.Lock()
+        self.size = 0
+
+    def _cell(self, row: int, lng: float) -> Tuple[int, int]:
+        # Columns widen in degrees away from the equator so they stay at least radius_m
+        # wide, measured one row further out so the rows either side are covered too
+        edge = (max(abs(row), abs(row + 1)) + 1) * self.cell_deg
+        cos_lat = max(math.cos(math.radians(min(edge, 90.0))), 0.01)
+        return row, math.floor(lng * cos_lat / self.cell_deg)
+
+    def nearest(self, lat: float, lng: float) -> Optional[Tuple[float, float]]:
+        """The closest stored point within `radius_m` (ties go to the smaller point), if any."""
+        row = math.floor(lat / self.cell_deg)
+        cos_lat = math.cos(math.radians(lat))
+        best, best_d2 = None, (self.radius_m / _METERS_PER_DEGREE) ** 2
+        for r in (row - 1, row, row + 1):
+            _, col = self._cell(r, lng)
+            for c in (col - 1, col, col + 1):
+                for point in self._cells.get((r, c), ()):
+                    # Equirectangular distance is exact enough at snapping scale
+                    d2 = (point[0] - lat) ** 2 + ((point[1] - lng) * cos_lat) ** 2
+                    if d2 < best_d2 or (d2 == best_d2 and best is not None and point < best):
+                        best, best_d2 = point, d2
+        return best
+
+    def snap(self, lat: float, lng: float) -> Tuple[float, float]:
+        """The stored point within `radius_m`, or this one (remembered while under `limit`)."""
+        if self.radius_m <= 0:
+            return lat, lng
+        with self._lock:
+            point = self.nearest(lat, lng)
+            if point is not None:
+                return point
+            if self.size < self.limit:
+                self._cells.setdefault(self._cell(math.floor(lat / self.cell_deg), lng),
+                                       []).append((lat, lng))
+                self.size += 1
+            return lat, lng
+
+    def snap_coord(self, coord: Optional[Coord]) -> Optional[Coord]:
+        if coord is None:
+            return coord
+        lat, lng = self.snap(coord['lat'], coord['lng'])
+        return {'lat': lat, 'lng': lng}
+
+    def clear(self):
+        with self._lock:
+            self._cells.clear()
+            self.size = 0
+
+
+known_points = PointIndex()
+
+
+def _first_result(results: list) -> Optional[Coord]:
+    if not results:
+        return None
+    loc = results[0]['geometry']['location']
+    return {'lat': loc['lat'], 'lng': loc['lng']}
+
+
+def geocode(gmaps_client, address: str) -> Optional[Coord]:
+    """Resolve an address to {"lat", "lng"}, memoised on the normalized address."""
+    key = normalize_address(address)
+    cached = geocode_cache.get(key)
+    if cached is not None:
+        return cached
+    if gmaps_client is None:
+        return None
+    started = time.perf_counter()
+    try:
+        coord = _first_result(gmaps_client.geocode(address, region="my"))
+    except Exception as e:
+        metrics.record_upstream(GEOCODE_URL, "error", time.perf_counter() - started)
+        print(f"Error geocoding {address!r}: {e}")
+        return None
+    # The googlemaps client hides status and sizes; count the call and its latency
+    metrics.record_upstream(GEOCODE_URL, "200", time.perf_counter() - started)
+    if coord is not None:
+        geocode_cache.set(key, coord)
+    return coord
+
+
+async def geocode_async(address: str, api_key: Optional[str]) -> Optional[Coord]:
+    """
+    `geocode` over the Geocoding REST API and the shared async client.
+    `UpstreamUnavailable` is raised rather than reported as "not found".
+    """
+    key = normalize_address(address)
+    cached = geocode_cache.get(key)
+    if cached is not None:
+        return cached
+    if not api_key:
+        return None
+    try:
+        response = await http_client.get(
+            GEOCODE_URL, params={"address": address, "region": "my", "key": api_key}
+        )
+        coord = _first_result(response.json().get('results') or [])
+    except UpstreamUnavailable:
+        raise
+    except Exception as e:
+        print(f"Error geocoding {address!r}: {e}")
+        return None
+    if coord is not None:
+        geocode_cache.set(key, coord)
+    return coord
+
+
+def locate(gmaps_client, location: str) -> Optional[Coord]:
+    """Coordinates for one location: parsed, from the gazetteer, or geocoded."""
+    coord = parse_coordinate(location) or get_gazetteer().lookup(location)
+    if coord is None:
+        coord = geocode(gmaps_client, location)
+    return coord
+
+
+async def locate_many_async(locations: Sequence[str], api_key: Optional[str],
+                            failures: Optional[Dict[int, UpstreamUnavailable]] = None
+                            ) -> List[Optional[Coord]]:
+    """
+    `locate` for a whole column of locations. Duplicates (after normalization) are
+    resolved once, coordinates are parsed in bulk and only addresses missing from
+    the gazetteer go to the geocode cache / API, concurrently.
+
+    Without `failures` an unavailable Geocoding API raises `UpstreamUnavailable`.
+    Bulk callers pass a dict instead: addresses are then geocoded
+    BULK_CONCURRENCY at a time under `resilience.bulk()`, and each location
+    that could not be looked up is left as None and recorded in `failures`
+    under its index.
+    """
+    keys = [normalize_address(loc) for loc in locations]
+    first: Dict[str, int] = {}
+    for i, key in enumerate(keys):
+        first.setdefault(key, i)
+    unique = [locations[i] for i in first.values()]
+    unique_keys = list(first)
+
+    lat, lng = parse_coordinates(unique)
+    coords: List[Optional[Coord]] = [None] * len(unique)
+    gazetteer = get_gazetteer()
+    pending = []
+    for k, location in enumerate(unique):
+        if not math.isnan(lat[k]):
+            coords[k] = {'lat': float(lat[k]), 'lng': float(lng[k])}
+        else:
+            coords[k] = gazetteer.lookup(location)
+            if coords[k] is None:
+                pending.append(k)
+
+    if failures is None:
+        found = await asyncio.gather(*(geocode_async(unique[k], api_key) for k in pending))
+    else:
+        found = await _geocode_bulk([unique[k] for k in pending], api_key)
+    unavailable: Dict[str, UpstreamUnavailable] = {}
+    for k, coord in zip(pending, found):
+        if isinstance(coord, UpstreamUnavailable):
+            unavailable[unique_keys[k]] = coord
+            coord = None
+        coords[k] = coord
+
+    by_key = dict(zip(unique_keys, coords))
+    if failures is not None:
+        failures.update((i, unavailable[key]) for i, key in enumerate(keys) if key in unavailable)
+    return [by_key[key] for key in keys]
+
+
+async def _geocode_bulk(addresses: List[str], api_key: Optional[str]) -> list:
+    """`geocode_async` for each address, a few at a time; unavailable lookups come back as the exception."""
+    slots = asyncio.Semaphore(resilience.BULK_CONCURRENCY)
+
+    async def one(address):
+        async with slots:
+            try:
+                return await geocode_async(address, api_key)
+            except UpstreamUnavailable as e:
+                return e
+
+    with resilience.bulk():
+        return await asyncio.gather(*(one(address) for address in addresses))
+
+
+def import_csv(src: str, dst: str, api_key: Optional[str]) -> Tuple[int, int, int]:
+    """
+    Geocode the `address` column of `src` into `dst` (address, lat, lng, error).
+    `error` is "not found" when the lookup found nothing and the upstream error
+    when the Geocoding API could not be asked; those rows are worth re-running.
+    Returns (rows, resolved, unavailable).
+    """
+    with open(src, newline="", encoding="utf-8") as f:
+        addresses = [row['address'] for row in csv.DictReader(f)]
+    failures: Dict[int, UpstreamUnavailable] = {}
+    coords = asyncio.run(_locate_and_close(addresses, api_key, failures))
+    with open(dst, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["address", "lat", "lng", "error"])
+        for i, (address, coord) in enumerate(zip(addresses, coords)):
+            if coord is not None:
+                writer.writerow([address, coord['lat'], coord['lng'], ""])
+            else:
+                writer.writerow([address, "", "", str(failures[i]) if i in failures else "not found"])
+    return len(addresses), sum(coord is not None for coord in coords), len(failures)
+
+
+async def _locate_and_close(addresses, api_key, failures):
+    try:
+        return await locate_many_async(addresses, api_key, failures)
+    finally:
+        await http_client.aclose()
+
+
+if __name__ == "__main__":
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    sub = parser.add_subparsers(dest="command", required=True)
+    imp = sub.add_parser("import", help="geocode the address column of a CSV")
+    imp.add_argument("src")
+    imp.add_argument("dst")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    rows, resolved, unavailable = import_csv(args.src, args.dst, os.environ.get("MAPS_API_KEY"))
+    print(f"Geocoded {resolved}/{rows} rows in {time.perf_counter() - started:.1f}s -> {args.dst}"
+          + (f" ({unavailable} rows could not be looked up; re-run them)" if unavailable else ""))
@@ -0,0 +1,40 @@
+"""
+gunicorn settings for the Cloud Run container (see Dockerfile):
+
+    gunicorn -c gunicorn.conf.py main:app
+
+The master imports the app once (`preload_app`) and runs `startup.warm()`
+before forking WEB_CONCURRENCY uvicorn workers, so the solver tables, caches
+and imports are loaded once and shared copy-on-write; `gc.freeze()` keeps the
+collector from touching (and so copying) those pages in the workers.
+`uvicorn --workers` cannot do this: it starts workers with spawn, and each
+one imports and warms the app again.
+
+Live sessions (`sessions.sessions`) and background advisories
+(`advisory._tasks`) are held in the memory of the worker that created them.
+Without sticky routing a follow-up request can land on another worker and get
+a 404, so the default is one worker; raise WEB_CONCURRENCY only when sessions
+and background advisories are not used.
+"""
+import gc
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 8080)}"
+workers = int(os.environ.get("WEB_CONCURRENCY", 1))
+worker_class = "uvicorn.workers.UvicornWorker"
+preload_app = True
+# Cloud Run bounds request time itself; let long batch streams finish
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", 0))
+graceful_timeout = int(os.environ.get("GUNICORN_GRACEFUL_TIMEOUT", 10))
+keepalive = 75
+
+
+def when_ready(server):
+    """Runs in the master after the app is preloaded and before any worker forks."""
+    import main
+    import startup
+
+    if startup.STARTUP_WARM != "off":
+        timings = startup.warm(imports=main.WARM_IMPORTS)
+        server.log.info("Warmed in %.3fs: %s", sum(timings.values()), timings)
+    gc.freeze()
@@ -0,0 +1,337 @@
+"""
+Shared HTTP client for upstream calls (Routes, Geocoding, OpenRouter).
+
+One pooled `httpx.AsyncClient` per process keeps TLS connections alive between
+requests. A semaphore bounds how many upstream calls are in flight at once and
+every call carries a timeout. `post_blocking` is the `requests` equivalent
+used by the Flask app, over one `requests.Session` per process so its threads
+reuse connections too. Each app only imports the HTTP library it calls through
+(httpx or `requests`), when it first needs it; both raise `UpstreamHTTPError`
+for failures retrying cannot fix. Every call is counted in `metrics`.
+
+Each attempt first passes the service's circuit breaker and rate limiter
+(`resilience`). 429s, 5xx responses and transport errors are retried with
+jittered exponential backoff until UPSTREAM_RETRIES or the request deadline
+runs out, then raise `UpstreamUnavailable`; other 4xx responses raise
+`UpstreamHTTPError` at once.
+Waiting for a token or a free slot is capped at UPSTREAM_QUEUE_SECONDS (or
+BULK_QUEUE_SECONDS inside `resilience.bulk()`) so a traffic spike fails fast
+instead of tying up workers.
+"""
+import asyncio
+import os
+import ssl
+import threading
+import time
+from functools import lru_cache
+from typing import TYPE_CHECKING, Any, Dict, Optional
+
+import certifi
+
+import metrics
+import resilience
+from resilience import UpstreamUnavailable
+
+if TYPE_CHECKING:
+    import httpx
+    import requests
+
+# Seconds allowed for a single upstream call (connect gets a shorter budget).
+UPSTREAM_TIMEOUT = float(os.environ.get("UPSTREAM_TIMEOUT", 10))
+UPSTREAM_CONNECT_TIMEOUT = float(os.environ.get("UPSTREAM_CONNECT_TIMEOUT", 3))
+# Upper bound on concurrent upstream calls across all requests in the process.
+UPSTREAM_CONCURRENCY = int(os.environ.get("UPSTREAM_CONCURRENCY", 16))
+UPSTREAM_MAX_CONNECTIONS = int(os.environ.get("UPSTREAM_MAX_CONNECTIONS", 32))
+
+_client: Optional["httpx.AsyncClient"] = None
+_semaphore: Optional[asyncio.Semaphore] = None
+_transport: Optional["httpx.AsyncBaseTransport"] = None
+# The Flask app's threads share this bound with each other (not with the event loop)
+_blocking_slots = threading.BoundedSemaphore(UPSTREAM_CONCURRENCY)
+_session: Optional["requests.Session"] = None
+_session_lock = threading.Lock()
+
+
+class UpstreamHTTPError(Exception):
+    """
+    An upstream call that retrying cannot fix: a 4xx `response` (httpx or
+    `requests`), or a request that could not be made at all (`response` None).
+    """
+
+    def __init__(self, message: str, response=None):
+        super().__init__(message)
+        self.response = response
+
+
+def _status_error(url: str, response) -> UpstreamHTTPError:
+    return UpstreamHTTPError(f"{response.status_code} from {url}", response)
+
+
+class _Guard:
+    """Per-service rate limiter and circuit breaker."""
+
+    def __init__(self, service: str, rate: Optional[float]):
+        self.service = service
+        self.bucket = (resilience.TokenBucket(rate, rate * resilience.UPSTREAM_BURST_SECONDS)
+                       if rate else None)
+        self.breaker = resilience.CircuitBreaker()
+
+
+_rate_limits = resilience.parse_rate_limits(resilience.UPSTREAM_RATE_LIMITS)
+_guards: Dict[str, _Guard] = {}
+_guards_lock = threading.Lock()
+
+
+def _guard(service: str) -> _Guard:
+    with _guards_lock:
+        guard = _guards.get(service)
+        if guard is None:
+            guard = _guards[service] = _Guard(service, _rate_limits.get(service))
+        return guard
+
+
+def calls_within(url: str, seconds: float) -> Optional[int]:
+    """How many calls to `url`'s service the rate limit allows in the next `seconds` (None: no limit)."""
+    bucket = _guard(metrics.upstream_service(url)).bucket
+    return None if bucket is None else bucket.available(seconds)
+
+
+def breaker_states() -> Dict[str, str]:
+    """Circuit state per service that has been called, for /api/status."""
+    with _guards_lock:
+        guards = list(_guards.values())
+    return {g.service: g.breaker.state for g in guards}
+
+
+def configure(transport: Optional["httpx.AsyncBaseTransport"] = None):
+    """Use `transport` for new clients (tests pass an `httpx.MockTransport`)."""
+    global _client, _semaphore, _transport
+    _transport = transport
+    _client = None
+    _semaphore = None
+    with _guards_lock:
+        _guards.clear()
+
+
+@lru_cache(maxsize=None)
+def ssl_context() -> ssl.SSLContext:
+    """
+    Verified TLS context for upstream clients. Loading the CA bundle takes tens
+    of milliseconds, so it is built once (`startup.warm` builds it before the
+    first request) and reused when a closed client is replaced.
+    """
+    context = ssl.create_default_context(cafile=certifi.where())
+    context.set_alpn_protocols(["http/1.1"])
+    return context
+
+
+def get_client() -> "httpx.AsyncClient":
+    import httpx
+
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            transport=_transport,
+            verify=ssl_context(),
+            timeout=httpx.Timeout(UPSTREAM_TIMEOUT, connect=UPSTREAM_CONNECT_TIMEOUT),
+            limits=httpx.Limits(max_connections=UPSTREAM_MAX_CONNECTIONS,
+                                max_keepalive_connections=UPSTREAM_MAX_CONNECTIONS,
+                                keepalive_expiry=60),
+        )
+    return _client
+
+
+def blocking_session() -> "requests.Session":
+    """Process-wide `requests.Session` for `post_blocking`, created on first use."""
+    import requests
+    from requests.adapters import HTTPAdapter
+
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = requests.Session()
+            # Keep as many connections per host as the async client does
+            _session.mount("https://", HTTPAdapter(pool_maxsize=UPSTREAM_MAX_CONNECTIONS))
+        return _session
+
+
+def _drop_session():
+    # Pooled sockets must not be shared with a forked child
+    global _session, _session_lock
+    _session, _session_lock = None, threading.Lock()
+
+
+os.register_at_fork(after_in_child=_drop_session)
+
+
+def _get_semaphore() -> asyncio.Semaphore:
+    global _semaphore
+    if _semaphore is None:
+        _semaphore = asyncio.Semaphore(UPSTREAM_CONCURRENCY)
+    return _semaphore
+
+
+class _Call:
+    """Retry, rate-limit and breaker bookkeeping for one logical upstream call."""
+
+    def __init__(self, url: str, timeout: Optional[float]):
+        self.url = url
+        self.service = metrics.upstream_service(url)
+        self.guard = _guard(self.service)
+        self.deadline = resilience.current_deadline()
+        self.timeout = UPSTREAM_TIMEOUT if timeout is None else timeout
+        self.attempt = 0
+
+    def _reject(self, reason: str) -> UpstreamUnavailable:
+        metrics.UPSTREAM_REJECTED.inc(service=self.service, reason=reason)
+        return UpstreamUnavailable(self.service, reason)
+
+    def remaining(self) -> float:
+        return self.deadline - time.monotonic()
+
+    def admit(self) -> float:
+        """Check the breaker and take a rate-limit token; returns seconds to wait for it."""
+        if not self.guard.breaker.allow():
+            raise self._reject("circuit_open")
+        if self.remaining() <= 0:
+            raise self._reject("deadline")
+        if self.guard.bucket is None:
+            return 0.0
+        wait = self.guard.bucket.reserve(min(resilience.queue_seconds(), self.remaining()))
+        if wait is None:
+            raise self._reject("rate_limited")
+        return wait
+
+    def queue_timeout(self) -> float:
+        return max(0.0, min(resilience.queue_seconds(), self.remaining()))
+
+    def busy(self) -> UpstreamUnavailable:
+        return self._reject("queue_full")
+
+    def attempt_timeout(self) -> float:
+        return max(0.001, min(self.timeout, self.remaining()))
+
+    def retry_delay(self, response) -> Optional[float]:
+        """
+        None if this attempt's outcome is final (any response but 429/5xx);
+        otherwise the backoff before the next attempt. `response` is None after a
+        transport error. Raises `UpstreamUnavailable` once retries or the deadline
+        are used up.
+        """
+        if response is not None and response.status_code not in resilience.RETRY_STATUSES:
+            self.guard.breaker.record_success()
+            return None
+        self.guard.breaker.record_failure()
+        metrics.CIRCUIT_OPEN.set(int(self.guard.breaker.state == "open"), service=self.service)
+        self.attempt += 1
+        retry_after = response.headers.get("Retry-After") if response is not None else None
+        delay = resilience.backoff(self.attempt, resilience.retry_after_seconds(retry_after))
+        if self.attempt > resilience.UPSTREAM_RETRIES or delay >= self.remaining():
+            raise self._reject("retries_exhausted" if response is not None else "unreachable")
+        metrics.UPSTREAM_RETRIES.inc(service=self.service)
+        return delay
+
+    def succeeded(self):
+        metrics.CIRCUIT_OPEN.set(0, service=self.service)
+
+
+async def _send(method: str, url: str, timeout: Optional[float], **kwargs) -> "httpx.Response":
+    import httpx
+
+    call = _Call(url, timeout)
+    while True:
+        await asyncio.sleep(call.admit())
+        try:
+            await asyncio.wait_for(_get_semaphore().acquire(), call.queue_timeout())
+        except asyncio.TimeoutError:
+            raise call.busy() from None
+        started, response, error = time.perf_counter(), None, None
+        try:
+            attempt_timeout = call.attempt_timeout()
+            response = await get_client().request(
+                method, url, **kwargs,
+                timeout=httpx.Timeout(attempt_timeout,
+                                      connect=min(UPSTREAM_CONNECT_TIMEOUT, attempt_timeout)))
+        except httpx.TransportError as e:
+            error = e
+        except httpx.HTTPError as e:
+            raise UpstreamHTTPError(str(e)) from e
+        finally:
+            _get_semaphore().release()
+            _record(url, started, response)
+        try:
+            delay = call.retry_delay(response)
+        except UpstreamUnavailable as e:
+            raise e from (error or _status_error(url, response))
+        if delay is None:
+            call.succeeded()
+            if response.status_code >= 400:
+                raise _status_error(url, response)
+            return response
+        await asyncio.sleep(delay)
+
+
+async def post(url: str, *, json: Any, headers: Dict[str, str],
+               timeout: Optional[float] = None) -> "httpx.Response":
+    """POST through the shared pool; `UpstreamHTTPError` on 4xx, `UpstreamUnavailable` when retries fail."""
+    return await _send("POST", url, timeout, json=json, headers=headers)
+
+
+async def get(url: str, *, params: Dict[str, Any],
+              timeout: Optional[float] = None) -> "httpx.Response":
+    """GET through the shared pool; `UpstreamHTTPError` on 4xx, `UpstreamUnavailable` when retries fail."""
+    return await _send("GET", url, timeout, params=params)
+
+
+def post_blocking(url: str, *, json: Any, headers: Dict[str, str],
+                  timeout: float) -> "requests.Response":
+    """`post` for the Flask app, over the shared `blocking_session`."""
+    import requests
+
+    session = blocking_session()
+    call = _Call(url, timeout)
+    while True:
+        time.sleep(call.admit())
+        if not _blocking_slots.acquire(timeout=call.queue_timeout()):
+            raise call.busy()
+        started, response, error = time.perf_counter(), None, None
+        try:
+            attempt_timeout = call.attempt_timeout()
+            response = session.post(url, json=json, headers=headers,
+                                    timeout=(min(UPSTREAM_CONNECT_TIMEOUT, attempt_timeout),
+                                             attempt_timeout))
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+            error = e
+        except requests.exceptions.RequestException as e:
+            raise UpstreamHTTPError(str(e)) from e
+        finally:
+            _blocking_slots.release()
+            _record(url, started, response)
+        try:
+            delay = call.retry_delay(response)
+        except UpstreamUnavailable as e:
+            raise e from (error or _status_error(url, response))
+        if delay is None:
+            call.succeeded()
+            if response.status_code >= 400:
+                raise _status_error(url, response)
+            return response
+        time.sleep(delay)
+
+
+def _record(url: str, started: float, response):
+    if response is None:
+        metrics.record_upstream(url, "error", time.perf_counter() - started)
+        return
+    # httpx requests carry `.content`, requests' prepared requests `.body`
+    request = response.request
+    body = getattr(request, "content", None) or getattr(request, "body", None) or b""
+    metrics.record_upstream(url, str(response.status_code), time.perf_counter() - started,
+                            sent=len(body), received=len(response.content))
+
+
+async def aclose():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
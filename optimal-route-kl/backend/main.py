@@ -1,8 +1,46 @@
-from typing import List, Optional
-from fastapi import FastAPI, HTTPExceptionrom pydantic import BaseModel
+import asyncio
+import json
+import os
+from contextlib import asynccontextmanager
+from typing import List, Literal, Optional
+
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from pydantic import BaseModel
+
+import batch
+import cache
+import geocoding
+import http_client
+import metrics
+import resilience
+import responses
+import sessions
+import solver
+import startup
+import vrp
+from advisory import advisory_status, get_llm_analysis_and_buffer_async, start_advisory
+from resilience import UpstreamUnavailable
+from routes_api import (DEGRADED_NOTICE, ROUTES_MAX_INTERMEDIATES, compute_routes_async,
+                        degraded_fields, fallback_matrix, fallback_route,
+                        fetch_travel_time_matrix_async, parse_duration, resolve_stops_async,
+                        summarize_matrix_route, summarize_route, tile_count)
+
+
+# Imported on the first request otherwise (anyio loads its event-loop backend lazily)
+WARM_IMPORTS = ("anyio._backends._asyncio",)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    startup.start(imports=WARM_IMPORTS)
+    yield
+    await http_client.aclose()
+    batch.shutdown()
+
 
-app = FastAPI(title="Optimal Route Mock API")
+app = FastAPI(title="Optimal Route API", lifespan=lifespan)
 
 # Allow CORS for local dev and deployed frontend
 app.add_middleware(
@@ -14,10 +52,80 @@ app.add_middleware(
 )
 
 
+# Never shed (health checks, scrapes) / not bound by REQUEST_DEADLINE (streams many jobs)
+_ALWAYS_SERVED = ("/metrics", "/api/status", "/api/ready")
+_NO_DEADLINE = ("/api/optimize/batch",)
+
+
+@app.middleware("http")
+async def track_requests(request: Request, call_next):
+    """
+    Request count, latency and in-flight gauge per route template (see metrics.py).
+    Past MAX_IN_FLIGHT_REQUESTS new requests get a 503; the rest run under REQUEST_DEADLINE.
+    """
+    path = request.url.path
+    if path not in _ALWAYS_SERVED and resilience.overloaded(metrics.IN_FLIGHT.value(app="fastapi")):
+        metrics.SHED.inc(app="fastapi")
+        return JSONResponse({'error': 'Server is busy, retry shortly.'}, status_code=503,
+                            headers={'Retry-After': '1'})
+    timer = metrics.RequestTimer("fastapi", request.method)
+    status_code = 500
+    try:
+        if path in _NO_DEADLINE:
+            response = await call_next(request)
+        else:
+            with resilience.deadline():
+                response = await call_next(request)
+        status_code = response.status_code
+        return response
+    finally:
+        route = request.scope.get("route")
+        timer.finish(route.path if route is not None else "unmatched", status_code)
+
+
 class OptimizeRequest(BaseModel):
     locations: List[str]  # address strings or "lat,lng"
 
 
+class BatchOptimizeRequest(BaseModel):
+    jobs: List[OptimizeRequest]
+
+
+class Vehicle(BaseModel):
+    start_location: str
+    capacity: int = 4  # free seats
+    name: Optional[str] = None
+
+
+class Pickup(BaseModel):
+    location: str
+    seats: int = 1
+    # Optional arrival window, in minutes after departure
+    earliest_minutes: Optional[float] = None
+    latest_minutes: Optional[float] = None
+
+
+class FleetRequest(BaseModel):
+    vehicles: List[Vehicle]
+    pickups: List[Pickup]
+    final_destination: str
+    time_limit_seconds: float = vrp.DEFAULT_TIME_LIMIT
+
+
+class SessionEvent(BaseModel):
+    type: Literal["add_stop", "drop_stop", "update_leg"]
+    location: Optional[str] = None         # add_stop / drop_stop
+    from_location: Optional[str] = None    # update_leg
+    to_location: Optional[str] = None
+    minutes: Optional[float] = None
+
+
+class OptimizeRouteRequest(BaseModel):
+    start_location: Optional[str] = None
+    final_destination: Optional[str] = None
+    friend_locations: List[str] = []
+
+
 class Coordinate(BaseModel):
     lat: float
     lng: float
@@ -35,23 +143,12 @@ class OptimizeResponse(BaseModel):
 
 def parse_location(loc: str) -> Coordinate:
     """
-    Very small helper: if input is "lat,lng" parse it.
+    Very small helper: if input is "lat,lng" parse it, or look it up in the gazetteer.
     For other strings, generate a deterministic fake coordinate for mocking.
     """
-    try:
-        if "," in loc:
-            parts = loc.split(",")
-            lat = float(parts[0].strip())
-            lng = float(parts[1].strip())
-            return Coordinate(lat=lat, lng=lng)
-    except Exception:
-        pass
-
-    # Mock deterministic coords based on hash of string (keeps results stable for testing)
-    h = abs(hash(loc))
-    lat = 1.0 + (h % 9000) / 1000.0  # example pseudo-lat
-    lng = 101.0 + (h % 18000) / 1000.0  # example pseudo-lng
-    return Coordinate(lat=lat, lng=lng)
+    coord = (geocoding.parse_coordinate(loc) or geocoding.get_gazetteer().lookup(loc)
+             or geocoding.stable_coordinate(loc))
+    return Coordinate(**coord)
 
 
 @app.post("/optimize", response_model=OptimizeResponse)
@@ -61,4 +158,439 @@ async def optimize(req: OptimizeRequest):
     points = [RoutePoint(input=loc, coord=parse_location(loc)) for loc in req.locations]
 
     # Very simple mock "optimization": keep order as-is but mark as route
-    return OptimizeResponse(route=points, summary=f"Mock route for {len(points)} points")
\ No newline at end of file
+    return OptimizeResponse(route=points, summary=f"Mock route for {len(points)} points")
+
+
+def _maps_key() -> Optional[str]:
+    return os.environ.get("MAPS_API_KEY")
+
+
+def _error(message: str, status_code: int = 500, **extra) -> JSONResponse:
+    return JSONResponse({'error': message, **extra}, status_code=status_code)
+
+
+def _respond(request: Request, body, compact: bool = False) -> Response:
+    with metrics.stage("serialize"):
+        data, headers = responses.encode(body, request.headers.get("accept-encoding", ""), compact)
+    return Response(data, headers=headers)
+
+
+def _upstream_error(http_err: http_client.UpstreamHTTPError) -> JSONResponse:
+    if http_err.response is None:
+        error_details = str(http_err)
+    else:
+        try:
+            error_details = http_err.response.json()
+        except ValueError:
+            error_details = http_err.response.text
+    return _error("An HTTP error occurred while calling the Routes API.", details=error_details)
+
+
+async def _fallback_summary(locations: List[str], route: str) -> dict:
+    """Straight-line route for when an upstream is unavailable (see `routes_api.fallback_route`)."""
+    metrics.DEGRADED.inc(app="fastapi", route=route)
+    with metrics.stage("fallback"):
+        return await asyncio.to_thread(fallback_route, locations)
+
+
+def _degraded(estimated_tiles: int, route: str) -> dict:
+    """`routes_api.degraded_fields`, counting the response in DEGRADED when it is flagged."""
+    if estimated_tiles:
+        metrics.DEGRADED.inc(app="fastapi", route=route)
+    return degraded_fields(estimated_tiles)
+
+
+async def solve_waypoint_order(locations: List[str]):
+    """
+    Async counterpart of `app.solve_waypoint_order` for [start, *waypoints, destination].
+    Addresses are geocoded concurrently and the solver runs off the event loop.
+    Also returns how many matrix tiles were estimated rather than fetched.
+    """
+    with metrics.stage("geocode"):
+        stops = await resolve_stops_async(locations, _maps_key())
+    resolved = [wp for _, wp in stops]
+    if len(locations) < 4:
+        return list(range(len(locations) - 2)), resolved, 0
+    with metrics.stage("matrix"):
+        durations, _, estimated = await fetch_travel_time_matrix_async(stops, _maps_key())
+    with metrics.stage("solve"):
+        order = await asyncio.to_thread(solver.solve, durations)
+    return [idx - 1 for idx in order[1:-1]], resolved, estimated
+
+
+async def _matrix_summary(locations: List[str]):
+    """
+    Route built from the travel-time matrix alone, for stop counts a single
+    computeRoutes call does not accept (more than ROUTES_MAX_INTERMEDIATES waypoints).
+    Returns (summary, estimated matrix tiles).
+    """
+    with metrics.stage("geocode"):
+        stops = await resolve_stops_async(locations, _maps_key())
+    with metrics.stage("matrix"):
+        durations, distances, estimated = await fetch_travel_time_matrix_async(stops, _maps_key())
+    with metrics.stage("solve"):
+        order = await asyncio.to_thread(solver.solve, durations)
+    with metrics.stage("summarize"):
+        return summarize_matrix_route(locations, stops, order, durations, distances), estimated
+
+
+@app.get("/metrics")
+async def get_metrics():
+    """Prometheus scrape endpoint."""
+    return Response(metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+
+@app.get("/api/ready")
+async def ready():
+    """Readiness probe: 503 until startup warm-up has finished (see startup.py)."""
+    return JSONResponse(startup.status(), status_code=200 if startup.is_ready() else 503)
+
+
+@app.get("/api/status")
+async def status():
+    if not _maps_key():
+        return JSONResponse({
+            "status": "Backend is running, but no Google Maps API key is configured.",
+            "error": "Check the MAPS_API_KEY environment variable. It is likely missing or invalid."
+        }, status_code=500)
+    return {
+        "status": "Backend is running and Google Maps API key is configured.",
+        "cache": cache.all_stats(),
+        "upstream": http_client.breaker_states(),
+    }
+
+
+@app.post("/api/optimize")
+async def api_optimize(req: OptimizeRequest, request: Request):
+    """
+    Same contract as the Flask `/api/optimize`, served on the async pipeline.
+    `?view=compact` returns the order, leg times and polylines only.
+    """
+    compact = responses.wants_compact(request.query_params, request.headers)
+    if not _maps_key():
+        return _error('Google Maps API key is not configured.')
+    locations = req.locations
+    if not locations or len(locations) < 2:
+        return _error('Provide at least two locations', 400)
+
+    waypoints = locations[1:-1]
+    try:
+        if len(waypoints) > ROUTES_MAX_INTERMEDIATES:
+            summary, estimated = await _matrix_summary(locations)
+            body = responses.compact_from_summary(summary) if compact else summary
+            return _respond(request, {**body, **_degraded(estimated, "/api/optimize")}, compact)
+        optimized_order, resolved, estimated = await solve_waypoint_order(locations)
+        payload = {
+            "origin": resolved[0],
+            "destination": resolved[-1],
+            "travelMode": "DRIVE",
+        }
+        if waypoints:
+            payload["intermediates"] = [resolved[idx + 1] for idx in optimized_order]
+
+        field_mask = responses.COMPACT_FIELD_MASK if compact else responses.OPTIMIZE_FIELD_MASK
+        with metrics.stage("compute_routes"):
+            directions_result = await compute_routes_async(payload, field_mask, _maps_key())
+        if not directions_result or not directions_result.get('routes'):
+            return _error('Could not calculate the route using Routes API')
+
+        inputs = [locations[0], *(waypoints[idx] for idx in optimized_order), locations[-1]]
+        route_data = directions_result['routes'][0]
+        with metrics.stage("summarize"):
+            body = (responses.compact_from_directions(route_data, inputs) if compact
+                    else summarize_route(route_data, inputs))
+        return _respond(request, {**body, **_degraded(estimated, "/api/optimize")}, compact)
+
+    except UpstreamUnavailable:
+        summary = await _fallback_summary(locations, "/api/optimize")
+        body = responses.compact_from_summary(summary) if compact else summary
+        return _respond(request, {**body, 'degraded': True, 'notice': DEGRADED_NOTICE}, compact)
+    except http_client.UpstreamHTTPError as http_err:
+        return _upstream_error(http_err)
+    except Exception as e:
+        return _error(str(e))
+
+
+@app.post("/api/optimize/batch")
+async def api_optimize_batch(req: BatchOptimizeRequest, request: Request):
+    """
+    Optimize many pickup groups at once. Streams one NDJSON line per job, in
+    completion order, each tagged with the job's `index` in the request.
+    """
+    compact = responses.wants_compact(request.query_params, request.headers)
+    if not _maps_key():
+        return _error('Google Maps API key is not configured.')
+    if not req.jobs:
+        return _error('Provide at least one job', 400)
+    if len(req.jobs) > batch.BATCH_MAX_JOBS:
+        return _error(f'A batch may contain at most {batch.BATCH_MAX_JOBS} jobs', 400)
+    return StreamingResponse(
+        batch.stream_batch([job.locations for job in req.jobs], _maps_key(), compact),
+        media_type="application/x-ndjson",
+    )
+
+
+@app.post("/api/optimize/fleet")
+async def api_optimize_fleet(req: FleetRequest):
+    """
+    Multi-vehicle mode: assign pickups to drivers within their seat capacity and
+    any pickup time windows, returning one route per vehicle.
+    """
+    if not _maps_key():
+        return _error('Google Maps API key is not configured.')
+    if not req.vehicles or not req.pickups:
+        return _error('Provide at least one vehicle and one pickup', 400)
+
+    k, n_pickups = len(req.vehicles), len(req.pickups)
+    locations = [v.start_location for v in req.vehicles] + [p.location for p in req.pickups] \
+        + [req.final_destination]
+    end = len(locations) - 1
+    windows = [
+        None if p.earliest_minutes is None and p.latest_minutes is None else (
+            None if p.earliest_minutes is None else p.earliest_minutes * 60,
+            None if p.latest_minutes is None else p.latest_minutes * 60,
+        )
+        for p in req.pickups
+    ]
+    try:
+        try:
+            stops = await resolve_stops_async(locations, _maps_key())
+            durations, distances, estimated = await fetch_travel_time_matrix_async(stops, _maps_key())
+        except UpstreamUnavailable as e:
+            # Assign on straight-line estimates rather than not at all
+            print(f"Fleet routing on straight-line estimates: {e}")
+            with metrics.stage("fallback"):
+                stops, durations, distances = await asyncio.to_thread(fallback_matrix, locations)
+            estimated = tile_count(len(stops), len(stops))
+        routes, unassigned = await asyncio.to_thread(
+            vrp.solve, durations,
+            starts=list(range(k)),
+            ends=[end] * k,
+            pickups=list(range(k, k + n_pickups)),
+            demands=[p.seats for p in req.pickups],
+            capacities=[v.capacity for v in req.vehicles],
+            windows=windows,
+            time_limit=min(max(req.time_limit_seconds, 0.0), 5.0),
+        )
+    except http_client.UpstreamHTTPError as http_err:
+        return _upstream_error(http_err)
+    except Exception as e:
+        return _error(str(e))
+
+    vehicle_routes = [
+        {
+            'vehicle': v,
+            'name': req.vehicles[v].name,
+            'seats_used': sum(req.pickups[node - k].seats for node in route[1:-1]),
+            **summarize_matrix_route(locations, stops, route, durations, distances),
+        }
+        for v, route in enumerate(routes)
+    ]
+    return {
+        'routes': vehicle_routes,
+        'unassigned': [locations[node] for node in unassigned],
+        'total_time_minutes': round(sum(r['total_time_minutes'] for r in vehicle_routes), 1),
+        **_degraded(estimated, "/api/optimize/fleet"),
+    }
+
+
+def _session_snapshot(snapshot: dict, route: str) -> dict:
+    """Count snapshots of sessions running on straight-line estimates in DEGRADED."""
+    if snapshot.get('degraded'):
+        metrics.DEGRADED.inc(app="fastapi", route=route)
+    return snapshot
+
+
+@app.post("/api/sessions")
+async def create_session(req: OptimizeRequest):
+    """Start a live session: solve once and keep the matrix and tour in memory."""
+    if not _maps_key():
+        return _error('Google Maps API key is not configured.')
+    if not req.locations or len(req.locations) < 2:
+        return _error('Provide at least two locations', 400)
+    try:
+        session = await sessions.RouteSession.create(req.locations, _maps_key())
+    except http_client.UpstreamHTTPError as http_err:
+        return _upstream_error(http_err)
+    return _session_snapshot(session.snapshot(), "/api/sessions")
+
+
+@app.get("/api/sessions/{session_id}")
+async def get_session(session_id: str):
+    session = sessions.get(session_id)
+    if session is None:
+        return _error('Unknown or expired session', 404)
+    return session.snapshot()
+
+
+@app.delete("/api/sessions/{session_id}")
+async def close_session(session_id: str):
+    if not sessions.close(session_id):
+        return _error('Unknown or expired session', 404)
+    return {'status': 'closed'}
+
+
+@app.post("/api/sessions/{session_id}/events")
+async def session_event(session_id: str, event: SessionEvent):
+    """Apply one delta (add/drop a stop, update a leg) and return the repaired route."""
+    session = sessions.get(session_id)
+    if session is None:
+        return _error('Unknown or expired session', 404)
+    try:
+        if event.type == "add_stop" and event.location:
+            snapshot = await session.add_stop(event.location, _maps_key())
+        elif event.type == "drop_stop" and event.location:
+            snapshot = await session.drop_stop(event.location)
+        elif event.type == "update_leg" and event.from_location and event.to_location \
+                and event.minutes is not None:
+            snapshot = await session.update_leg(event.from_location, event.to_location,
+                                                event.minutes)
+        else:
+            return _error(f'Missing fields for {event.type} event', 400)
+        return _session_snapshot(snapshot, "/api/sessions/events")
+    except ValueError as e:
+        return _error(str(e), 400)
+    except http_client.UpstreamHTTPError as http_err:
+        return _upstream_error(http_err)
+
+
+@app.get("/api/sessions/{session_id}/stream")
+async def stream_session(session_id: str, request: Request):
+    """Server-sent events: the current route, then every update as it happens."""
+    session = sessions.get(session_id)
+    if session is None:
+        return _error('Unknown or expired session', 404)
+
+    async def events():
+        queue = session.subscribe()
+        try:
+            yield f"data: {json.dumps(session.snapshot())}\n\n"
+            while not await request.is_disconnected():
+                try:
+                    snapshot = await asyncio.wait_for(queue.get(), timeout=15)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                yield f"data: {json.dumps(snapshot)}\n\n"
+        finally:
+            session.unsubscribe(queue)
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+async def _advisory_fields(route_sequence: List[str], background: bool) -> dict:
+    """The `llm_*` response fields; in background mode, pending ones come with an `advisory_id`."""
+    extra = {}
+    if background:
+        advisory_id, llm_result = start_advisory(route_sequence)
+        extra['advisory_id'] = advisory_id
+        if llm_result is None:
+            return {'llm_analysis': None, 'llm_buffer_minutes': None, **extra}
+    else:
+        with metrics.stage("advisory"):
+            llm_result = await get_llm_analysis_and_buffer_async(route_sequence)
+    return {'llm_analysis': llm_result['analysis'],
+            'llm_buffer_minutes': llm_result['buffer_minutes'], **extra}
+
+
+@app.get("/api/advisory/{advisory_id}")
+async def get_advisory(advisory_id: str):
+    """Poll a background advisory started by `/api/optimize_route?advisory=background`."""
+    status = advisory_status(advisory_id)
+    if status is None:
+        return _error('Advisory not found or expired', 404)
+    return status
+
+
+async def _summary_route_response(request: Request, summary: dict, compact: bool, background: bool,
+                                  **extra) -> Response:
+    """`/api/optimize_route` body from a matrix summary: no computeRoutes `directions`."""
+    optimized_sequence = [point['input'] for point in summary['route']]
+    llm_fields = await _advisory_fields(optimized_sequence, background)
+    if compact:
+        body = responses.compact_from_summary(summary)
+    else:
+        body = {'optimal_sequence': optimized_sequence,
+                'total_time_minutes': summary['total_time_minutes'], 'directions': None}
+    return _respond(request, {'status': 'success', **body, **llm_fields, **extra}, compact)
+
+
+@app.post("/api/optimize_route")
+async def api_optimize_route(req: OptimizeRouteRequest, request: Request):
+    """
+    Same contract as the Flask `/api/optimize_route`. The LLM advisory only needs
+    the solved order, so it runs concurrently with the computeRoutes call.
+    `?view=compact` replaces the raw `directions` payload with polylines.
+    `?advisory=background` returns without waiting for the LLM; poll
+    `/api/advisory/{advisory_id}` for it.
+    """
+    compact = responses.wants_compact(request.query_params, request.headers)
+    background = request.query_params.get('advisory') == 'background'
+    if not _maps_key():
+        return _error('Google Maps API key is not configured.')
+    if not req.start_location or not req.final_destination:
+        return _error('Start and final destination are required', 400)
+
+    waypoints = req.friend_locations
+    try:
+        if len(waypoints) > ROUTES_MAX_INTERMEDIATES:
+            summary, estimated = await _matrix_summary(
+                [req.start_location, *waypoints, req.final_destination])
+            return await _summary_route_response(request, summary, compact, background,
+                                                 **_degraded(estimated, "/api/optimize_route"))
+        optimized_order, resolved, estimated = await solve_waypoint_order(
+            [req.start_location, *waypoints, req.final_destination]
+        )
+        optimized_sequence = [req.start_location, *(waypoints[i] for i in optimized_order),
+                              req.final_destination]
+        payload = {
+            "origin": resolved[0],
+            "destination": resolved[-1],
+            "intermediates": [resolved[i + 1] for i in optimized_order],
+            "travelMode": "DRIVE",
+        }
+
+        advisory_task = asyncio.ensure_future(_advisory_fields(optimized_sequence, background))
+        try:
+            with metrics.stage("compute_routes"):
+                directions_result = await compute_routes_async(payload, responses.TOTALS_FIELD_MASK,
+                                                               _maps_key())
+        except BaseException:
+            advisory_task.cancel()
+            raise
+        if not directions_result or not directions_result.get('routes'):
+            advisory_task.cancel()
+            return _error('Could not calculate the route using Routes API')
+
+        duration_str = directions_result['routes'][0].get('duration', "0s")
+        total_time_minutes = round(parse_duration(duration_str) / 60, 1)
+        llm_fields = await advisory_task
+
+        degraded = _degraded(estimated, "/api/optimize_route")
+        if compact:
+            return _respond(request, {
+                'status': 'success',
+                **responses.compact_from_directions(directions_result['routes'][0],
+                                                    optimized_sequence),
+                **llm_fields,
+                **degraded,
+            }, True)
+        return _respond(request, {
+            'status': 'success',
+            'optimal_sequence': optimized_sequence,
+            'total_time_minutes': total_time_minutes,
+            **llm_fields,
+            **degraded,
+            'directions': directions_result  # Keep raw data for frontend map rendering
+        })
+
+    except UpstreamUnavailable:
+        locations = [req.start_location, *waypoints, req.final_destination]
+        summary = await _fallback_summary(locations, "/api/optimize_route")
+        return await _summary_route_response(request, summary, compact, background,
+                                             degraded=True, notice=DEGRADED_NOTICE)
+    except http_client.UpstreamHTTPError as http_err:
+        return _upstream_error(http_err)
+    except Exception as e:
+        return _error(str(e))
@@ -0,0 +1,315 @@
+"""
+Request tracing and hot-path instrumentation for the Flask and FastAPI apps.
+
+Keeps counters, gauges and histograms in process and renders them in the
+Prometheus text format on `/metrics`, with no client library required:
+
+- http_requests_total / http_request_duration_seconds / http_requests_in_flight
+- stage_duration_seconds{stage}: request parsing, geocoding, matrix, solve,
+  computeRoutes, advisory, summarizing and serialization (`stage()` blocks)
+- upstream_requests_total / upstream_duration_seconds / upstream_*_bytes_total
+  per upstream service (`record_upstream`, called from `http_client`)
+- upstream_retries_total / upstream_rejected_total / upstream_circuit_open
+  from the rate limiter, retries and circuit breakers (`resilience`)
+- matrix_tiles_total{result}: computeRouteMatrix tiles fetched or estimated
+- degraded_responses_total / http_requests_shed_total: fallback routes and
+  requests refused by the in-flight limit
+- cache_* from `cache.all_stats()`, collected when scraped
+
+Each process (uvicorn worker, gunicorn worker) keeps its own numbers.
+
+With PROFILE_SLOW_MS set, `SlowRequestProfiler` samples the stacks of threads
+that are serving requests every PROFILE_INTERVAL_MS and, when a request takes
+longer than the threshold, writes them to PROFILE_DIR in collapsed
+("folded") format for flamegraph.pl or speedscope. In the async app every
+request shares the event-loop thread, so its samples show everything the
+loop ran while the slow request was open.
+"""
+import os
+import sys
+import threading
+import time
+from collections import Counter as _Tally
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import cache
+
+CONTENT_TYPE = "text/plain; version=0.0.4"
+
+# Seconds; spans cache hits (sub-ms) to slow LLM calls.
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+LabelValues = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        return tuple(str(labels.get(n, "")) for n in self.labelnames)
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_labels(self.labelnames, k)} {v:g}" for k, v in items]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+        # label values -> [count per bucket..., +Inf count, sum]
+        self._values: Dict[LabelValues, List[float]] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            row = self._values.get(key)
+            if row is None:
+                row = self._values[key] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    row[i] += 1
+            row[-2] += 1
+            row[-1] += value
+
+    def count(self, **labels) -> int:
+        row = self._values.get(self._key(labels))
+        return int(row[-2]) if row else 0
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = sorted((k, list(v)) for k, v in self._values.items())
+        lines = []
+        for key, row in items:
+            for bound, n in zip((*self.buckets, "+Inf"), row):
+                le = 'le="%s"' % (bound if isinstance(bound, str) else f"{bound:g}")
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, le)} {n:g}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {row[-2]:g}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {row[-1]:.6f}")
+        return lines
+
+
+REQUESTS = Counter("http_requests_total", "HTTP requests served.",
+                   ("app", "route", "method", "status"))
+REQUEST_SECONDS = Histogram("http_request_duration_seconds", "Time to produce a response.",
+                            ("app", "route"))
+IN_FLIGHT = Gauge("http_requests_in_flight", "Requests currently being served.", ("app",))
+STAGE_SECONDS = Histogram("stage_duration_seconds", "Time spent in each request stage.", ("stage",))
+UPSTREAM_REQUESTS = Counter("upstream_requests_total", "Calls to upstream APIs.", ("service", "status"))
+UPSTREAM_SECONDS = Histogram("upstream_duration_seconds", "Upstream call latency.", ("service",))
+UPSTREAM_SENT = Counter("upstream_request_bytes_total", "Request body bytes sent upstream.", ("service",))
+UPSTREAM_RECEIVED = Counter("upstream_response_bytes_total", "Response body bytes received from upstream.",
+                            ("service",))
+UPSTREAM_RETRIES = Counter("upstream_retries_total", "Upstream attempts retried after a 429/5xx or "
+                           "transport error.", ("service",))
+UPSTREAM_REJECTED = Counter("upstream_rejected_total", "Upstream calls refused or abandoned locally.",
+                            ("service", "reason"))
+CIRCUIT_OPEN = Gauge("upstream_circuit_open", "1 while the service's circuit breaker is open.", ("service",))
+MATRIX_TILES = Counter("matrix_tiles_total", "computeRouteMatrix tiles fetched, or estimated from "
+                       "straight-line distances when the call failed.", ("result",))
+DEGRADED = Counter("degraded_responses_total", "Responses built locally because an upstream was "
+                   "unavailable.", ("app", "route"))
+SHED = Counter("http_requests_shed_total", "Requests refused with 503 by the in-flight limit.", ("app",))
+SLOW_PROFILES = Counter("slow_request_profiles_total", "Slow-request stack profiles written.", ("route",))
+
+_METRICS: List[_Metric] = [REQUESTS, REQUEST_SECONDS, IN_FLIGHT, STAGE_SECONDS, UPSTREAM_REQUESTS,
+                           UPSTREAM_SECONDS, UPSTREAM_SENT, UPSTREAM_RECEIVED, UPSTREAM_RETRIES,
+                           UPSTREAM_REJECTED, CIRCUIT_OPEN, MATRIX_TILES, DEGRADED, SHED, SLOW_PROFILES]
+
+
+def _cache_lines() -> List[str]:
+    stats = cache.all_stats()
+    lines = []
+    for metric, field, kind, doc in (
+        ("cache_hits_total", "hits", "counter", "Cache lookups that found a fresh entry."),
+        ("cache_misses_total", "misses", "counter", "Cache lookups that missed."),
+        ("cache_evictions_total", "evictions", "counter", "Entries evicted to stay under maxsize."),
+        ("cache_entries", "size", "gauge", "Entries held in memory."),
+        ("cache_hit_ratio", "hit_rate", "gauge", "Hits over lookups since start."),
+    ):
+        lines += [f"# HELP {metric} {doc}", f"# TYPE {metric} {kind}"]
+        lines += [f'{metric}{{cache="{name}"}} {s[field]:g}' for name, s in sorted(stats.items())]
+    return lines
+
+
+def render() -> str:
+    lines: List[str] = []
+    for metric in _METRICS:
+        lines += metric.header() + metric.render()
+    lines += _cache_lines()
+    return "\n".join(lines) + "\n"
+
+
+@contextmanager
+def stage(name: str):
+    """Time a block of request work under stage_duration_seconds{stage=name}."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - started, stage=name)
+
+
+def upstream_service(url: str) -> str:
+    if ":computeRouteMatrix" in url:
+        return "route_matrix"
+    if ":computeRoutes" in url:
+        return "compute_routes"
+    if "/geocode/" in url:
+        return "geocode"
+    if "/chat/completions" in url:
+        return "openrouter"
+    return "other"
+
+
+def record_upstream(url: str, status: str, seconds: float, sent: int = 0, received: int = 0):
+    """Count one upstream call; `status` is the HTTP status code or "error"."""
+    service = upstream_service(url)
+    UPSTREAM_REQUESTS.inc(service=service, status=status)
+    UPSTREAM_SECONDS.observe(seconds, service=service)
+    UPSTREAM_SENT.inc(sent, service=service)
+    UPSTREAM_RECEIVED.inc(received, service=service)
+
+
+class SlowRequestProfiler:
+    """Samples request threads' stacks; keeps them only for requests slower than `threshold_ms`."""
+
+    def __init__(self, threshold_ms: float, interval_ms: float = 5, out_dir: str = "/tmp/profiles"):
+        self.threshold = threshold_ms / 1000
+        self.interval = interval_ms / 1000
+        self.out_dir = out_dir
+        self._active: Dict[int, Tuple[int, _Tally]] = {}
+        self._next_token = 0
+        self._lock = threading.Lock()
+        self._sampler: Optional[threading.Thread] = None
+
+    def begin(self) -> int:
+        with self._lock:
+            self._next_token += 1
+            token = self._next_token
+            self._active[token] = (threading.get_ident(), _Tally())
+            if self._sampler is None:
+                self._sampler = threading.Thread(target=self._sample_forever, daemon=True,
+                                                 name="slow-request-profiler")
+                self._sampler.start()
+        return token
+
+    def end(self, token: int, route: str, seconds: float) -> Optional[str]:
+        """Stop sampling `token`; returns the profile path if the request was slow."""
+        with self._lock:
+            _, stacks = self._active.pop(token, (None, None))
+        if stacks is None or seconds < self.threshold or not stacks:
+            return None
+        os.makedirs(self.out_dir, exist_ok=True)
+        name = route.strip("/").replace("/", "_").replace("{", "").replace("}", "") or "root"
+        path = os.path.join(self.out_dir, f"{time.strftime('%Y%m%dT%H%M%S')}-{name}-"
+                                          f"{round(seconds * 1000)}ms-{token}.folded")
+        with open(path, "w") as f:
+            f.writelines(f"{stack} {n}\n" for stack, n in stacks.most_common())
+        SLOW_PROFILES.inc(route=route)
+        return path
+
+    def _sample_forever(self):
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                active = list(self._active.values())
+            if not active:
+                continue
+            frames = sys._current_frames()
+            for thread_id, stacks in active:
+                frame = frames.get(thread_id)
+                if frame is not None:
+                    stacks[_fold(frame)] += 1
+
+
+def _fold(frame) -> str:
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+def _profiler_from_env() -> Optional[SlowRequestProfiler]:
+    threshold = os.environ.get("PROFILE_SLOW_MS")
+    if not threshold:
+        return None
+    return SlowRequestProfiler(float(threshold), float(os.environ.get("PROFILE_INTERVAL_MS", 5)),
+                               os.environ.get("PROFILE_DIR", "/tmp/optimal-route-profiles"))
+
+
+profiler = _profiler_from_env()
+
+
+class RequestTimer:
+    """Per-request bookkeeping used by both apps' request hooks."""
+
+    __slots__ = ("app", "method", "started", "token")
+
+    def __init__(self, app: str, method: str):
+        self.app = app
+        self.method = method
+        self.started = time.perf_counter()
+        self.token = profiler.begin() if profiler is not None else None
+        IN_FLIGHT.inc(app=app)
+
+    def finish(self, route: str, status: int):
+        seconds = time.perf_counter() - self.started
+        IN_FLIGHT.dec(app=self.app)
+        REQUESTS.inc(app=self.app, route=route, method=self.method, status=str(status))
+        REQUEST_SECONDS.observe(seconds, app=self.app, route=route)
+        if self.token is not None:
+            profiler.end(self.token, route, seconds)
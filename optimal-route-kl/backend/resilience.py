@@ -0,0 +1,228 @@
+"""
+Rate limiting, circuit breaking and deadlines for upstream calls.
+
+`http_client` keeps one `TokenBucket` and one `CircuitBreaker` per upstream
+service (see `metrics.upstream_service`) and checks both before every
+attempt:
+
+- the bucket refills at the service's quota (UPSTREAM_RATE_LIMITS, calls per
+  second) and lets a short burst through; a call that would have to queue for
+  a token longer than UPSTREAM_QUEUE_SECONDS is rejected instead of holding a
+  worker
+- the breaker opens after BREAKER_FAILURES consecutive 429/5xx/transport
+  failures, rejects calls for BREAKER_RESET_SECONDS, then lets a single probe
+  through; a successful probe closes it again
+- `deadline()` bounds the time a whole request may spend upstream, across
+  retries and every call it makes; both apps open one per request
+- bulk callers (batch jobs, CSV imports) keep only BULK_CONCURRENCY items in
+  flight and run them under `bulk()`, which lets their calls queue for a token
+  for up to BULK_QUEUE_SECONDS: a batch larger than the quota is paced at the
+  quota instead of being refused
+
+Rejected calls raise `UpstreamUnavailable`, which the endpoints answer with a
+locally computed route instead of an error.
+"""
+import contextvars
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+# Calls per second allowed per service; unlisted services are not limited.
+DEFAULT_RATE_LIMITS = "compute_routes=50,route_matrix=50,geocode=50,openrouter=5"
+UPSTREAM_RATE_LIMITS = os.environ.get("UPSTREAM_RATE_LIMITS", DEFAULT_RATE_LIMITS)
+# Bucket capacity, in seconds of quota.
+UPSTREAM_BURST_SECONDS = float(os.environ.get("UPSTREAM_BURST_SECONDS", 1))
+# Longest a call may wait for a rate-limit token or a free upstream slot.
+UPSTREAM_QUEUE_SECONDS = float(os.environ.get("UPSTREAM_QUEUE_SECONDS", 2))
+
+# Items a bulk caller works on at once, and how long their calls may queue for a token.
+BULK_CONCURRENCY = int(os.environ.get("BULK_CONCURRENCY", 8))
+BULK_QUEUE_SECONDS = float(os.environ.get("BULK_QUEUE_SECONDS", 30))
+
+# Retries after the first attempt, with full-jitter exponential backoff.
+UPSTREAM_RETRIES = int(os.environ.get("UPSTREAM_RETRIES", 2))
+UPSTREAM_BACKOFF_BASE = float(os.environ.get("UPSTREAM_BACKOFF_BASE", 0.2))
+UPSTREAM_BACKOFF_MAX = float(os.environ.get("UPSTREAM_BACKOFF_MAX", 2))
+
+BREAKER_FAILURES = int(os.environ.get("BREAKER_FAILURES", 5))
+BREAKER_RESET_SECONDS = float(os.environ.get("BREAKER_RESET_SECONDS", 30))
+
+# Upstream time budget for one API request, and for calls made outside one.
+REQUEST_DEADLINE = float(os.environ.get("REQUEST_DEADLINE", 25))
+# Requests served at once per process before new ones get a 503 (0 = no limit).
+MAX_IN_FLIGHT_REQUESTS = int(os.environ.get("MAX_IN_FLIGHT_REQUESTS", 0))
+
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+
+class UpstreamUnavailable(Exception):
+    """An upstream call was not made, or gave up, because the service is overloaded or down."""
+
+    def __init__(self, service: str, reason: str):
+        super().__init__(f"{service} unavailable: {reason}")
+        self.service = service
+        self.reason = reason
+
+
+def parse_rate_limits(spec: str) -> Dict[str, float]:
+    """Parse UPSTREAM_RATE_LIMITS, e.g. "geocode=50,openrouter=5"."""
+    limits = {}
+    for item in spec.split(","):
+        name, _, rate = item.partition("=")
+        if name.strip() and rate.strip():
+            limits[name.strip()] = float(rate)
+    return limits
+
+
+class TokenBucket:
+    """Thread-safe token bucket; callers reserve a token and sleep for the returned delay."""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.capacity = max(burst, 1.0)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, max_wait: float) -> Optional[float]:
+        """
+        Take a token, returning how long to wait before using it, or None (and
+        take nothing) if that would be longer than `max_wait`. Tokens go negative
+        while calls are queued, so waiters are spaced out at the refill rate.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            wait = max(0.0, (1 - self._tokens) / self.rate)
+            if wait > max_wait:
+                return None
+            self._tokens -= 1
+            return wait
+
+    def available(self, seconds: float) -> int:
+        """How many tokens can be taken within the next `seconds`, counting queued callers."""
+        with self._lock:
+            now = time.monotonic()
+            tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            return max(0, int(tokens + seconds * self.rate))
+
+
+class CircuitBreaker:
+    """Consecutive-failure breaker with a single half-open probe."""
+
+    def __init__(self, failures: Optional[int] = None, reset_seconds: Optional[float] = None):
+        self.failures = BREAKER_FAILURES if failures is None else failures
+        self.reset_seconds = BREAKER_RESET_SECONDS if reset_seconds is None else reset_seconds
+        self._count = 0
+        self._opened_at: Optional[float] = None
+        self._probe_at: Optional[float] = None
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self._opened_at is None:
+            return "closed"
+        if time.monotonic() - self._opened_at < self.reset_seconds:
+            return "open"
+        return "half_open"
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            now = time.monotonic()
+            if now - self._opened_at < self.reset_seconds:
+                return False
+            # One probe at a time; a probe that never reports back expires
+            if self._probe_at is not None and now - self._probe_at < self.reset_seconds:
+                return False
+            self._probe_at = now
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self._count = 0
+            self._opened_at = self._probe_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self._count += 1
+            if self._probe_at is not None or self._count >= self.failures:
+                self._opened_at = time.monotonic()
+                self._probe_at = None
+
+
+def backoff(attempt: int, retry_after: Optional[float] = None) -> float:
+    """Full-jitter exponential delay before retry number `attempt` (1-based)."""
+    delay = random.uniform(0, min(UPSTREAM_BACKOFF_MAX, UPSTREAM_BACKOFF_BASE * 2 ** (attempt - 1)))
+    if retry_after is not None:
+        delay = max(delay, min(retry_after, UPSTREAM_BACKOFF_MAX))
+    return delay
+
+
+def retry_after_seconds(value: Optional[str]) -> Optional[float]:
+    """The delta-seconds form of a Retry-After header (HTTP dates are ignored)."""
+    try:
+        return max(0.0, float(value)) if value else None
+    except ValueError:
+        return None
+
+
+_deadline: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar("upstream_deadline",
+                                                                             default=None)
+
+
+def start_deadline(seconds: float = REQUEST_DEADLINE) -> contextvars.Token:
+    """Bound upstream calls in the current context to `seconds` from now; pass the token to `end_deadline`."""
+    until = time.monotonic() + seconds
+    current = _deadline.get()
+    return _deadline.set(until if current is None else min(current, until))
+
+
+def end_deadline(token: contextvars.Token):
+    _deadline.reset(token)
+
+
+@contextmanager
+def deadline(seconds: float = REQUEST_DEADLINE):
+    """`start_deadline` for a block; tasks and threads started inside inherit it."""
+    token = start_deadline(seconds)
+    try:
+        yield
+    finally:
+        end_deadline(token)
+
+
+def current_deadline() -> float:
+    """Monotonic time by which the current call must finish."""
+    until = _deadline.get()
+    return time.monotonic() + REQUEST_DEADLINE if until is None else until
+
+
+_queue_seconds: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar(
+    "upstream_queue_seconds", default=None)
+
+
+def queue_seconds() -> float:
+    """Longest a call in the current context may wait for a token or a free slot."""
+    value = _queue_seconds.get()
+    return UPSTREAM_QUEUE_SECONDS if value is None else value
+
+
+@contextmanager
+def bulk():
+    """Calls in this block queue for up to BULK_QUEUE_SECONDS (still within the deadline)."""
+    token = _queue_seconds.set(max(UPSTREAM_QUEUE_SECONDS, BULK_QUEUE_SECONDS))
+    try:
+        yield
+    finally:
+        _queue_seconds.reset(token)
+
+
+def overloaded(in_flight: float) -> bool:
+    """Whether a new request should be shed given `in_flight` requests already being served."""
+    return MAX_IN_FLIGHT_REQUESTS > 0 and in_flight >= MAX_IN_FLIGHT_REQUESTS
@@ -0,0 +1,156 @@
+"""
+Response encoding shared by the Flask and FastAPI apps.
+
+Clients can ask for a compact route body with `?view=compact` or
+`Accept: application/vnd.optimal-route.compact+json`. The compact body drops
+the raw computeRoutes payload and keeps only the visiting order, per-leg
+seconds/metres and encoded polylines for geometry.
+
+Bodies are serialized with orjson when it is installed (stdlib json otherwise)
+and compressed with brotli or gzip when the client accepts it and the body is
+large enough to benefit.
+"""
+import gzip
+import json
+from typing import Any, Dict, List, Mapping, Optional, Sequence, Tuple
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional speedup
+    orjson = None
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - optional
+    brotli = None
+
+COMPACT_MEDIA_TYPE = "application/vnd.optimal-route.compact+json"
+
+# Bodies smaller than this are sent uncompressed.
+COMPRESS_MIN_BYTES = 1024
+
+# computeRoutes field masks. /api/optimize summarizes the full legs, or in compact
+# mode asks only for what it returns; /api/optimize_route only ever needs the totals.
+OPTIMIZE_FIELD_MASK = "routes.duration,routes.distanceMeters,routes.legs"
+TOTALS_FIELD_MASK = "routes.duration,routes.distanceMeters"
+COMPACT_FIELD_MASK = ",".join([
+    "routes.duration", "routes.distanceMeters", "routes.polyline.encodedPolyline",
+    "routes.legs.duration", "routes.legs.distanceMeters", "routes.legs.polyline.encodedPolyline",
+])
+
+
+def wants_compact(query: Mapping[str, str], headers: Mapping[str, str]) -> bool:
+    return (query.get("view") == "compact"
+            or COMPACT_MEDIA_TYPE in (headers.get("accept") or headers.get("Accept") or ""))
+
+
+def encode_polyline(points: Sequence[Tuple[float, float]]) -> str:
+    """Google encoded-polyline string for (lat, lng) points (precision 1e-5)."""
+    out = []
+    prev_lat = prev_lng = 0
+    for lat, lng in points:
+        lat_e5, lng_e5 = int(round(lat * 1e5)), int(round(lng * 1e5))
+        for delta in (lat_e5 - prev_lat, lng_e5 - prev_lng):
+            value = ~(delta << 1) if delta < 0 else delta << 1
+            while value >= 0x20:
+                out.append(chr((0x20 | (value & 0x1f)) + 63))
+                value >>= 5
+            out.append(chr(value + 63))
+        prev_lat, prev_lng = lat_e5, lng_e5
+    return "".join(out)
+
+
+def _seconds(duration: Optional[str]) -> int:
+    return int(float((duration or "0s").rstrip("s")))
+
+
+def compact_from_directions(route_data: dict, inputs: List[str]) -> Dict[str, Any]:
+    """Compact body from a computeRoutes route and the inputs in visiting order."""
+    legs = route_data.get('legs', [])
+    return {
+        'order': inputs,
+        'total_seconds': _seconds(route_data.get('duration')),
+        'total_meters': route_data.get('distanceMeters', 0),
+        'polyline': route_data.get('polyline', {}).get('encodedPolyline', ""),
+        # [seconds, metres, encoded polyline] per leg, in visiting order
+        'legs': [[_seconds(leg.get('duration')), leg.get('distanceMeters', 0),
+                  leg.get('polyline', {}).get('encodedPolyline', "")] for leg in legs],
+    }
+
+
+def compact_from_summary(summary: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Compact body from a matrix-based summary (`routes_api.summarize_matrix_route`).
+    There is no road geometry, so leg polylines are straight stop-to-stop lines.
+    """
+    route = summary['route']
+    points = [(p['coord']['lat'], p['coord']['lng']) if p.get('coord') else None for p in route]
+    legs = []
+    for leg, a, b in zip(summary['legs'], points[:-1], points[1:]):
+        line = encode_polyline([a, b]) if a and b else ""
+        legs.append([round(leg['time_minutes'] * 60), round(leg['distance_km'] * 1000), line])
+    return {
+        **{k: v for k, v in summary.items() if k not in ('route', 'legs', 'summary',
+                                                          'total_distance_km',
+                                                          'total_time_minutes')},
+        'order': [p['input'] for p in route],
+        'total_seconds': sum(leg[0] for leg in legs),
+        'total_meters': sum(leg[1] for leg in legs),
+        'polyline': encode_polyline([p for p in points if p]) if all(points) else "",
+        'legs': legs,
+    }
+
+
+def dumps(body: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(body, option=orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(body, separators=(",", ":"), default=_default).encode()
+
+
+def _default(value):
+    # NumPy scalars sneak in from matrix-based summaries
+    if hasattr(value, "item"):
+        return value.item()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def _content_coding(accept_encoding: str) -> Optional[str]:
+    """
+    The coding to compress with: the supported one with the highest q-value in
+    Accept-Encoding (brotli on a tie), or None if every one is refused (q=0).
+    """
+    accepted: Dict[str, float] = {}
+    for item in accept_encoding.lower().split(","):
+        coding, *params = [part.strip() for part in item.split(";")]
+        q = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if coding:
+            accepted[coding] = q
+    supported = ["br", "gzip"] if brotli is not None else ["gzip"]
+    q_values = {coding: accepted.get(coding, accepted.get("*", 0.0)) for coding in supported}
+    best = max(supported, key=q_values.__getitem__)
+    return best if q_values[best] > 0 else None
+
+
+def encode(body: Any, accept_encoding: str = "", compact: bool = False) -> Tuple[bytes, Dict[str, str]]:
+    """Serialize (and maybe compress) `body`. Returns (bytes, response headers)."""
+    data = dumps(body)
+    headers = {
+        "Content-Type": COMPACT_MEDIA_TYPE if compact else "application/json",
+        "Vary": "Accept, Accept-Encoding",
+    }
+    if len(data) >= COMPRESS_MIN_BYTES:
+        coding = _content_coding(accept_encoding)
+        if coding == "br":
+            data = brotli.compress(data, quality=4)
+            headers["Content-Encoding"] = "br"
+        elif coding == "gzip":
+            data = gzip.compress(data, compresslevel=5)
+            headers["Content-Encoding"] = "gzip"
+    return data, headers
@@ -0,0 +1,489 @@
+"""
+Offline road-graph routing with contraction hierarchies.
+
+Builds a drivable road graph from an OSM XML extract (.osm, .osm.gz or
+.osm.bz2), contracts it once into a contraction hierarchy (CH) and saves the
+result as a directory of `.npy` arrays. At startup `RoadGraph.load` memory-maps
+those arrays, so no preprocessing runs in the API process.
+
+The hierarchy is stored as two CSR adjacency structures:
+- `up`: edge u -> w with rank[w] > rank[u] (forward searches)
+- `down`: for an edge u -> w with rank[u] > rank[w], w -> u (backward searches)
+
+Each node also stores its `level` in the hierarchy (one more than the highest
+node with an edge into it). Many-to-many matrices run one forward sweep over
+the upward search space of all sources and one backward sweep for all
+targets, relaxing edges a level at a time as NumPy operations over (edges x
+origins), then take the best meeting node of each pair. Each edge carries
+travel time (the CH metric) and length, so distances along the fastest path
+come out of the same sweeps. Indexes saved before `level` existed must be
+rebuilt.
+
+Build an index with:
+    python road_graph.py build kuala-lumpur.osm.bz2 road-index/
+"""
+import bz2
+import gzip
+import heapq
+import json
+import math
+import os
+import re
+import xml.etree.ElementTree as ET
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+# Free-flow speeds (km/h) for drivable OSM highway types, tuned down for KL traffic.
+HIGHWAY_SPEEDS = {
+    "motorway": 90, "motorway_link": 50,
+    "trunk": 70, "trunk_link": 40,
+    "primary": 50, "primary_link": 35,
+    "secondary": 40, "secondary_link": 30,
+    "tertiary": 35, "tertiary_link": 25,
+    "unclassified": 25, "residential": 20, "road": 25,
+    "living_street": 10, "service": 15,
+}
+
+# Nodes settled per witness search before a shortcut is added conservatively.
+WITNESS_SETTLE_LIMIT = 100
+
+# Stops further than this from any road node are left to the Routes API.
+MAX_SNAP_METERS = 1000.0
+
+# Grid cell size (degrees, ~550 m at KL's latitude) of the snapping index.
+# `nearest_nodes` searches as many cells around a stop as MAX_SNAP_METERS spans.
+GRID_CELL_DEG = 0.005
+
+# Stops snapped per vectorised pass in `nearest_nodes` (bounds the candidate arrays).
+SNAP_CHUNK = 256
+
+# Meeting nodes combined per pass in `RoadGraph.matrix` (bounds the node x source x
+# target array).
+MEET_CHUNK = 256
+
+EARTH_RADIUS_M = 6371008.8
+
+_ARRAYS = ("lat", "lng", "up_indptr", "up_indices", "up_time", "up_dist",
+           "down_indptr", "down_indices", "down_time", "down_dist",
+           "grid_cells", "grid_order", "level")
+
+
+def haversine_m(lat1, lng1, lat2, lng2):
+    """Great-circle distance in metres; accepts scalars or NumPy arrays."""
+    lat1, lng1, lat2, lng2 = map(np.radians, (lat1, lng1, lat2, lng2))
+    a = (np.sin((lat2 - lat1) / 2) ** 2
+         + np.cos(lat1) * np.cos(lat2) * np.sin((lng2 - lng1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(a))
+
+
+def _open(path: str):
+    if path.endswith(".gz"):
+        return gzip.open(path, "rb")
+    if path.endswith(".bz2"):
+        return bz2.open(path, "rb")
+    return open(path, "rb")
+
+
+def _speed_kmh(tags: Dict[str, str]) -> Optional[float]:
+    speed = HIGHWAY_SPEEDS.get(tags.get("highway"))
+    if speed is None:
+        return None
+    match = re.match(r"\s*(\d+(?:\.\d+)?)", tags.get("maxspeed", ""))
+    if match:
+        speed = min(speed * 1.5, float(match.group(1)))
+    return float(speed)
+
+
+def read_osm(path: str):
+    """
+    Parse drivable ways from an OSM XML extract.
+
+    Returns (lat, lng, src, dst, time_s, dist_m) with nodes renumbered 0..n-1.
+    """
+    coords: Dict[int, Tuple[float, float]] = {}
+    ways: List[Tuple[List[int], float, int]] = []   # (node refs, km/h, direction)
+    with _open(path) as fh:
+        for _, el in ET.iterparse(fh, events=("end",)):
+            if el.tag == "node":
+                coords[int(el.get("id"))] = (float(el.get("lat")), float(el.get("lon")))
+                el.clear()
+            elif el.tag == "way":
+                tags = {t.get("k"): t.get("v") for t in el.iter("tag")}
+                speed = _speed_kmh(tags)
+                if speed is not None and tags.get("access") not in ("no", "private"):
+                    oneway = tags.get("oneway", "")
+                    if oneway == "-1":
+                        direction = -1
+                    elif (oneway in ("yes", "true", "1") or tags.get("junction") == "roundabout"
+                          or tags.get("highway") == "motorway"):
+                        direction = 1
+                    else:
+                        direction = 0
+                    ways.append(([int(nd.get("ref")) for nd in el.iter("nd")], speed, direction))
+                el.clear()
+            elif el.tag == "relation":
+                el.clear()
+
+    index: Dict[int, int] = {}
+    src, dst, time_s, dist_m = [], [], [], []
+    for refs, speed, direction in ways:
+        refs = [r for r in refs if r in coords]
+        for a, b in zip(refs[:-1], refs[1:]):
+            ia = index.setdefault(a, len(index))
+            ib = index.setdefault(b, len(index))
+            length = float(haversine_m(*coords[a], *coords[b]))
+            seconds = length / (speed / 3.6)
+            if direction >= 0:
+                src.append(ia), dst.append(ib), time_s.append(seconds), dist_m.append(length)
+            if direction <= 0:
+                src.append(ib), dst.append(ia), time_s.append(seconds), dist_m.append(length)
+
+    lat = np.empty(len(index))
+    lng = np.empty(len(index))
+    for osm_id, i in index.items():
+        lat[i], lng[i] = coords[osm_id]
+    return lat, lng, np.asarray(src), np.asarray(dst), np.asarray(time_s), np.asarray(dist_m)
+
+
+def contract(n: int, src: Sequence[int], dst: Sequence[int], time_s: Sequence[float],
+             dist_m: Sequence[float]):
+    """
+    Build a contraction hierarchy. Nodes are contracted in lazily updated
+    edge-difference order. Returns (rank, edges) where edges is a list of
+    (u, w, time, dist) that includes every original edge and every shortcut.
+    """
+    out: List[Dict[int, Tuple[float, float]]] = [dict() for _ in range(n)]
+    inn: List[Dict[int, Tuple[float, float]]] = [dict() for _ in range(n)]
+    for u, w, t, d in zip(src, dst, time_s, dist_m):
+        u, w = int(u), int(w)
+        if u != w and (w not in out[u] or t < out[u][w][0]):
+            out[u][w] = inn[w][u] = (float(t), float(d))
+
+    def witness(u: int, skip: int, limit: float, targets) -> Dict[int, float]:
+        best = {u: 0.0}
+        heap = [(0.0, u)]
+        settled = 0
+        # Stop once every target is settled: their costs cannot improve after that
+        remaining = len(targets)
+        while heap and settled < WITNESS_SETTLE_LIMIT and remaining:
+            cost, x = heapq.heappop(heap)
+            if cost > limit:
+                break
+            if cost > best.get(x, math.inf):
+                continue
+            settled += 1
+            if x in targets:
+                remaining -= 1
+            for y, (t, _) in out[x].items():
+                if y == skip:
+                    continue
+                c = cost + t
+                if c < best.get(y, math.inf):
+                    best[y] = c
+                    heapq.heappush(heap, (c, y))
+        return best
+
+    def shortcuts(v: int) -> List[Tuple[int, int, float, float]]:
+        result = []
+        for u, (tu, du) in inn[v].items():
+            targets = {w: (tu + tw, du + dw) for w, (tw, dw) in out[v].items() if w != u}
+            if not targets:
+                continue
+            found = witness(u, v, max(t for t, _ in targets.values()), targets)
+            for w, (t, d) in targets.items():
+                if found.get(w, math.inf) > t:
+                    result.append((u, w, t, d))
+        return result
+
+    contracted_neighbours = [0] * n
+
+    def priority(v: int) -> int:
+        return len(shortcuts(v)) - len(inn[v]) - len(out[v]) + contracted_neighbours[v]
+
+    heap = [(priority(v), v) for v in range(n)]
+    heapq.heapify(heap)
+    rank = np.empty(n, dtype=np.int64)
+    contracted = bytearray(n)
+    edges: List[Tuple[int, int, float, float]] = []
+    next_rank = 0
+    while heap:
+        _, v = heapq.heappop(heap)
+        if contracted[v]:
+            continue
+        # Lazy update: recompute the priority, keeping the shortcuts for contraction
+        added = shortcuts(v)
+        fresh = len(added) - len(inn[v]) - len(out[v]) + contracted_neighbours[v]
+        if heap and fresh > heap[0][0]:
+            heapq.heappush(heap, (fresh, v))
+            continue
+
+        for u, (t, d) in inn[v].items():
+            edges.append((u, v, t, d))
+            del out[u][v]
+            contracted_neighbours[u] += 1
+        for w, (t, d) in out[v].items():
+            edges.append((v, w, t, d))
+            del inn[w][v]
+            contracted_neighbours[w] += 1
+        inn[v], out[v] = {}, {}
+        for u, w, t, d in added:
+            if w not in out[u] or t < out[u][w][0]:
+                out[u][w] = inn[w][u] = (t, d)
+        rank[v] = next_rank
+        next_rank += 1
+        contracted[v] = 1
+    return rank, edges
+
+
+def _csr(n: int, heads: np.ndarray, tails: np.ndarray, time_s: np.ndarray, dist_m: np.ndarray):
+    order = np.argsort(heads, kind="stable")
+    indptr = np.zeros(n + 1, dtype=np.int64)
+    np.add.at(indptr, heads + 1, 1)
+    return (np.cumsum(indptr).astype(np.int64), tails[order].astype(np.int32),
+            time_s[order].astype(np.float32), dist_m[order].astype(np.float32))
+
+
+def _grid(lat: np.ndarray, lng: np.ndarray):
+    cells = _cell_ids(lat, lng)
+    order = np.argsort(cells, kind="stable")
+    return cells[order], order.astype(np.int32)
+
+
+def _search_span(lat: float) -> Tuple[int, int]:
+    """Grid (rows, columns) either side of a stop's cell that MAX_SNAP_METERS can reach."""
+    cell_m = math.radians(GRID_CELL_DEG) * EARTH_RADIUS_M
+    cos_lat = max(math.cos(math.radians(lat)), 0.01)
+    return math.ceil(MAX_SNAP_METERS / cell_m), math.ceil(MAX_SNAP_METERS / (cell_m * cos_lat))
+
+
+def _cell_ids(lat, lng):
+    row = np.floor((np.asarray(lat) + 90.0) / GRID_CELL_DEG).astype(np.int64)
+    col = np.floor((np.asarray(lng) + 180.0) / GRID_CELL_DEG).astype(np.int64)
+    return row * 100000 + col
+
+
+def _csr_edges(indptr: np.ndarray, nodes: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Positions of every CSR edge leaving `nodes`, and how many leave each node."""
+    starts = np.asarray(indptr[nodes], dtype=np.int64)
+    counts = np.asarray(indptr[nodes + 1], dtype=np.int64) - starts
+    total = int(counts.sum())
+    return np.repeat(starts - (np.cumsum(counts) - counts), counts) + np.arange(total), counts
+
+
+def _levels(n: int, tails: np.ndarray, heads: np.ndarray) -> np.ndarray:
+    """
+    Level of each node in the hierarchy's DAG (every CH edge runs from lower to
+    higher rank): 0 with no incoming edge, else one more than its highest tail.
+    """
+    level = np.zeros(n, dtype=np.int32)
+    while True:
+        raised = level.copy()
+        np.maximum.at(raised, heads, level[tails] + 1)
+        if np.array_equal(raised, level):
+            return level
+        level = raised
+
+
+class RoadGraph:
+    """Contraction-hierarchy road graph backed by (optionally memory-mapped) arrays."""
+
+    def __init__(self, arrays: Dict[str, np.ndarray]):
+        for name in _ARRAYS:
+            setattr(self, name, arrays[name])
+        self.n = len(self.lat)
+
+    @classmethod
+    def from_edges(cls, lat, lng, src, dst, time_s, dist_m) -> "RoadGraph":
+        lat, lng = np.asarray(lat, dtype=np.float64), np.asarray(lng, dtype=np.float64)
+        rank, edges = contract(len(lat), src, dst, time_s, dist_m)
+        e = np.asarray(edges, dtype=np.float64).reshape(-1, 4)
+        u, w = e[:, 0].astype(np.int64), e[:, 1].astype(np.int64)
+        upward = rank[w] > rank[u]
+        up = _csr(len(lat), u[upward], w[upward], e[upward, 2], e[upward, 3])
+        down = _csr(len(lat), w[~upward], u[~upward], e[~upward, 2], e[~upward, 3])
+        grid_cells, grid_order = _grid(lat, lng)
+        # Both CSRs store edges as (lower rank -> higher rank)
+        level = _levels(len(lat), np.concatenate([u[upward], w[~upward]]),
+                        np.concatenate([w[upward], u[~upward]]))
+        return cls(dict(zip(_ARRAYS, (lat, lng, *up, *down, grid_cells, grid_order, level))))
+
+    @classmethod
+    def from_osm(cls, path: str) -> "RoadGraph":
+        return cls.from_edges(*read_osm(path))
+
+    def save(self, directory: str):
+        os.makedirs(directory, exist_ok=True)
+        for name in _ARRAYS:
+            np.save(os.path.join(directory, f"{name}.npy"), getattr(self, name))
+        with open(os.path.join(directory, "meta.json"), "w") as fh:
+            json.dump({"nodes": self.n, "grid_cell_deg": GRID_CELL_DEG}, fh)
+
+    @classmethod
+    def load(cls, directory: str, mmap: bool = True) -> "RoadGraph":
+        mode = "r" if mmap else None
+        return cls({name: np.load(os.path.join(directory, f"{name}.npy"), mmap_mode=mode)
+                    for name in _ARRAYS})
+
+    def nearest_nodes(self, lats: Sequence[float], lngs: Sequence[float]):
+        """Return (node ids, snap distances in metres); -1 where nothing is near."""
+        lats, lngs = np.asarray(lats, dtype=np.float64), np.asarray(lngs, dtype=np.float64)
+        nodes = np.full(len(lats), -1, dtype=np.int64)
+        snap = np.full(len(lats), np.inf)
+        for lo in range(0, len(lats), SNAP_CHUNK):
+            self._nearest_chunk(lats[lo:lo + SNAP_CHUNK], lngs[lo:lo + SNAP_CHUNK],
+                                nodes[lo:lo + SNAP_CHUNK], snap[lo:lo + SNAP_CHUNK])
+        return nodes, snap
+
+    def _nearest_chunk(self, lats: np.ndarray, lngs: np.ndarray, nodes: np.ndarray, snap: np.ndarray):
+        # Every stop searches the widest window any stop in the chunk needs
+        rows, cols = _search_span(float(np.abs(lats).max()))
+        offsets = (np.arange(-rows, rows + 1)[:, None] * 100000
+                   + np.arange(-cols, cols + 1)[None, :]).ravel()
+        cells = _cell_ids(lats, lngs)[:, None] + offsets[None, :]
+        starts = np.searchsorted(self.grid_cells, cells, "left").ravel()
+        counts = np.searchsorted(self.grid_cells, cells, "right").ravel() - starts
+        total = int(counts.sum())
+        if not total:
+            return
+        # Flatten every (stop, candidate node) pair, then keep the closest node per stop
+        owner = np.repeat(np.repeat(np.arange(len(lats)), len(offsets)), counts)
+        first = np.repeat(starts - (np.cumsum(counts) - counts), counts)
+        candidates = np.asarray(self.grid_order)[first + np.arange(total)]
+        d = haversine_m(lats[owner], lngs[owner], self.lat[candidates], self.lng[candidates])
+        order = np.lexsort((d, owner))
+        keep = order[np.r_[True, owner[order][1:] != owner[order][:-1]]]
+        nodes[owner[keep]], snap[owner[keep]] = candidates[keep], d[keep]
+
+    def _sweep(self, origins: np.ndarray, forward: bool):
+        """
+        Shortest upward-path times and distances from every origin at once.
+
+        The upward search space (every node reachable over `up` edges, or
+        `down` for backward sweeps) is collected a frontier at a time, then its
+        edges are relaxed level by level: an edge's head has a higher `level`
+        than its tail, so when a level is relaxed every path into it is final.
+        Each step is one NumPy operation over (edges x origins).
+        Returns (space nodes, times, distances), the last two (space x origins).
+        """
+        if forward:
+            indptr, indices, time_s, dist_m = self.up_indptr, self.up_indices, self.up_time, self.up_dist
+        else:
+            indptr, indices, time_s, dist_m = (self.down_indptr, self.down_indices,
+                                               self.down_time, self.down_dist)
+        seen = np.zeros(self.n, dtype=bool)
+        seen[origins] = True
+        frontier = np.unique(origins)
+        tails, edges = [], []
+        while len(frontier):
+            e, counts = _csr_edges(indptr, frontier)
+            tails.append(np.repeat(frontier, counts))
+            edges.append(e)
+            heads = np.asarray(indices[e], dtype=np.int64)
+            frontier = np.unique(heads[~seen[heads]])
+            seen[frontier] = True
+        space = np.flatnonzero(seen)
+        local = np.full(self.n, -1, dtype=np.int64)
+        local[space] = np.arange(len(space))
+        e = np.concatenate(edges)
+        tail, head = local[np.concatenate(tails)], local[np.asarray(indices[e], dtype=np.int64)]
+        edge_t = np.asarray(time_s[e], dtype=np.float64)[:, None]
+        edge_d = np.asarray(dist_m[e], dtype=np.float64)[:, None]
+
+        times = np.full((len(space), len(origins)), np.inf)
+        dists = np.full((len(space), len(origins)), np.inf)
+        columns = np.arange(len(origins))
+        times[local[origins], columns] = dists[local[origins], columns] = 0.0
+        # Edges grouped by their head's level, then by head
+        head_level = np.asarray(self.level)[space[head]]
+        order = np.lexsort((head, head_level))
+        tail, head, edge_t, edge_d = tail[order], head[order], edge_t[order], edge_d[order]
+        bounds = np.flatnonzero(np.diff(head_level[order])) + 1
+        for lo, hi in zip(np.r_[0, bounds], np.r_[bounds, len(order)]):
+            t, h = tail[lo:hi], head[lo:hi]
+            firsts = np.flatnonzero(np.r_[True, h[1:] != h[:-1]])
+            heads = h[firsts]
+            reach = times[t] + edge_t[lo:hi]
+            times[heads] = np.minimum(times[heads], np.minimum.reduceat(reach, firsts))
+            # Distance along the fastest of the paths just relaxed into each head
+            via = np.where(reach == times[h], dists[t] + edge_d[lo:hi], np.inf)
+            dists[heads] = np.minimum(dists[heads], np.minimum.reduceat(via, firsts))
+        return space, times, dists
+
+    def matrix(self, sources: Iterable[int], targets: Iterable[int]) -> Tuple[np.ndarray, np.ndarray]:
+        """Many-to-many (durations_s, distances_m); np.inf where no path exists."""
+        sources = np.asarray(list(sources), dtype=np.int64)
+        targets = np.asarray(list(targets), dtype=np.int64)
+        durations = np.full((len(sources), len(targets)), np.inf)
+        if not len(sources) or not len(targets):
+            return durations, durations.copy()
+        f_space, f_time, f_dist = self._sweep(sources, forward=True)
+        b_space, b_time, b_dist = self._sweep(targets, forward=False)
+        # Every shortest path is up-then-down, meeting at a node in both search spaces
+        _, fi, bi = np.intersect1d(f_space, b_space, assume_unique=True, return_indices=True)
+        if not len(fi):
+            return durations, durations.copy()
+        meeting = np.zeros(durations.shape, dtype=np.int64)
+        for lo in range(0, len(fi), MEET_CHUNK):
+            f, b = fi[lo:lo + MEET_CHUNK], bi[lo:lo + MEET_CHUNK]
+            total = f_time[f][:, :, None] + b_time[b][:, None, :]
+            best = np.argmin(total, axis=0)
+            chunk = np.take_along_axis(total, best[None], 0)[0]
+            better = chunk < durations
+            durations[better], meeting[better] = chunk[better], best[better] + lo
+        # Distances along each fastest path, through the meeting node that gave its time
+        rows, cols = np.indices(durations.shape)
+        distances = np.where(np.isfinite(durations),
+                             f_dist[fi[meeting], rows] + b_dist[bi[meeting], cols], np.inf)
+        return durations, distances
+
+    def travel_time_matrix(self, origins: Sequence[Dict[str, float]],
+                           destinations: Optional[Sequence[Dict[str, float]]] = None):
+        """
+        (durations_s, distances_m) from each origin to each destination (default:
+        the origins), or None if any point is further than MAX_SNAP_METERS from
+        the road graph.
+        """
+        points = list(origins) + list(destinations or [])
+        nodes, snap = self.nearest_nodes([c['lat'] for c in points], [c['lng'] for c in points])
+        if (nodes < 0).any() or (snap > MAX_SNAP_METERS).any():
+            return None
+        sources = nodes[:len(origins)]
+        targets = nodes[len(origins):] if destinations is not None else sources
+        return self.matrix(sources, targets)
+
+
+_default: Optional[RoadGraph] = None
+_default_loaded = False
+
+
+def get_default() -> Optional[RoadGraph]:
+    """The index at ROAD_GRAPH_INDEX when ROUTING_BACKEND=local, else None."""
+    global _default, _default_loaded
+    if not _default_loaded:
+        _default_loaded = True
+        path = os.environ.get("ROAD_GRAPH_INDEX")
+        if os.environ.get("ROUTING_BACKEND", "google") == "local" and path:
+            try:
+                _default = RoadGraph.load(path)
+            except (OSError, ValueError, KeyError) as e:
+                print(f"Error loading road graph index {path}: {e}")
+    return _default
+
+
+if __name__ == "__main__":
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    sub = parser.add_subparsers(dest="command", required=True)
+    build = sub.add_parser("build", help="contract an OSM XML extract into an index directory")
+    build.add_argument("osm")
+    build.add_argument("out")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    graph = RoadGraph.from_osm(args.osm)
+    graph.save(args.out)
+    print(f"Indexed {graph.n} nodes, {len(graph.up_indices) + len(graph.down_indices)} CH edges "
+          f"in {time.perf_counter() - started:.1f}s -> {args.out}")
@@ -0,0 +1,566 @@
+"""
+Helpers for the Google Routes API shared by the backend apps.
+
+Builds the travel-time matrix consumed by `solver.py`. Stops are located with
+`geocoding.py`; individual legs and full computeRoutes responses go through the caches in `cache.py`, so
+only pairs that have not been seen in the current time bucket are fetched
+from `computeRouteMatrix`. Matrices are float32 (memory-mapped when very
+large) and fetched in tiles that fit the API's per-call element limit. Only
+as many tiles are requested as the route_matrix rate limit allows before the
+request deadline; those, and tiles whose call fails, are filled with
+straight-line estimates and counted, so responses can be marked `degraded`.
+
+With ROUTING_BACKEND=local, travel-time matrices come from the offline
+contraction-hierarchy index in `road_graph.py` whenever every stop has
+coordinates near the road graph; otherwise they fall back to the Routes API.
+
+When the Routes API is unavailable (`resilience.UpstreamUnavailable`),
+`fallback_route` orders the stops on straight-line travel-time estimates
+instead, using only coordinates that can be resolved without an API call.
+
+Every upstream helper has a blocking version (used by the Flask app) and an
+`*_async` version that goes through the pooled client in `http_client.py`
+(used by the FastAPI app). Both share request building and cache handling.
+"""
+import asyncio
+import contextvars
+import json
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional speedup
+    orjson = None
+
+import http_client
+import metrics
+import resilience
+import road_graph
+import solver
+from cache import leg_cache, normalize_address, route_cache, time_bucket, traffic_ttl
+from geocoding import known_points, locate, locate_many_async
+from resilience import UpstreamUnavailable
+
+# Base URLs can be overridden to point the apps at local stub servers.
+ROUTES_BASE_URL = os.environ.get("ROUTES_BASE_URL", "https://routes.googleapis.com")
+
+ROUTES_URL = f"{ROUTES_BASE_URL}/directions/v2:computeRoutes"
+MATRIX_URL = f"{ROUTES_BASE_URL}/distanceMatrix/v2:computeRouteMatrix"
+MATRIX_FIELD_MASK = "originIndex,destinationIndex,duration,distanceMeters,status,condition"
+
+# Seconds allowed for a blocking upstream call.
+REQUEST_TIMEOUT = float(os.environ.get("UPSTREAM_TIMEOUT", 10))
+
+# Cost used for origin/destination pairs the API could not route.
+UNREACHABLE_SECONDS = 1e7
+
+# computeRoutes accepts at most this many intermediate waypoints; longer routes
+# are answered from the matrix alone.
+ROUTES_MAX_INTERMEDIATES = 25
+
+# computeRouteMatrix accepts at most 625 elements (and 50 waypoints) per call,
+# so matrices are fetched in 25 x 25 tiles, this many at a time.
+MATRIX_TILE_SIZE = int(os.environ.get("MATRIX_TILE_SIZE", 25))
+MATRIX_FETCH_CONCURRENCY = int(os.environ.get("MATRIX_FETCH_CONCURRENCY", 8))
+# Matrices with more elements than this live in a temporary memory-mapped file
+# (4M float32 elements is 16 MB per matrix, about 2,000 stops).
+MATRIX_MEMMAP_ELEMENTS = int(os.environ.get("MATRIX_MEMMAP_ELEMENTS", 4_000_000))
+MATRIX_MEMMAP_DIR = os.environ.get("MATRIX_MEMMAP_DIR") or None
+# Seconds of the request deadline kept back for solving when planning tile fetches.
+MATRIX_PLAN_MARGIN = float(os.environ.get("MATRIX_PLAN_MARGIN", 2))
+
+# Straight-line fallback: road distance is roughly this multiple of the
+# great-circle distance, driven at an average urban speed.
+FALLBACK_DETOUR_FACTOR = 1.3
+FALLBACK_SPEED_KMH = float(os.environ.get("FALLBACK_SPEED_KMH", 30))
+FALLBACK_TIME_LIMIT = 0.1
+
+# A resolved stop: (cache key, Routes API waypoint body)
+Stop = Tuple[str, Dict[str, Any]]
+
+DEGRADED_NOTICE = "Live routing is unavailable; the order and times are straight-line estimates."
+
+
+def degraded_fields(estimated_tiles: int) -> Dict[str, Any]:
+    """Response fields flagging a matrix that was partly estimated ({} if it was all fetched)."""
+    if not estimated_tiles:
+        return {}
+    return {'degraded': True, 'notice': DEGRADED_NOTICE, 'estimated_tiles': estimated_tiles}
+
+
+def parse_duration(duration_str: str) -> int:
+    """Convert a Routes API duration such as "812s" to whole seconds."""
+    duration_str = duration_str or "0s"
+    return int(float(duration_str[:-1] if duration_str.endswith('s') else duration_str))
+
+
+def _routes_headers(api_key: str, field_mask: str) -> Dict[str, str]:
+    return {
+        "Content-Type": "application/json",
+        "X-Goog-Api-Key": api_key,
+        "X-Goog-FieldMask": field_mask,
+    }
+
+
+def _stop_for(location: str, coord: Optional[Dict[str, float]]) -> Stop:
+    if coord is None:
+        return normalize_address(location), {"address": location}
+    # Near-duplicate pickups share a key (and cached legs); the waypoint keeps the exact point
+    lat, lng = known_points.snap(coord['lat'], coord['lng'])
+    key = f"{lat:.5f},{lng:.5f}"
+    return key, {"location": {"latLng": {"latitude": coord['lat'], "longitude": coord['lng']}}}
+
+
+def resolve_stop(gmaps_client, location: str) -> Stop:
+    """
+    Map a user-supplied location to a cache key and a Routes API waypoint.
+
+    "lat,lng" strings and geocodable addresses are keyed on rounded coordinates,
+    snapped onto any point already resolved within SNAP_METERS, so different
+    spellings of the same place share cached legs.
+    """
+    return _stop_for(location, locate(gmaps_client, location))
+
+
+async def resolve_stops_async(locations: List[str], api_key: Optional[str],
+                              failures: Optional[Dict[int, UpstreamUnavailable]] = None) -> List[Stop]:
+    """`resolve_stop` for every location, geocoding the addresses in bulk (see `locate_many_async`)."""
+    coords = await locate_many_async(locations, api_key, failures)
+    return [_stop_for(location, coord) for location, coord in zip(locations, coords)]
+
+
+def _json(response) -> Any:
+    """Response body, parsed with orjson when installed (matrix responses run to 625 elements)."""
+    if orjson is not None and response.content:
+        return orjson.loads(response.content)
+    return response.json()
+
+
+def _matrix_columns(elements: List[dict]) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """(origin index, destination index, seconds, metres) arrays for the routable elements."""
+    ok = [el for el in elements
+          if 'duration' in el and el.get('condition', 'ROUTE_EXISTS') == 'ROUTE_EXISTS']
+    # proto3 JSON omits zero values, so index 0 may be missing
+    return (np.array([el.get('originIndex', 0) for el in ok], dtype=np.intp),
+            np.array([el.get('destinationIndex', 0) for el in ok], dtype=np.intp),
+            np.array([parse_duration(el['duration']) for el in ok], dtype=np.int64),
+            np.array([el.get('distanceMeters', 0) for el in ok], dtype=np.int64))
+
+
+def _local_matrix(origins: List[Stop],
+                  destinations: List[Stop]) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+    """Matrix from the offline road graph, or None to use the Routes API."""
+    graph = road_graph.get_default()
+    if graph is None:
+        return None
+    origin_coords = [_coord(stop) for stop in origins]
+    destination_coords = [_coord(stop) for stop in destinations]
+    if any(c is None for c in origin_coords + destination_coords):
+        return None
+    result = graph.travel_time_matrix(origin_coords, destination_coords)
+    if result is None:
+        return None
+    durations, distances = result
+    unreachable = ~np.isfinite(durations)
+    durations[unreachable] = UNREACHABLE_SECONDS
+    distances[unreachable] = 0.0
+    return durations, distances
+
+
+def _allocate(shape: Tuple[int, int], fill: float) -> np.ndarray:
+    """float32 matrix, memory-mapped from a temporary file past MATRIX_MEMMAP_ELEMENTS."""
+    if shape[0] * shape[1] <= MATRIX_MEMMAP_ELEMENTS:
+        return np.full(shape, fill, dtype=np.float32)
+    with tempfile.TemporaryFile(dir=MATRIX_MEMMAP_DIR) as f:
+        # The mapping keeps the (already unlinked) file alive after it is closed
+        matrix = np.memmap(f, dtype=np.float32, mode="w+", shape=shape)
+    matrix[:] = fill
+    return matrix
+
+
+# (origin indices, destination indices) still to fetch in one computeRouteMatrix call
+Tile = Tuple[List[int], List[int]]
+
+
+def tile_count(origins: int, destinations: int) -> int:
+    """computeRouteMatrix tiles an origins x destinations matrix spans."""
+    return -(-origins // MATRIX_TILE_SIZE) * -(-destinations // MATRIX_TILE_SIZE)
+
+
+class _MatrixFill:
+    """
+    float32 matrix pre-filled from the leg cache, plus one computeRouteMatrix
+    request per MATRIX_TILE_SIZE x MATRIX_TILE_SIZE tile that still has missing pairs.
+    """
+
+    def __init__(self, origin_stops: List[Stop], destination_stops: List[Stop]):
+        self.origin_stops = origin_stops
+        self.destination_stops = destination_stops
+        self.bucket = time_bucket()
+        shape = (len(origin_stops), len(destination_stops))
+        self.durations = _allocate(shape, UNREACHABLE_SECONDS)
+        self.distances = _allocate(shape, 0.0)
+        # Matrices bigger than the leg cache would only evict everything else from it
+        self.use_cache = shape[0] * shape[1] <= leg_cache.maxsize
+        ids: Dict[str, int] = {}
+        self.origin_ids = np.array([ids.setdefault(key, len(ids)) for key, _ in origin_stops])
+        self.destination_ids = np.array([ids.setdefault(key, len(ids)) for key, _ in destination_stops])
+        size = MATRIX_TILE_SIZE
+        # Tiles left out of the plan (see `plan`); estimated in `finish`
+        self.unplanned: List[Tile] = []
+        self.tiles: List[Tile] = []
+        for o in range(0, shape[0], size):
+            for d in range(0, shape[1], size):
+                tile = self._missing(range(o, min(o + size, shape[0])), range(d, min(d + size, shape[1])))
+                if tile is not None:
+                    self.tiles.append(tile)
+
+    def _key(self, i: int, j: int) -> str:
+        return f"{self.origin_stops[i][0]}|{self.destination_stops[j][0]}|{self.bucket}"
+
+    def plan(self) -> List[Tile]:
+        """
+        Trim `tiles` to as many calls as the route_matrix rate limit allows
+        before the request deadline (less MATRIX_PLAN_MARGIN). Queuing the rest
+        would only end in rejections at the deadline, so they are estimated
+        up front instead.
+        """
+        seconds = resilience.current_deadline() - time.monotonic() - MATRIX_PLAN_MARGIN
+        allowed = http_client.calls_within(MATRIX_URL, max(seconds, 0.0))
+        if allowed is not None and allowed < len(self.tiles):
+            print(f"Fetching {allowed} of {len(self.tiles)} matrix tiles within the rate limit")
+            self.tiles, self.unplanned = self.tiles[:allowed], self.tiles[allowed:]
+        return self.tiles
+
+    def _missing(self, origins: range, destinations: range) -> Optional[Tile]:
+        if not self.use_cache:
+            same = self.origin_ids[origins][:, None] == self.destination_ids[destinations][None, :]
+            block = self.durations[origins.start:origins.stop, destinations.start:destinations.stop]
+            block[same] = 0.0
+            rows, cols = (~same).any(axis=1), (~same).any(axis=0)
+            if not rows.any():
+                return None
+            return np.asarray(origins)[rows].tolist(), np.asarray(destinations)[cols].tolist()
+        pairs = {}
+        for i in origins:
+            origin_key = self.origin_stops[i][0]
+            for j in destinations:
+                if origin_key == self.destination_stops[j][0]:
+                    self.durations[i, j] = 0.0
+                else:
+                    # A stop can repeat (a round trip), so several cells can share a key
+                    pairs.setdefault(self._key(i, j), []).append((i, j))
+        # One lookup per tile, so a persistent store is queried in bulk
+        legs = leg_cache.get_many(list(pairs))
+        missing_origins, missing_destinations = set(), set()
+        for key, cells in pairs.items():
+            leg = legs.get(key)
+            for i, j in cells:
+                if leg is None:
+                    missing_origins.add(i)
+                    missing_destinations.add(j)
+                else:
+                    self.durations[i, j], self.distances[i, j] = leg
+        if not missing_origins:
+            return None
+        return sorted(missing_origins), sorted(missing_destinations)
+
+    def request_body(self, tile: Tile) -> dict:
+        origins, destinations = tile
+        return {
+            "origins": [{"waypoint": self.origin_stops[i][1]} for i in origins],
+            "destinations": [{"waypoint": self.destination_stops[j][1]} for j in destinations],
+            "travelMode": "DRIVE",
+            "routingPreference": "TRAFFIC_AWARE",
+        }
+
+    def apply(self, tile: Tile, elements: List[dict]):
+        oi, di, seconds, meters = _matrix_columns(elements)
+        i = np.asarray(tile[0], dtype=np.intp)[oi]
+        j = np.asarray(tile[1], dtype=np.intp)[di]
+        keep = self.origin_ids[i] != self.destination_ids[j]
+        i, j, seconds, meters = i[keep], j[keep], seconds[keep], meters[keep]
+        self.durations[i, j], self.distances[i, j] = seconds, meters
+        if self.use_cache:
+            leg_cache.set_many([(self._key(a, b), [t, d]) for a, b, t, d in
+                                zip(i.tolist(), j.tolist(), seconds.tolist(), meters.tolist())],
+                               ttl=traffic_ttl())
+
+    def estimate(self, tile: Tile):
+        """Straight-line estimates for a tile the Routes API could not serve (not cached)."""
+        origins, destinations = tile
+        durations, distances = straight_line_estimates([self.origin_stops[i] for i in origins],
+                                                       [self.destination_stops[j] for j in destinations])
+        block = np.ix_(origins, destinations)
+        same = self.durations[block] == 0.0
+        self.durations[block] = np.where(same, 0.0, np.nan_to_num(durations, nan=UNREACHABLE_SECONDS))
+        self.distances[block] = np.where(same, 0.0, np.nan_to_num(distances, nan=0.0))
+
+    def finish(self, errors: List[Optional[BaseException]]) -> Tuple[np.ndarray, np.ndarray, int]:
+        """
+        Estimate the unplanned tiles and those whose call raised
+        `UpstreamUnavailable` (`errors` lines up with `tiles`; None for tiles
+        already applied). Returns (durations, distances, estimated tile count).
+        If no tile could be fetched there is nothing worth returning and
+        `UpstreamUnavailable` is raised instead.
+        """
+        unavailable = [e for e in errors if isinstance(e, UpstreamUnavailable)]
+        if self.unplanned or unavailable:
+            if len(unavailable) == len(errors):
+                raise unavailable[0] if unavailable else UpstreamUnavailable("route_matrix",
+                                                                             "rate_limited")
+            print(f"Estimating {len(unavailable) + len(self.unplanned)} of "
+                  f"{len(errors) + len(self.unplanned)} matrix tiles")
+        for tile, error in zip(self.tiles, errors):
+            if isinstance(error, UpstreamUnavailable):
+                self.estimate(tile)
+            elif error is not None:
+                raise error
+        for tile in self.unplanned:
+            self.estimate(tile)
+        estimated = len(unavailable) + len(self.unplanned)
+        metrics.MATRIX_TILES.inc(len(errors) - len(unavailable), result="fetched")
+        metrics.MATRIX_TILES.inc(estimated, result="estimated")
+        return self.durations, self.distances, estimated
+
+
+def _fetch_tile(fill: _MatrixFill, tile: Tile, api_key: str) -> Optional[Exception]:
+    """Fetch and apply one tile; returns the exception instead of raising (see `_MatrixFill.finish`)."""
+    try:
+        response = http_client.post_blocking(
+            MATRIX_URL,
+            json=fill.request_body(tile),
+            headers=_routes_headers(api_key, MATRIX_FIELD_MASK),
+            timeout=REQUEST_TIMEOUT,
+        )
+        fill.apply(tile, _json(response))
+    except Exception as e:
+        return e
+    return None
+
+
+def fetch_leg_matrix(origins: List[Stop], destinations: List[Stop],
+                     api_key: str) -> Tuple[np.ndarray, np.ndarray, int]:
+    """
+    Return (durations_s, distances_m, estimated tiles) for every origin ->
+    destination pair, as float32 arrays. Tiles are fetched on up to
+    MATRIX_FETCH_CONCURRENCY threads; see `_MatrixFill.finish` for estimates.
+    """
+    local = _local_matrix(origins, destinations)
+    if local is not None:
+        return (*local, 0)
+    fill = _MatrixFill(origins, destinations)
+    fill.plan()
+    if len(fill.tiles) <= 1:
+        return fill.finish([_fetch_tile(fill, tile, api_key) for tile in fill.tiles])
+    with ThreadPoolExecutor(min(MATRIX_FETCH_CONCURRENCY, len(fill.tiles))) as pool:
+        # Each call runs in a copy of this context, so tiles share the request deadline
+        futures = [pool.submit(contextvars.copy_context().run, _fetch_tile, fill, tile, api_key)
+                   for tile in fill.tiles]
+    return fill.finish([f.result() for f in futures])
+
+
+async def fetch_leg_matrix_async(origins: List[Stop], destinations: List[Stop],
+                                 api_key: str) -> Tuple[np.ndarray, np.ndarray, int]:
+    """`fetch_leg_matrix` over the shared async client, MATRIX_FETCH_CONCURRENCY tiles at a time."""
+    local = None
+    if road_graph.get_default() is not None:
+        local = await asyncio.to_thread(_local_matrix, origins, destinations)
+    if local is not None:
+        return (*local, 0)
+    fill = _MatrixFill(origins, destinations)
+    fill.plan()
+    slots = asyncio.Semaphore(MATRIX_FETCH_CONCURRENCY)
+
+    async def fetch(tile: Tile):
+        async with slots:
+            response = await http_client.post(
+                MATRIX_URL,
+                json=fill.request_body(tile),
+                headers=_routes_headers(api_key, MATRIX_FIELD_MASK),
+            )
+        # Applied straight away so only MATRIX_FETCH_CONCURRENCY responses are held at once
+        fill.apply(tile, _json(response))
+
+    results = await asyncio.gather(*(fetch(tile) for tile in fill.tiles), return_exceptions=True)
+    return fill.finish(results)
+
+
+def fetch_travel_time_matrix(stops: List[Stop], api_key: str) -> Tuple[np.ndarray, np.ndarray, int]:
+    """Return (durations_s, distances_m, estimated tiles) for every ordered pair of `stops`."""
+    return fetch_leg_matrix(stops, stops, api_key)
+
+
+async def fetch_travel_time_matrix_async(stops: List[Stop], api_key: str) -> Tuple[np.ndarray, np.ndarray, int]:
+    """`fetch_travel_time_matrix` over the shared async client."""
+    return await fetch_leg_matrix_async(stops, stops, api_key)
+
+
+def _route_cache_key(payload: dict, field_mask: str) -> str:
+    return f"{json.dumps(payload, sort_keys=True)}|{field_mask}|{time_bucket()}"
+
+
+def _store_route(key: str, result: dict):
+    if result and result.get('routes'):
+        route_cache.set(key, result, ttl=traffic_ttl())
+
+
+def compute_routes(payload: dict, field_mask: str, api_key: str) -> dict:
+    """POST to computeRoutes, reusing a cached response for the same ordered stops."""
+    key = _route_cache_key(payload, field_mask)
+    cached = route_cache.get(key)
+    if cached is not None:
+        return cached
+
+    response = http_client.post_blocking(
+        ROUTES_URL,
+        json=payload,
+        headers=_routes_headers(api_key, field_mask),
+        timeout=REQUEST_TIMEOUT,
+    )
+    result = response.json()
+    _store_route(key, result)
+    return result
+
+
+async def compute_routes_async(payload: dict, field_mask: str, api_key: str) -> dict:
+    """`compute_routes` over the shared async client."""
+    key = _route_cache_key(payload, field_mask)
+    cached = route_cache.get(key)
+    if cached is not None:
+        return cached
+
+    response = await http_client.post(
+        ROUTES_URL, json=payload, headers=_routes_headers(api_key, field_mask)
+    )
+    result = response.json()
+    _store_route(key, result)
+    return result
+
+
+def summarize_route(route_data: dict, inputs: List[str]) -> Dict[str, Any]:
+    """
+    Build the `/api/optimize` response body from a computeRoutes route and the
+    user inputs in visiting order (start, pickups..., destination).
+    """
+    total_time_minutes = round(parse_duration(route_data.get('duration', "0s")) / 60, 1)
+    distance_km = round(route_data.get('distanceMeters', 0) / 1000, 2)
+
+    route = [{'input': loc, 'coord': None} for loc in inputs]
+    legs = route_data.get('legs', [])
+    leg_details = []
+    for i, leg in enumerate(legs):
+        if i < len(route) and 'startLocation' in leg:
+            loc = leg['startLocation']['latLng']
+            route[i]['coord'] = {'lat': loc['latitude'], 'lng': loc['longitude']}
+        leg_details.append({
+            'step': i + 1,
+            'from': route[i]['input'] if i < len(route) else "Unknown",
+            'to': route[i + 1]['input'] if i + 1 < len(route) else "Unknown",
+            'distance_km': round(leg.get('distanceMeters', 0) / 1000, 2),
+            'time_minutes': round(parse_duration(leg.get('duration', '0s')) / 60, 1),
+        })
+    if legs and 'endLocation' in legs[-1] and len(legs) < len(route):
+        loc = legs[-1]['endLocation']['latLng']
+        route[len(legs)]['coord'] = {'lat': loc['latitude'], 'lng': loc['longitude']}
+
+    return {
+        'route': route,
+        'legs': leg_details,
+        'summary': f'Optimized route: {distance_km}km, {total_time_minutes} mins',
+        'total_distance_km': distance_km,
+        'total_time_minutes': total_time_minutes,
+    }
+
+
+def _coord(stop: Stop) -> Optional[Dict[str, float]]:
+    lat_lng = stop[1].get("location", {}).get("latLng")
+    if lat_lng is None:
+        return None
+    return {'lat': lat_lng['latitude'], 'lng': lat_lng['longitude']}
+
+
+def summarize_matrix_route(inputs: List[str], stops: List[Stop], order: List[int],
+                           durations: np.ndarray, distances: np.ndarray) -> Dict[str, Any]:
+    """
+    Same shape as `summarize_route`, built from a travel-time matrix instead of a
+    computeRoutes response. `order` indexes `inputs`/`stops` in visiting order.
+    """
+    legs = []
+    for step, (a, b) in enumerate(zip(order[:-1], order[1:]), start=1):
+        legs.append({
+            'step': step,
+            'from': inputs[a],
+            'to': inputs[b],
+            'distance_km': round(float(distances[a, b]) / 1000, 2),
+            'time_minutes': round(float(durations[a, b]) / 60, 1),
+        })
+    distance_km = round(sum(leg['distance_km'] for leg in legs), 2)
+    total_seconds = sum(float(durations[a, b]) for a, b in zip(order[:-1], order[1:]))
+    total_time_minutes = round(total_seconds / 60, 1)
+    return {
+        'route': [{'input': inputs[i], 'coord': _coord(stops[i])} for i in order],
+        'legs': legs,
+        'summary': f'Optimized route: {distance_km}km, {total_time_minutes} mins',
+        'total_distance_km': distance_km,
+        'total_time_minutes': total_time_minutes,
+    }
+
+
+def straight_line_estimates(origins: List[Stop],
+                            destinations: List[Stop]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    (durations s, distances m) estimated from great-circle distances; NaN for
+    pairs where either stop has no coordinates.
+    """
+    def lat_lng(stops):
+        coords = [_coord(stop) for stop in stops]
+        return (np.array([c['lat'] if c else np.nan for c in coords]),
+                np.array([c['lng'] if c else np.nan for c in coords]))
+
+    (lat1, lng1), (lat2, lng2) = lat_lng(origins), lat_lng(destinations)
+    distances = road_graph.haversine_m(lat1[:, None], lng1[:, None], lat2[None, :], lng2[None, :])
+    distances *= FALLBACK_DETOUR_FACTOR
+    return distances / (FALLBACK_SPEED_KMH / 3.6), distances
+
+
+def straight_line_matrix(stops: List[Stop]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    `straight_line_estimates` between every pair of `stops`. Pairs with a stop
+    that has no coordinates get the mean of the known pairs, so such stops keep
+    no particular place in the order.
+    """
+    durations, distances = straight_line_estimates(stops, stops)
+    for matrix in (durations, distances):
+        np.fill_diagonal(matrix, 0.0)
+        unknown = np.isnan(matrix)
+        known = ~unknown
+        np.fill_diagonal(known, False)
+        matrix[unknown] = matrix[known].mean() if known.any() else 0.0
+    return durations, distances
+
+
+def fallback_matrix(locations: List[str]) -> Tuple[List[Stop], np.ndarray, np.ndarray]:
+    """
+    (stops, durations, distances) for `locations` without any upstream call:
+    stops resolve from coordinates, the gazetteer or the geocode cache, and the
+    matrix is `straight_line_matrix`.
+    """
+    stops = [resolve_stop(None, location) for location in locations]
+    return (stops, *straight_line_matrix(stops))
+
+
+def fallback_route(locations: List[str]) -> Dict[str, Any]:
+    """
+    `summarize_matrix_route` for [start, *waypoints, destination] without any
+    upstream call, ordered on `fallback_matrix`.
+    """
+    stops, durations, distances = fallback_matrix(locations)
+    order = solver.solve(durations, time_limit=FALLBACK_TIME_LIMIT)
+    return summarize_matrix_route(locations, stops, order, durations, distances)
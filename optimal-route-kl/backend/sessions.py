@@ -0,0 +1,189 @@
+"""
+Live route sessions for incremental re-optimization.
+
+A session keeps its stops, travel-time matrix and current tour in memory.
+Delta events (add a stop, drop a stop, update a leg's travel time) repair the
+tour with `solver.insert_cheapest` / `solver.improve` instead of solving from
+scratch, and adding a stop only fetches the new stop's row and column of the
+matrix. Solving and repairs run on a worker thread, off the event loop. Each
+change bumps `version` and is pushed to every subscriber queue (the SSE stream
+in `main.py`).
+
+While the Routes or Geocoding API is unavailable, sessions start from (and new
+stops are added with) straight-line estimates instead of failing; those legs
+count towards `estimated_tiles` and every later snapshot is marked `degraded`.
+
+Location index 0 is the start and index 1 the destination; pickups follow.
+"""
+import asyncio
+import os
+import uuid
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+import solver
+from cache import TTLCache
+from resilience import UpstreamUnavailable
+from routes_api import (Stop, degraded_fields, fetch_leg_matrix_async,
+                        fetch_travel_time_matrix_async, resolve_stop, resolve_stops_async,
+                        straight_line_matrix, summarize_matrix_route, tile_count)
+
+# Local-search budget for repairing a tour after one event.
+REPAIR_TIME_LIMIT = 0.05
+
+# Idle sessions are dropped after this many seconds.
+SESSION_TTL = int(os.environ.get("SESSION_TTL", 4 * 3600))
+
+sessions = TTLCache("session", maxsize=int(os.environ.get("SESSION_LIMIT", 1000)), ttl=SESSION_TTL)
+
+
+class RouteSession:
+
+    def __init__(self, locations: List[str], stops: List[Stop], durations: np.ndarray,
+                 distances: np.ndarray, tour: List[int], estimated_tiles: int = 0):
+        self.id = uuid.uuid4().hex
+        self.locations = locations
+        self.stops = stops
+        self.durations = durations
+        self.distances = distances
+        # Matrix tiles filled with straight-line estimates so far; flags snapshots `degraded`
+        self.estimated_tiles = estimated_tiles
+        self.tour = tour
+        self.version = 0
+        self.lock = asyncio.Lock()
+        self._subscribers: List[asyncio.Queue] = []
+
+    @classmethod
+    async def create(cls, locations: List[str], api_key: str) -> "RouteSession":
+        """`locations` as for /api/optimize: start, pickups..., destination."""
+        ordered = [locations[0], locations[-1], *locations[1:-1]]
+        stops = await _resolve(ordered, api_key)
+        try:
+            durations, distances, estimated = await fetch_travel_time_matrix_async(stops, api_key)
+        except UpstreamUnavailable as e:
+            print(f"Starting session on straight-line estimates: {e}")
+            durations, distances = await asyncio.to_thread(straight_line_matrix, stops)
+            estimated = tile_count(len(stops), len(stops))
+        tour = await asyncio.to_thread(solver.solve, durations, start=0, end=1)
+        session = cls(ordered, stops, durations, distances, tour, estimated)
+        sessions.set(session.id, session)
+        return session
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            'session_id': self.id,
+            'version': self.version,
+            **summarize_matrix_route(self.locations, self.stops, self.tour,
+                                     self.durations, self.distances),
+            **degraded_fields(self.estimated_tiles),
+        }
+
+    def subscribe(self) -> asyncio.Queue:
+        queue: asyncio.Queue = asyncio.Queue(maxsize=1)
+        self._subscribers.append(queue)
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        if queue in self._subscribers:
+            self._subscribers.remove(queue)
+
+    def _publish(self) -> Dict[str, Any]:
+        self.version += 1
+        sessions.set(self.id, self)
+        snapshot = self.snapshot()
+        for queue in self._subscribers:
+            # Slow listeners only need the latest route, not every intermediate one.
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait(snapshot)
+        return snapshot
+
+    def _index(self, location: str, pickups_only: bool = False) -> int:
+        first = 2 if pickups_only else 0
+        for i in range(first, len(self.locations)):
+            if self.locations[i] == location:
+                return i
+        raise ValueError(f"Unknown stop: {location}")
+
+    async def _repair(self, order: List[int], insert: Optional[int] = None):
+        """Improve `order` (after cheapest-inserting node `insert`, if given) off the event loop."""
+        durations = self.durations
+
+        def repair() -> List[int]:
+            tour = order if insert is None else solver.insert_cheapest(durations, order, insert)
+            return solver.improve(durations, tour, time_limit=REPAIR_TIME_LIMIT)
+
+        self.tour = await asyncio.to_thread(repair)
+
+    async def add_stop(self, location: str, api_key: str) -> Dict[str, Any]:
+        async with self.lock:
+            stop = (await _resolve([location], api_key))[0]
+            try:
+                (out_t, out_d, out_estimated), (in_t, in_d, in_estimated) = await asyncio.gather(
+                    fetch_leg_matrix_async([stop], self.stops, api_key),
+                    fetch_leg_matrix_async(self.stops, [stop], api_key),
+                )
+            except UpstreamUnavailable as e:
+                print(f"Adding {location} on straight-line estimates: {e}")
+                durations, distances = await asyncio.to_thread(straight_line_matrix,
+                                                               [*self.stops, stop])
+                out_t, out_d = durations[-1:, :-1], distances[-1:, :-1]
+                in_t, in_d = durations[:-1, -1:], distances[:-1, -1:]
+                out_estimated = in_estimated = tile_count(1, len(self.stops))
+            n = len(self.stops)
+            self.estimated_tiles += out_estimated + in_estimated
+            self.durations = _grow(self.durations, out_t[0], in_t[:, 0])
+            self.distances = _grow(self.distances, out_d[0], in_d[:, 0])
+            self.locations.append(location)
+            self.stops.append(stop)
+            await self._repair(self.tour, insert=n)
+            return self._publish()
+
+    async def drop_stop(self, location: str) -> Dict[str, Any]:
+        async with self.lock:
+            k = self._index(location, pickups_only=True)
+            keep = np.arange(len(self.locations)) != k
+            self.durations = self.durations[np.ix_(keep, keep)]
+            self.distances = self.distances[np.ix_(keep, keep)]
+            del self.locations[k]
+            del self.stops[k]
+            await self._repair([i - (i > k) for i in self.tour if i != k])
+            return self._publish()
+
+    async def update_leg(self, from_location: str, to_location: str,
+                         minutes: float) -> Dict[str, Any]:
+        async with self.lock:
+            i, j = self._index(from_location), self._index(to_location)
+            if i == j:
+                raise ValueError("A leg needs two different stops")
+            self.durations[i, j] = max(minutes, 0.0) * 60
+            await self._repair(list(self.tour))
+            return self._publish()
+
+
+async def _resolve(locations: List[str], api_key: str) -> List[Stop]:
+    """`resolve_stops_async`, falling back to local lookups only while geocoding is unavailable."""
+    try:
+        return await resolve_stops_async(locations, api_key)
+    except UpstreamUnavailable as e:
+        print(f"Resolving stops without the Geocoding API: {e}")
+        return [resolve_stop(None, location) for location in locations]
+
+
+def _grow(matrix: np.ndarray, row: np.ndarray, col: np.ndarray) -> np.ndarray:
+    """Append a node whose outgoing legs are `row` and incoming legs are `col`."""
+    n = matrix.shape[0]
+    grown = np.zeros((n + 1, n + 1), dtype=matrix.dtype)
+    grown[:n, :n] = matrix
+    grown[n, :n] = row
+    grown[:n, n] = col
+    return grown
+
+
+def get(session_id: str) -> Optional[RouteSession]:
+    return sessions.get(session_id)
+
+
+def close(session_id: str) -> bool:
+    return sessions.pop(session_id)
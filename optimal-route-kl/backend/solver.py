@@ -0,0 +1,241 @@
+"""
+Waypoint ordering solver.
+
+Takes a square travel-time matrix (seconds) with a fixed start and end node
+and returns the visiting order that minimises total travel time.
+
+- Small instances are solved exactly with Held-Karp dynamic programming over
+  bitmasks (vectorised per subset size).
+- Larger instances use a vectorised nearest-neighbour construction followed by
+  2-opt and Or-opt local search.
+
+Matrices may be asymmetric (driving times usually are). float32 matrices (as
+built by `routes_api` for large stop counts) are used as-is rather than copied
+to float64; sums that decide moves are still accumulated in float64.
+"""
+import time
+from functools import lru_cache
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+# Up to this many intermediate stops we solve exactly (2^12 * 12 states).
+HELD_KARP_MAX_STOPS = 12
+
+# Wall-clock budget for the local-search phase of the heuristic.
+DEFAULT_TIME_LIMIT = 0.5
+
+
+def _as_matrix(matrix) -> np.ndarray:
+    m = np.asarray(matrix)
+    return m if m.dtype == np.float32 else m.astype(np.float64, copy=False)
+
+
+def route_cost(matrix, order: List[int]) -> float:
+    """Total travel time of visiting `order` in sequence."""
+    m = _as_matrix(matrix)
+    idx = np.asarray(order, dtype=np.intp)
+    if len(idx) < 2:
+        return 0.0
+    return float(m[idx[:-1], idx[1:]].sum(dtype=np.float64))
+
+
+def solve(matrix, start: int = 0, end: Optional[int] = None,
+          time_limit: float = DEFAULT_TIME_LIMIT) -> List[int]:
+    """
+    Return the full visiting order (start ... end) over every node in `matrix`.
+
+    `end` defaults to the last node. If `end == start` the route is a round trip
+    and the start node appears at both ends of the returned list.
+    """
+    m = _as_matrix(matrix)
+    if m.ndim != 2 or m.shape[0] != m.shape[1]:
+        raise ValueError("Travel-time matrix must be square")
+    n = m.shape[0]
+    if end is None:
+        end = n - 1
+    if not (0 <= start < n and 0 <= end < n):
+        raise ValueError("Start/end index out of range")
+
+    stops = np.array([i for i in range(n) if i != start and i != end], dtype=np.intp)
+    if len(stops) <= 1:
+        return [start, *stops.tolist(), end]
+
+    if len(stops) <= HELD_KARP_MAX_STOPS:
+        middle = _held_karp(m.astype(np.float64, copy=False), start, end, stops)
+    else:
+        middle = _heuristic(m, start, end, stops, time_limit)
+    return [start, *middle, end]
+
+
+@lru_cache(maxsize=None)
+def _subset_layers(k: int) -> Tuple[np.ndarray, Tuple[np.ndarray, ...]]:
+    """
+    Single-stop bitmasks and, for each subset size, every mask of that size.
+    Depends only on `k`, so it is built once per process (`preload_tables`
+    builds them all up front) and shared read-only between calls.
+    """
+    bits = (1 << np.arange(k)).astype(np.int64)
+    masks = np.arange(1 << k, dtype=np.int64)
+    popcount = np.zeros(1 << k, dtype=np.int64)
+    for b in bits:
+        popcount += (masks & b) > 0
+    layers = tuple(masks[popcount == size] for size in range(k + 1))
+    for array in (bits, *layers):
+        array.setflags(write=False)
+    return bits, layers
+
+
+def preload_tables():
+    """Build the Held-Karp subset tables for every size solved exactly."""
+    for k in range(2, HELD_KARP_MAX_STOPS + 1):
+        _subset_layers(k)
+
+
+def _held_karp(m: np.ndarray, start: int, end: int, stops: np.ndarray) -> List[int]:
+    """Exact open-path DP. dp[mask, j] = cheapest start->...->j covering `mask`."""
+    k = len(stops)
+    full = (1 << k) - 1
+    w = m[np.ix_(stops, stops)]          # w[i, j] = time stop i -> stop j
+    bits, layers = _subset_layers(k)
+
+    dp = np.full((1 << k, k), np.inf)
+    parent = np.full((1 << k, k), -1, dtype=np.int16)
+    dp[bits, np.arange(k)] = m[start, stops]
+
+    for size in range(2, k + 1):
+        layer = layers[size]                                 # (L,)
+        prev = layer[:, None] ^ bits[None, :]                # (L, k): mask without j
+        # cand[l, j, i] = dp[prev[l, j], i] + w[i, j]
+        cand = dp[prev] + w.T[None, :, :]
+        best_i = np.argmin(cand, axis=2)
+        best = np.take_along_axis(cand, best_i[:, :, None], axis=2)[:, :, 0]
+        has_j = (layer[:, None] & bits[None, :]) > 0
+        best = np.where(has_j, best, np.inf)
+        dp[layer] = best
+        parent[layer] = np.where(has_j, best_i, -1)
+
+    last = int(np.argmin(dp[full] + m[stops, end]))
+    order = []
+    mask = full
+    j = last
+    while j >= 0:
+        order.append(j)
+        nxt = int(parent[mask, j])
+        mask ^= 1 << j
+        j = nxt
+    order.reverse()
+    return stops[order].tolist()
+
+
+def _nearest_neighbour(m: np.ndarray, start: int, stops: np.ndarray) -> np.ndarray:
+    remaining = np.ones(len(stops), dtype=bool)
+    sub = m[np.ix_(stops, stops)]
+    first_row = m[start, stops]
+    order = np.empty(len(stops), dtype=np.intp)
+    row = first_row
+    for pos in range(len(stops)):
+        cur = int(np.argmin(np.where(remaining, row, np.inf)))
+        order[pos] = cur
+        remaining[cur] = False
+        row = sub[cur]
+    return stops[order]
+
+
+def _two_opt_move(m: np.ndarray, path: np.ndarray) -> bool:
+    """Apply the best improving segment reversal. Endpoints stay fixed."""
+    n = len(path)
+    fwd = m[path[:-1], path[1:]]
+    bwd = m[path[1:], path[:-1]]
+    F = np.concatenate(([0.0], np.cumsum(fwd, dtype=np.float64)))
+    B = np.concatenate(([0.0], np.cumsum(bwd, dtype=np.float64)))
+
+    i, j = np.triu_indices(n - 1, k=1)           # reverse path[i..j]
+    keep = i >= 1
+    i, j = i[keep], j[keep]
+    if len(i) == 0:
+        return False
+    before = m[path[i - 1], path[i]] + (F[j] - F[i]) + m[path[j], path[j + 1]]
+    after = m[path[i - 1], path[j]] + (B[j] - B[i]) + m[path[i], path[j + 1]]
+    delta = after - before
+    best = int(np.argmin(delta))
+    if delta[best] >= -1e-9:
+        return False
+    a, b = int(i[best]), int(j[best])
+    path[a:b + 1] = path[a:b + 1][::-1]
+    return True
+
+
+def _or_opt_move(m: np.ndarray, path: np.ndarray, max_segment: int = 3) -> bool:
+    """Apply the best improving relocation of a 1..3 stop segment."""
+    n = len(path)
+    best_delta, best_move = -1e-9, None
+    for seg in range(1, max_segment + 1):
+        i = np.arange(1, n - seg)                    # segment path[i : i+seg]
+        if len(i) == 0:
+            break
+        head, tail = path[i], path[i + seg - 1]
+        removal = (m[path[i - 1], head].astype(np.float64) + m[tail, path[i + seg]]
+                   - m[path[i - 1], path[i + seg]])
+        k = np.arange(n - 1)                          # insert between path[k], path[k+1]
+        insert = (m[path[k][None, :], head[:, None]].astype(np.float64)
+                  + m[tail[:, None], path[k + 1][None, :]]
+                  - m[path[k], path[k + 1]][None, :])
+        invalid = (k[None, :] >= (i - 1)[:, None]) & (k[None, :] <= (i + seg - 1)[:, None])
+        delta = np.where(invalid, np.inf, insert - removal[:, None])
+        flat = int(np.argmin(delta))
+        r, c = divmod(flat, delta.shape[1])
+        if delta[r, c] < best_delta:
+            best_delta, best_move = delta[r, c], (int(i[r]), seg, int(k[c]))
+    if best_move is None:
+        return False
+    start, seg, k = best_move
+    segment = path[start:start + seg].copy()
+    rest = np.concatenate((path[:start], path[start + seg:]))
+    pos = k + 1 if k < start else k + 1 - seg
+    path[:] = np.concatenate((rest[:pos], segment, rest[pos:]))
+    return True
+
+
+def _local_search(m: np.ndarray, path: np.ndarray, deadline: float):
+    while time.perf_counter() < deadline:
+        improved = _two_opt_move(m, path)
+        if not improved:
+            improved = _or_opt_move(m, path)
+        if not improved:
+            break
+
+
+def _heuristic(m: np.ndarray, start: int, end: int, stops: np.ndarray,
+               time_limit: float) -> List[int]:
+    deadline = time.perf_counter() + time_limit
+    path = np.concatenate(([start], _nearest_neighbour(m, start, stops), [end])).astype(np.intp)
+    _local_search(m, path, deadline)
+    return path[1:-1].tolist()
+
+
+def insert_cheapest(matrix, order: List[int], node: int) -> List[int]:
+    """Insert `node` into `order` (fixed endpoints) where it adds the least time."""
+    m = _as_matrix(matrix)
+    idx = np.asarray(order, dtype=np.intp)
+    delta = m[idx[:-1], node].astype(np.float64) + m[node, idx[1:]] - m[idx[:-1], idx[1:]]
+    at = int(np.argmin(delta)) + 1
+    return [*order[:at], node, *order[at:]]
+
+
+def improve(matrix, order: List[int], time_limit: float = DEFAULT_TIME_LIMIT) -> List[int]:
+    """
+    Repair an existing order (start ... end) with 2-opt and Or-opt moves instead
+    of solving from scratch. Small orders are re-solved exactly, which is
+    already fast enough.
+    """
+    m = _as_matrix(matrix)
+    if len(order) - 2 <= HELD_KARP_MAX_STOPS:
+        stops = np.asarray(order[1:-1], dtype=np.intp)
+        if len(stops) <= 1:
+            return list(order)
+        return [order[0], *_held_karp(m.astype(np.float64, copy=False), order[0], order[-1], stops),
+                order[-1]]
+    path = np.asarray(order, dtype=np.intp).copy()
+    _local_search(m, path, time.perf_counter() + time_limit)
+    return path.tolist()
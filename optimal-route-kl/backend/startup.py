@@ -0,0 +1,107 @@
+"""
+Cold-start work: what each process loads before it serves, and when.
+
+Importing either app is kept cheap (clients, `requests` and googlemaps are
+built or imported on first use) so the port opens quickly. `warm()` then does
+the one-off work a first request would otherwise pay for:
+
+- solver subset tables for every exactly-solved stop count
+- the gazetteer and the local road-graph index, when configured
+- the freshest persisted cache entries (ROUTE_CACHE_DB) into memory
+- the upstream TLS context, plus any imports or clients the app defers
+- one small solve of each kind, so NumPy's code paths are paged in
+
+STARTUP_WARM picks when that happens:
+
+- "background" (default): each app starts `warm()` on a thread at startup;
+  GET /api/ready answers 503 until it finishes, so a readiness or startup
+  probe holds traffic back while the process is already listening
+- "off": nothing is preloaded and /api/ready is 200 at once; the first
+  requests load what they need
+
+Under gunicorn (`gunicorn.conf.py`, as in the Dockerfile) the master imports
+the app and runs `warm()` before forking, so every worker starts ready and
+shares the loaded pages copy-on-write instead of loading its own copy.
+"""
+import importlib
+import os
+import threading
+import time
+from typing import Callable, Dict, Optional, Sequence
+
+import numpy as np
+
+import cache
+import geocoding
+import http_client
+import road_graph
+import solver
+
+STARTUP_WARM = os.environ.get("STARTUP_WARM", "background")
+
+_ready = threading.Event()
+_lock = threading.Lock()
+_timings: Dict[str, float] = {}
+_thread: Optional[threading.Thread] = None
+
+
+def _solve_samples():
+    rng = np.random.default_rng(0)
+    for n in (solver.HELD_KARP_MAX_STOPS + 2, solver.HELD_KARP_MAX_STOPS + 8):
+        solver.solve(rng.uniform(60, 600, (n, n)), time_limit=0.05)
+
+
+def warm(imports: Sequence[str] = (), clients: Sequence[Callable[[], object]] = ()) -> Dict[str, float]:
+    """
+    Preload everything listed in the module docstring, then mark the process
+    ready. `imports` are module names and `clients` are zero-argument
+    factories the app otherwise calls on first use. Idempotent; returns the
+    seconds each step took.
+    """
+    with _lock:
+        if _ready.is_set():
+            return dict(_timings)
+        steps = [
+            ("solver_tables", solver.preload_tables),
+            ("gazetteer", geocoding.get_gazetteer),
+            ("road_graph", road_graph.get_default),
+            ("caches", cache.preload_all),
+            ("tls", http_client.ssl_context),
+            *((f"import:{name}", lambda name=name: importlib.import_module(name))
+              for name in imports),
+            *((f"client:{getattr(factory, '__name__', 'client')}", factory) for factory in clients),
+            ("solve", _solve_samples),
+        ]
+        for name, step in steps:
+            started = time.perf_counter()
+            try:
+                step()
+            except Exception as e:
+                # A failed step is loaded lazily later, as with STARTUP_WARM=off
+                print(f"Error warming {name}: {e}")
+            _timings[name] = round(time.perf_counter() - started, 4)
+        _ready.set()
+        return dict(_timings)
+
+
+def start(imports: Sequence[str] = (), clients: Sequence[Callable[[], object]] = ()):
+    """Begin warming as STARTUP_WARM says, unless this process (or its preloading master) already has."""
+    global _thread
+    if STARTUP_WARM == "off":
+        _ready.set()
+        return
+    with _lock:
+        if _ready.is_set() or (_thread is not None and _thread.is_alive()):
+            return
+        _thread = threading.Thread(target=warm, args=(imports, clients), name="startup-warm",
+                                   daemon=True)
+        _thread.start()
+
+
+def is_ready() -> bool:
+    return _ready.is_set()
+
+
+def status() -> Dict[str, object]:
+    """/api/ready body: whether warm-up finished and what each step cost."""
+    return {"ready": is_ready(), "warm_seconds": dict(_timings) if is_ready() else {}}
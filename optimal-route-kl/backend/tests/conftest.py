@@ -0,0 +1,36 @@
+import httpx
+import pytest
+
+import advisory
+import batch
+import cache
+import geocoding
+import http_client
+import sessions
+
+
+def reset_shared_state():
+    """Empty every process-wide cache and index the apps keep between requests."""
+    for c in (cache.geocode_cache, cache.leg_cache, cache.route_cache, cache.advisory_cache,
+              sessions.sessions):
+        c.clear()
+    advisory._tasks.clear()
+    geocoding.known_points.clear()
+    http_client.configure(None)
+
+
+@pytest.fixture
+def mock_upstream(monkeypatch):
+    """
+    Returns `install(handler)`, which routes every upstream call to `handler`
+    through an `httpx.MockTransport`. Shared state is reset before and after.
+    """
+    monkeypatch.setenv("MAPS_API_KEY", "test-key")
+    reset_shared_state()
+
+    def install(handler):
+        http_client.configure(httpx.MockTransport(handler))
+
+    yield install
+    reset_shared_state()
+    batch.shutdown()
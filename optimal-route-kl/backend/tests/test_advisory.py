@@ -0,0 +1,102 @@
+import asyncio
+import json
+import threading
+import time
+from datetime import datetime
+
+import httpx
+import pytest
+from httpx import AsyncClient
+
+import advisory
+import cache
+from main import app
+
+
+def llm_reply(content):
+    return httpx.Response(200, json={"choices": [{"message": {"content": json.dumps(content)}}]})
+
+
+@pytest.fixture
+def llm(mock_upstream):
+    calls = []
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        if request.url.path.endswith(":computeRoutes"):
+            return httpx.Response(200, json={"routes": [{"duration": "600s", "distanceMeters": 8000}]})
+        calls.append(request.url.path)
+        await asyncio.sleep(0.1)
+        return llm_reply({"analysis": "Expect traffic near KLCC.", "buffer_minutes": 10})
+
+    mock_upstream(handler)
+    yield calls
+
+
+def test_key_ignores_spelling_and_nearby_coordinates_but_not_the_hour():
+    rush = datetime(2026, 10, 14, 8, 5, tzinfo=cache.KL_TZ)
+    key = advisory.advisory_key(["KLCC", "3.13901,101.68690", "Mid Valley"], rush)
+    assert key == advisory.advisory_key(["  klcc", "3.1392, 101.6871", "MID   VALLEY"],
+                                        rush.replace(minute=55))
+    assert key != advisory.advisory_key(["KLCC", "3.13901,101.68690", "Mid Valley"],
+                                        rush.replace(hour=9))
+    assert key != advisory.advisory_key(["Mid Valley", "3.13901,101.68690", "KLCC"], rush)
+
+
+@pytest.mark.asyncio
+async def test_concurrent_requests_share_one_upstream_call(llm):
+    route = ["Bangsar South", "KLCC", "Petaling Jaya"]
+    results = await asyncio.gather(*(advisory.get_llm_analysis_and_buffer_async(route)
+                                     for _ in range(5)))
+    assert len(llm) == 1 and all(r["buffer_minutes"] == 10 for r in results)
+
+    await advisory.get_llm_analysis_and_buffer_async(["bangsar south", "klcc", "petaling jaya"])
+    assert len(llm) == 1
+
+
+def test_blocking_callers_share_one_upstream_call(monkeypatch):
+    cache.advisory_cache.clear()
+    calls = []
+
+    def fetch(route_sequence):
+        calls.append(route_sequence)
+        time.sleep(0.1)
+        return {"analysis": "Clear roads.", "buffer_minutes": 5}
+
+    monkeypatch.setattr(advisory, "_fetch", fetch)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(
+        advisory.get_llm_analysis_and_buffer(["Bangsar South", "KLCC"]))) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(calls) == 1 and [r["buffer_minutes"] for r in results] == [5] * 4
+
+
+def test_failures_are_cached_briefly(monkeypatch):
+    cache.advisory_cache.clear()
+    monkeypatch.setattr(advisory, "_fetch", lambda route_sequence: None)
+    assert advisory.get_llm_analysis_and_buffer(["KLCC", "PJ"]) == advisory.UNAVAILABLE
+    monkeypatch.setattr(advisory, "_fetch", lambda route_sequence: pytest.fail("retried"))
+    assert advisory.get_llm_analysis_and_buffer(["KLCC", "PJ"]) == advisory.UNAVAILABLE
+
+
+@pytest.mark.asyncio
+async def test_background_advisory_arrives_later(llm):
+    payload = {"start_location": "3.10,101.60", "friend_locations": ["3.12,101.62"],
+               "final_destination": "3.15,101.70"}
+    async with AsyncClient(app=app, base_url="http://test") as client:
+        r = await client.post("/api/optimize_route?advisory=background", json=payload)
+        data = r.json()
+        assert r.status_code == 200 and data["llm_analysis"] is None
+        status = (await client.get(f"/api/advisory/{data['advisory_id']}")).json()
+        assert status == {"status": "pending"}
+
+        await asyncio.sleep(0.2)
+        status = (await client.get(f"/api/advisory/{data['advisory_id']}")).json()
+        assert status["status"] == "ready" and status["buffer_minutes"] == 10
+
+        # Now cached: answered inline even in background mode
+        r = await client.post("/api/optimize_route?advisory=background", json=payload)
+        assert r.json()["llm_buffer_minutes"] == 10
+        assert (await client.get("/api/advisory/unknown")).status_code == 404
@@ -0,0 +1,104 @@
+import asyncio
+import json
+
+import httpx
+import pytest
+from httpx import AsyncClient
+
+import http_client
+from main import app
+
+LATENCY = 0.2
+
+
+def fake_upstream(calls, overlaps):
+    """
+    Every call sleeps LATENCY; `overlaps` records, as each call starts, the
+    sorted paths of all calls in flight at that moment (itself included).
+    """
+    in_flight = []
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        calls.append(request.url.path)
+        in_flight.append(request.url.path)
+        overlaps.append(sorted(in_flight))
+        try:
+            await asyncio.sleep(LATENCY)
+            return respond(request)
+        finally:
+            in_flight.remove(request.url.path)
+    return handler
+
+
+def respond(request: httpx.Request) -> httpx.Response:
+    if request.url.path.endswith("/geocode/json"):
+        seed = len(request.url.params["address"])
+        return httpx.Response(200, json={"results": [
+            {"geometry": {"location": {"lat": 3.1 + seed / 1000, "lng": 101.6 + seed / 1000}}}
+        ]})
+    body = json.loads(request.content)
+    if request.url.path.endswith(":computeRouteMatrix"):
+        return httpx.Response(200, json=[
+            {"originIndex": i, "destinationIndex": j, "duration": f"{60 * abs(i - j) + 60}s",
+             "distanceMeters": 1000}
+            for i in range(len(body["origins"])) for j in range(len(body["destinations"]))
+        ])
+    if request.url.path.endswith(":computeRoutes"):
+        return httpx.Response(200, json={"routes": [{"duration": "900s", "distanceMeters": 12000}]})
+    content = json.dumps({"analysis": "Expect traffic near KLCC.", "buffer_minutes": 10})
+    return httpx.Response(200, json={"choices": [{"message": {"content": content}}]})
+
+
+@pytest.fixture
+def overlaps():
+    return []
+
+
+@pytest.fixture
+def upstream(mock_upstream, overlaps):
+    calls = []
+    mock_upstream(fake_upstream(calls, overlaps))
+    yield calls
+
+
+@pytest.mark.asyncio
+async def test_optimize_route_overlaps_upstream_calls(upstream, overlaps):
+    payload = {
+        "start_location": "Bangsar South",
+        "friend_locations": ["KLCC", "Mid Valley Megamall", "Bukit Bintang"],
+        "final_destination": "Petaling Jaya",
+    }
+    async with AsyncClient(app=app, base_url="http://test") as client:
+        r = await client.post("/api/optimize_route", json=payload)
+
+    assert r.status_code == 200
+    data = r.json()
+    assert data["llm_buffer_minutes"] == 10
+    assert sorted(data["optimal_sequence"][1:-1]) == sorted(payload["friend_locations"])
+    assert upstream.count("/maps/api/geocode/json") == 5
+    # geocode (x5 in parallel), matrix, then routes + advisory in parallel
+    assert max(overlaps, key=len) == ["/maps/api/geocode/json"] * 5
+    assert ["/api/v1/chat/completions", "/directions/v2:computeRoutes"] in overlaps
+
+
+@pytest.mark.asyncio
+async def test_optimize_reports_upstream_http_errors(upstream):
+    # 4xx other than 429 are not retried and come back with the upstream's details
+    http_client.configure(httpx.MockTransport(lambda request: httpx.Response(403, json={"error": "denied"})))
+    async with AsyncClient(app=app, base_url="http://test") as client:
+        r = await client.post("/api/optimize", json={"locations": ["3.15,101.71", "3.14,101.69"]})
+    assert r.status_code == 500
+    assert r.json()["details"] == {"error": "denied"}
+
+
+@pytest.mark.asyncio
+async def test_long_routes_are_built_from_a_tiled_matrix(upstream, overlaps):
+    locations = [f"{3.0 + i / 200:.3f},{101.6 + (i % 7) / 100:.2f}" for i in range(40)]
+    async with AsyncClient(app=app, base_url="http://test") as client:
+        r = await client.post("/api/optimize", json={"locations": locations})
+
+    assert r.status_code == 200
+    assert sorted(p["input"] for p in r.json()["route"]) == sorted(locations)
+    # 40 x 40 in four 25 x 25 tiles, fetched concurrently; too many waypoints for computeRoutes
+    assert upstream == ["/distanceMatrix/v2:computeRouteMatrix"] * 4
+    assert len(overlaps[-1]) == 4
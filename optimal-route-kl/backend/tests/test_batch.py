@@ -0,0 +1,64 @@
+import json
+
+import httpx
+import pytest
+from httpx import AsyncClient
+
+import batch
+from main import app
+
+
+@pytest.fixture
+def upstream(mock_upstream):
+    calls = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        calls.append(request)
+        if request.url.path.endswith("/geocode/json"):
+            seed = len(request.url.params["address"])
+            return httpx.Response(200, json={"results": [
+                {"geometry": {"location": {"lat": 3.0 + seed / 100, "lng": 101.5 + seed / 100}}}
+            ]})
+        body = json.loads(request.content)
+        return httpx.Response(200, json=[
+            {"originIndex": i, "destinationIndex": j, "duration": f"{120 * (i + j) + 60}s",
+             "distanceMeters": 500 * (i + j) + 500}
+            for i in range(len(body["origins"])) for j in range(len(body["destinations"]))
+        ])
+
+    mock_upstream(handler)
+    yield calls
+
+
+@pytest.mark.asyncio
+async def test_batch_streams_one_line_per_job(upstream):
+    jobs = [
+        {"locations": ["Bangsar", "KLCC", "Mid Valley", "Cheras", "Bangsar"]},
+        {"locations": ["Bangsar", "Mid Valley", "KLCC"]},
+        {"locations": ["only-one"]},
+    ]
+    async with AsyncClient(app=app, base_url="http://test") as client:
+        r = await client.post("/api/optimize/batch", json={"jobs": jobs})
+
+    assert r.status_code == 200
+    assert r.headers["content-type"].startswith("application/x-ndjson")
+    results = {res["index"]: res for res in map(json.loads, r.text.splitlines())}
+    assert set(results) == {0, 1, 2}
+    assert "error" in results[2]
+
+    first = results[0]
+    assert [p["input"] for p in first["route"]][0] == "Bangsar"
+    assert sorted(p["input"] for p in first["route"][1:-1]) == ["Cheras", "KLCC", "Mid Valley"]
+    assert len(first["legs"]) == 4 and first["route"][0]["coord"] is not None
+
+    geocoded = [c.url.params["address"] for c in upstream if c.url.path.endswith("/geocode/json")]
+    assert sorted(geocoded) == ["Bangsar", "Cheras", "KLCC", "Mid Valley"]
+    # The solver pool is not forked from the threaded API process
+    assert batch._get_pool()._mp_context.get_start_method() in ("forkserver", "spawn")
+
+
+@pytest.mark.asyncio
+async def test_batch_rejects_empty_request(upstream):
+    async with AsyncClient(app=app, base_url="http://test") as client:
+        r = await client.post("/api/optimize/batch", json={"jobs": []})
+    assert r.status_code == 400
@@ -0,0 +1,143 @@
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+import requests
+
+import cache
+import http_client
+import resilience
+import routes_api
+from cache import KL_TZ, SQLiteStore, TTLCache
+
+
+def test_lru_eviction_and_ttl(monkeypatch):
+    c = TTLCache("t", maxsize=2, ttl=60)
+    c.set("a", 1)
+    c.set("b", 2)
+    assert c.get("a") == 1          # "a" is now most recently used
+    c.set("c", 3)                   # evicts "b"
+    assert c.get("b") is None
+    assert c.stats()["evictions"] == 1
+
+    now = time.time()
+    monkeypatch.setattr(cache.time, "time", lambda: now + 61)
+    assert c.get("a") is None
+    assert c.stats()["hits"] == 1 and c.stats()["misses"] == 2
+
+
+def test_sqlite_store_survives_new_cache(tmp_path):
+    store = SQLiteStore(str(tmp_path / "cache.db"))
+    TTLCache("geocode", store=store).set("klcc", {"lat": 3.1579, "lng": 101.7116})
+    fresh = TTLCache("geocode", store=SQLiteStore(str(tmp_path / "cache.db")))
+    assert fresh.get("klcc") == {"lat": 3.1579, "lng": 101.7116}
+
+
+def test_bulk_writes_and_reads_are_one_sqlite_statement(tmp_path):
+    store = SQLiteStore(str(tmp_path / "cache.db"))
+    statements = []
+    store._conn.set_trace_callback(statements.append)
+    legs = [(f"{i}|{j}|Mon0800", [60 * i, 100 * j]) for i in range(25) for j in range(25)]
+    TTLCache("leg", store=store).set_many(legs, ttl=300)
+    assert sum(s.startswith("COMMIT") for s in statements) == 1
+
+    statements.clear()
+    fresh = TTLCache("leg", maxsize=1000, store=store)
+    found = fresh.get_many([key for key, _ in legs] + ["missing"])
+    assert found == dict(legs) and sum(s.startswith("SELECT") for s in statements) == 1
+    assert fresh.stats()["hits"] == 625 and fresh.stats()["misses"] == 1
+    assert fresh.get_many(["0|0|Mon0800"]) == {"0|0|Mon0800": [0, 0]}      # now in memory
+
+
+def test_traffic_ttl_is_shorter_at_rush_hour():
+    rush = datetime(2024, 5, 6, 8, 30, tzinfo=KL_TZ)   # Monday morning
+    night = datetime(2024, 5, 6, 2, 0, tzinfo=KL_TZ)
+    assert cache.traffic_ttl(rush) < cache.traffic_ttl(night)
+
+
+def test_entries_stay_readable_until_they_expire():
+    # Every minute of a week: an entry's key is still current for its whole TTL
+    monday = datetime(2024, 5, 6, tzinfo=KL_TZ)
+    for minute in range(0, 7 * 24 * 60, 7):
+        now = monday + timedelta(minutes=minute)
+        ttl = cache.traffic_ttl(now)
+        assert ttl > 0
+        assert cache.time_bucket(now + timedelta(seconds=ttl - 1)) == cache.time_bucket(now)
+    # The night is one bucket, so its two-hour entries are not cut off every 15 minutes
+    assert cache.time_bucket(monday.replace(hour=23, minute=10)) == \
+        cache.time_bucket(monday.replace(day=7, hour=5, minute=50))
+    assert cache.traffic_ttl(monday.replace(hour=1)) == 2 * 60 * 60
+    assert cache.normalize_address("  KLCC ,Kuala   Lumpur ") == "klcc, kuala lumpur"
+
+
+class FakeResponse:
+    content = b""
+    request = None
+    headers = {}
+
+    def __init__(self, data, status_code=200):
+        self.data = data
+        self.status_code = status_code
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return self.data
+
+
+def test_matrix_only_fetches_uncached_legs(monkeypatch):
+    cache.leg_cache.clear()
+    requests_made = []
+
+    def fake_post(session, url, json=None, headers=None, **kwargs):
+        requests_made.append(json)
+        return FakeResponse([
+            {"originIndex": i, "destinationIndex": j, "duration": f"{60 * (i + j + 1)}s",
+             "distanceMeters": 1000, "condition": "ROUTE_EXISTS"}
+            for i in range(len(json["origins"])) for j in range(len(json["destinations"]))
+        ])
+
+    monkeypatch.setattr(requests.Session, "post", fake_post)
+    stops = [routes_api.resolve_stop(None, loc) for loc in ["3.15,101.71", "3.14,101.69", "3.13,101.68"]]
+    first, _, _ = routes_api.fetch_travel_time_matrix(stops, "key")
+    second, _, _ = routes_api.fetch_travel_time_matrix(stops, "key")
+    assert len(requests_made) == 1
+    assert (first == second).all()
+
+    routes_api.fetch_travel_time_matrix(stops + [routes_api.resolve_stop(None, "3.12,101.67")], "key")
+    assert len(requests_made) == 2
+    assert len(requests_made[1]["origins"]) == 4 and len(requests_made[1]["destinations"]) == 4
+
+
+def test_large_matrices_are_fetched_in_tiles(monkeypatch):
+    cache.leg_cache.clear()
+    requests_made = []
+
+    def fake_post(session, url, json=None, headers=None, **kwargs):
+        requests_made.append(json)
+        if json["origins"][0]["waypoint"]["location"]["latLng"]["latitude"] >= 3.25:
+            return FakeResponse([], status_code=503)
+        return FakeResponse([
+            {"originIndex": i, "destinationIndex": j, "duration": "600s", "distanceMeters": 1000}
+            for i in range(len(json["origins"])) for j in range(len(json["destinations"]))
+        ])
+
+    monkeypatch.setattr(requests.Session, "post", fake_post)
+    monkeypatch.setattr(resilience, "UPSTREAM_RETRIES", 0)
+    monkeypatch.setattr(routes_api, "MATRIX_MEMMAP_ELEMENTS", 100)
+    monkeypatch.setattr(cache.leg_cache, "maxsize", 100)
+    # Stops 25..29 (latitude >= 3.25) are in the tiles that fail
+    stops = [routes_api.resolve_stop(None, f"{3.0 + i / 100:.2f},101.60") for i in range(30)]
+    durations, distances, estimated = routes_api.fetch_travel_time_matrix(stops, "key")
+
+    assert len(requests_made) == 4
+    assert all(len(r["origins"]) * len(r["destinations"]) <= 625 for r in requests_made)
+    assert isinstance(durations, np.memmap) and durations.dtype == np.float32
+    assert durations[0, 1] == 600 and durations[0, 29] == 600
+    # 1.11 km apart: estimated from the straight line, not left unreachable
+    assert 1000 < distances[29, 28] < 2000 and durations[29, 28] < 600
+    assert durations[29, 29] == 0
+    assert estimated == 2
+    # Too big for the leg cache, so it was left alone
+    assert cache.leg_cache.stats()["size"] == 0
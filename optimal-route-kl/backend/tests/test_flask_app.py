@@ -0,0 +1,75 @@
+import threading
+import time
+
+import pytest
+import requests
+
+# The Flask app's dependencies are in requirements-flask.txt, which CI does not install
+pytest.importorskip("flask")
+
+import app as flask_app  # noqa: E402
+import http_client
+import metrics
+import resilience
+import startup
+from routes_api import DEGRADED_NOTICE
+
+STOPS = ["3.10,101.60", "3.30,101.60", "3.20,101.60", "3.40,101.60"]
+
+
+@pytest.fixture
+def client(monkeypatch, mock_upstream):
+    # Coordinate stops never reach the Maps client; it only has to exist
+    monkeypatch.setattr(flask_app, "get_gmaps", lambda: object())
+    return flask_app.app.test_client()
+
+
+def test_endpoints_degrade_while_the_breaker_is_open(client, monkeypatch):
+    def unreachable(session, url, **kwargs):
+        if "openrouter" not in url:
+            pytest.fail(f"called {url}")
+        raise requests.exceptions.ConnectionError(url)
+
+    monkeypatch.setattr(requests.Session, "post", unreachable)
+    http_client._guard("route_matrix").breaker._opened_at = time.monotonic()
+    degraded = metrics.DEGRADED.value(app="flask", route="/api/optimize")
+
+    r = client.post("/api/optimize", json={"locations": STOPS})
+    assert r.status_code == 200
+    assert r.json["degraded"] is True and r.json["notice"] == DEGRADED_NOTICE
+    assert [p["input"] for p in r.json["route"]] == sorted(STOPS)
+    assert metrics.DEGRADED.value(app="flask", route="/api/optimize") == degraded + 1
+
+    r = client.post("/api/optimize_route", json={"start_location": STOPS[0],
+                                                 "friend_locations": STOPS[1:-1],
+                                                 "final_destination": STOPS[-1]})
+    assert r.status_code == 200 and r.json["degraded"] is True
+    assert r.json["optimal_sequence"] == sorted(STOPS) and r.json["directions"] is None
+    assert client.get("/api/status").json["upstream"]["route_matrix"] == "open"
+
+
+def test_requests_past_the_in_flight_limit_are_shed(client, monkeypatch):
+    monkeypatch.setattr(resilience, "MAX_IN_FLIGHT_REQUESTS", 1)
+    shed = metrics.SHED.value(app="flask")
+    metrics.IN_FLIGHT.inc(app="flask")          # one request already being served
+    try:
+        r = client.post("/api/optimize", json={"locations": STOPS})
+        assert r.status_code == 503 and r.headers["Retry-After"] == "1"
+        assert metrics.SHED.value(app="flask") == shed + 1
+        # Probes and scrapes are still answered
+        for path in ("/api/ready", "/metrics", "/api/status"):
+            assert "Retry-After" not in client.get(path).headers
+        assert metrics.SHED.value(app="flask") == shed + 1
+    finally:
+        metrics.IN_FLIGHT.dec(app="flask")
+
+
+def test_ready_answers_503_until_warm_up_finishes(client, monkeypatch):
+    monkeypatch.setattr(startup, "_ready", threading.Event())
+    monkeypatch.setattr(startup, "_timings", {})
+    r = client.get("/api/ready")
+    assert r.status_code == 503 and r.json == {"ready": False, "warm_seconds": {}}
+
+    startup.warm(imports=("json",), clients=(lambda: None,))
+    r = client.get("/api/ready")
+    assert r.status_code == 200 and r.json["ready"] is True
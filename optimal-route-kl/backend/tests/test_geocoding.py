@@ -0,0 +1,77 @@
+import math
+import os
+import subprocess
+import sys
+
+import httpx
+import numpy as np
+import pytest
+
+import geocoding
+import routes_api
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_parse_coordinates_column():
+    lat, lng = geocoding.parse_coordinates(
+        ["3.1390, 101.6869", "KLCC", "", " -2.5,100 ", "91,0", "1,2,3", "3.15,101.7"]
+    )
+    assert np.allclose(lat[[0, 3, 6]], [3.139, -2.5, 3.15])
+    assert np.allclose(lng[[0, 3, 6]], [101.6869, 100, 101.7])
+    assert np.isnan(lat[[1, 2, 4, 5]]).all() and np.isnan(lng[[1, 2, 4, 5]]).all()
+
+
+def test_stable_coordinate_does_not_depend_on_hash_seed():
+    script = "import geocoding; print(geocoding.stable_coordinate('Mid Valley Megamall'))"
+    outputs = {
+        subprocess.run([sys.executable, "-c", script], cwd=BACKEND, capture_output=True, text=True,
+                       env={**os.environ, "PYTHONHASHSEED": seed}).stdout
+        for seed in ("1", "2")
+    }
+    assert len(outputs) == 1
+    assert geocoding.stable_coordinate(" mid valley   megamall") == \
+        geocoding.stable_coordinate("Mid Valley Megamall")
+
+
+def test_near_duplicates_snap_onto_the_nearest_known_point():
+    index = geocoding.PointIndex(radius_m=15)
+    # ~8 m apart, either side of a grid cell edge: still one key
+    edge = (math.floor(3.139 / index.cell_deg) + 1) * index.cell_deg
+    assert index.snap(edge - 3.5e-5, 101.6869) == (edge - 3.5e-5, 101.6869)
+    assert index.snap(edge + 3.5e-5, 101.6869) == (edge - 3.5e-5, 101.6869)
+    assert index.snap(edge - 3.5e-5, 101.68699) == (edge - 3.5e-5, 101.6869)     # ~10 m east
+    assert index.snap(3.139, 101.6871) == (3.139, 101.6871)                      # ~22 m away
+    # The nearest of two known points wins
+    assert index.snap(3.139, 101.68701) == (3.139, 101.6871)
+    assert geocoding.PointIndex(radius_m=0).snap(3.1, 101.6) == (3.1, 101.6)
+
+
+def test_snapping_only_changes_the_cache_key(mock_upstream):
+    key, waypoint = routes_api.resolve_stop(None, "3.13900,101.68690")
+    near_key, near_waypoint = routes_api.resolve_stop(None, "3.13905,101.68695")   # ~8 m away
+    assert near_key == key == "3.13900,101.68690"
+    assert near_waypoint["location"]["latLng"] == {"latitude": 3.13905, "longitude": 101.68695}
+    assert geocoding.locate(None, "3.13905,101.68695") == {'lat': 3.13905, 'lng': 101.68695}
+
+
+@pytest.mark.asyncio
+async def test_locate_many_resolves_each_distinct_address_once(monkeypatch, mock_upstream):
+    monkeypatch.setattr(geocoding, "_gazetteer", geocoding.Gazetteer({"KLCC": (3.1579, 101.7116)}))
+    geocoded = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        geocoded.append(request.url.params["address"])
+        return httpx.Response(200, json={"results": [
+            {"geometry": {"location": {"lat": 3.11805, "lng": 101.6771}}}
+        ]})
+
+    mock_upstream(handler)
+    coords = await geocoding.locate_many_async(
+        ["Mid Valley", "klcc", "3.11808,101.67715", "mid  valley", "Nowhere", "KLCC"], "test-key"
+    )
+
+    assert sorted(geocoded) == ["Mid Valley", "Nowhere"]
+    assert coords[1] == coords[5] == {'lat': 3.1579, 'lng': 101.7116}
+    assert coords[0] == coords[3] == coords[4] == {'lat': 3.11805, 'lng': 101.6771}
+    assert coords[2] == {'lat': 3.11808, 'lng': 101.67715}        # pasted points are not moved
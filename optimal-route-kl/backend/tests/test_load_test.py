@@ -0,0 +1,34 @@
+import httpx
+
+from benchmarks import load_test
+from benchmarks.fake_upstream import FakeUpstream
+
+
+def test_fake_upstream_serves_matrix_and_injects_errors():
+    waypoint = lambda lat, lng: {"waypoint": {"location": {"latLng": {"latitude": lat,
+                                                                      "longitude": lng}}}}
+    body = {"origins": [waypoint(3.10, 101.60), waypoint(3.12, 101.62)],
+            "destinations": [waypoint(3.12, 101.62)]}
+    with FakeUpstream(latency_ms=0, jitter_ms=0) as upstream:
+        r = httpx.post(f"{upstream.url}/distanceMatrix/v2:computeRouteMatrix", json=body)
+    elements = sorted(r.json(), key=lambda el: el["originIndex"])
+    assert [el["distanceMeters"] > 0 for el in elements] == [True, False]
+
+    with FakeUpstream(latency_ms=0, jitter_ms=0, error_rate=1.0) as upstream:
+        r = httpx.get(f"{upstream.url}/maps/api/geocode/json", params={"address": "KLCC"})
+    assert r.status_code == 503 and upstream.requests == {"geocode": 1}
+
+
+def test_load_test_reports_latency_percentiles():
+    report = load_test.run(apps=["fastapi"], endpoints=["/api/optimize"], stops=[4],
+                           requests=6, concurrency=3, latency_ms=0, jitter_ms=0)
+    (result,) = report["results"]
+    assert result["requests"] == 6 and result["errors"] == 0
+    assert 0 < result["p50_ms"] <= result["p95_ms"] <= result["p99_ms"]
+    assert result["rps"] > 0
+
+
+def test_summary_has_no_percentiles_without_successful_requests():
+    summary = load_test.summarize([], errors=5, elapsed=1.0, peak_rss_mb=None)
+    assert summary["requests"] == summary["errors"] == 5
+    assert summary["p50_ms"] is summary["p95_ms"] is summary["p99_ms"] is None
@@ -0,0 +1,70 @@
+import time
+
+import httpx
+import pytest
+from httpx import AsyncClient
+
+import metrics
+from main import app
+
+
+@pytest.fixture
+def upstream(mock_upstream):
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        return httpx.Response(200, json={"routes": [{"duration": "600s", "distanceMeters": 8000,
+                                                     "legs": []}]})
+
+    mock_upstream(handler)
+    yield
+
+
+@pytest.mark.asyncio
+async def test_metrics_endpoint_reports_requests_stages_upstream_and_caches(upstream):
+    labels = dict(app="fastapi", route="/api/optimize", method="POST", status="200")
+    before = metrics.REQUESTS.value(**labels)
+    routes_calls = metrics.UPSTREAM_REQUESTS.value(service="compute_routes", status="200")
+
+    async with AsyncClient(app=app, base_url="http://test") as client:
+        r = await client.post("/api/optimize", json={"locations": ["3.10,101.60", "3.15,101.70"]})
+        assert r.status_code == 200
+        text = (await client.get("/metrics")).text
+
+    assert metrics.REQUESTS.value(**labels) == before + 1
+    assert metrics.UPSTREAM_REQUESTS.value(service="compute_routes", status="200") == routes_calls + 1
+    assert metrics.UPSTREAM_RECEIVED.value(service="compute_routes") > 0
+    for stage in ("geocode", "compute_routes", "summarize", "serialize"):
+        assert metrics.STAGE_SECONDS.count(stage=stage) > 0
+    assert 'http_requests_total{app="fastapi",route="/api/optimize",method="POST",status="200"}' in text
+    assert 'http_request_duration_seconds_bucket{app="fastapi",route="/api/optimize",le="+Inf"}' in text
+    assert 'cache_misses_total{cache="route"}' in text
+
+
+def test_histogram_buckets_are_cumulative():
+    h = metrics.Histogram("test_seconds", "Test.", ("stage",), buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 5.0):
+        h.observe(value, stage="x")
+    assert h.render()[:3] == ['test_seconds_bucket{stage="x",le="0.1"} 1',
+                              'test_seconds_bucket{stage="x",le="1"} 2',
+                              'test_seconds_bucket{stage="x",le="+Inf"} 3']
+
+
+def busy_wait_for_profiler(seconds):
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        pass
+
+
+def test_slow_request_profiler_writes_folded_stacks(tmp_path):
+    profiler = metrics.SlowRequestProfiler(threshold_ms=20, interval_ms=1, out_dir=str(tmp_path))
+
+    fast = profiler.begin()
+    assert profiler.end(fast, "/api/optimize", 0.001) is None
+
+    slow = profiler.begin()
+    busy_wait_for_profiler(0.1)
+    path = profiler.end(slow, "/api/optimize", 0.1)
+
+    lines = open(path).read().splitlines()
+    assert lines and all(line.rsplit(" ", 1)[1].isdigit() for line in lines)
+    assert any("busy_wait_for_profiler (test_metrics.py" in line for line in lines)
@@ -0,0 +1,232 @@
+import csv
+import json
+import time
+
+import httpx
+import pytest
+from httpx import AsyncClient
+
+import geocoding
+import http_client
+import metrics
+import resilience
+import routes_api
+from main import app
+from resilience import UpstreamUnavailable
+from routes_api import DEGRADED_NOTICE, ROUTES_URL, fallback_route
+
+
+@pytest.fixture
+def fast_retries(monkeypatch, mock_upstream):
+    monkeypatch.setattr(resilience, "UPSTREAM_BACKOFF_BASE", 0.001)
+    monkeypatch.setattr(resilience, "BREAKER_FAILURES", 3)
+    return mock_upstream
+
+
+def test_token_bucket_spaces_out_callers_and_refuses_long_waits():
+    bucket = resilience.TokenBucket(rate=10, burst=2)
+    assert bucket.reserve(1) == bucket.reserve(1) == 0
+    assert bucket.reserve(1) == pytest.approx(0.1, abs=0.01)
+    assert bucket.reserve(0.15) is None
+    assert bucket.reserve(1) == pytest.approx(0.2, abs=0.01)
+
+
+def test_breaker_opens_then_lets_one_probe_through():
+    breaker = resilience.CircuitBreaker(failures=2, reset_seconds=0.05)
+    breaker.record_failure()
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == "open" and not breaker.allow()
+
+    time.sleep(0.06)
+    assert breaker.allow() and not breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == "open"
+
+    time.sleep(0.06)
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == "closed" and breaker.allow()
+
+
+@pytest.mark.asyncio
+async def test_transient_errors_are_retried(fast_retries):
+    statuses = [503, 429, 200]
+    fast_retries(lambda request: httpx.Response(statuses.pop(0), json={}))
+    retries = metrics.UPSTREAM_RETRIES.value(service="compute_routes")
+
+    response = await http_client.post(ROUTES_URL, json={}, headers={})
+    assert response.status_code == 200 and statuses == []
+    assert metrics.UPSTREAM_RETRIES.value(service="compute_routes") == retries + 2
+
+
+@pytest.mark.asyncio
+async def test_calls_past_the_deadline_are_not_made(fast_retries):
+    fast_retries(lambda request: pytest.fail("called upstream"))
+    with resilience.deadline(0):
+        with pytest.raises(UpstreamUnavailable, match="deadline"):
+            await http_client.post(ROUTES_URL, json={}, headers={})
+
+
+def test_fallback_orders_stops_by_straight_line_distance():
+    summary = fallback_route(["3.10,101.60", "3.30,101.60", "3.20,101.60", "3.40,101.60"])
+    assert [p['input'] for p in summary['route']] == ["3.10,101.60", "3.20,101.60",
+                                                      "3.30,101.60", "3.40,101.60"]
+    assert 40 < summary['total_distance_km'] < 50
+
+
+@pytest.mark.asyncio
+async def test_endpoints_degrade_while_the_breaker_is_open(fast_retries):
+    calls = []
+
+    def handler(request):
+        calls.append(request.url.path)
+        return httpx.Response(503, json={"error": "overloaded"})
+
+    fast_retries(handler)
+    payload = {"locations": ["3.10,101.60", "3.30,101.60", "3.20,101.60", "3.40,101.60"]}
+    async with AsyncClient(app=app, base_url="http://test") as client:
+        first = await client.post("/api/optimize", json=payload)
+        assert first.status_code == 200 and first.json()["degraded"] is True
+        assert [p["input"] for p in first.json()["route"]][1] == "3.20,101.60"
+        assert len(calls) == 3
+
+        # Breaker is now open: answered locally without calling the Routes API
+        second = await client.post("/api/optimize", json=payload)
+        assert second.status_code == 200 and second.json()["degraded"] is True
+        assert len(calls) == 3
+        status = (await client.get("/api/status")).json()
+    assert status["upstream"]["route_matrix"] == "open"
+
+
+@pytest.mark.asyncio
+async def test_upstream_timeouts_degrade_instead_of_failing(fast_retries):
+    def handler(request):
+        raise httpx.ReadTimeout("no response", request=request)
+
+    fast_retries(handler)
+    payload = {"locations": ["3.10,101.60", "3.30,101.60", "3.20,101.60"]}
+    async with AsyncClient(app=app, base_url="http://test") as client:
+        r = await client.post("/api/optimize", json=payload)
+    assert r.status_code == 200 and r.json()["notice"] == DEGRADED_NOTICE
+
+
+@pytest.mark.asyncio
+async def test_fleet_is_assigned_on_estimates_while_the_matrix_is_unavailable(mock_upstream):
+    mock_upstream(lambda request: pytest.fail("called upstream"))
+    http_client._guard("route_matrix").breaker._opened_at = time.monotonic()
+    payload = {
+        "vehicles": [{"start_location": "3.10,101.60", "capacity": 2},
+                     {"start_location": "3.40,101.60", "capacity": 2}],
+        "pickups": [{"location": f"3.{n}0,101.61"} for n in (1, 2, 3, 4)],
+        "final_destination": "3.25,101.70",
+    }
+    async with AsyncClient(app=app, base_url="http://test") as client:
+        r = await client.post("/api/optimize/fleet", json=payload)
+
+    body = r.json()
+    assert r.status_code == 200 and body["unassigned"] == []
+    assert body["degraded"] is True and body["notice"] == DEGRADED_NOTICE
+    assert sorted(len(route["route"]) for route in body["routes"]) == [4, 4]
+
+
+@pytest.mark.asyncio
+async def test_tiles_past_the_rate_limit_are_estimated_and_flagged(monkeypatch, mock_upstream):
+    calls = []
+
+    def handler(request):
+        body = json.loads(request.content)
+        calls.append(body)
+        return httpx.Response(200, json=[
+            {"originIndex": i, "destinationIndex": j, "duration": "600s", "distanceMeters": 1000}
+            for i in range(len(body["origins"])) for j in range(len(body["destinations"]))])
+
+    mock_upstream(handler)
+    # Two calls' worth of burst and no time left to refill it: 2 of the 4 tiles fit
+    monkeypatch.setattr(http_client, "_rate_limits", {"route_matrix": 2})
+    monkeypatch.setattr(resilience, "UPSTREAM_BURST_SECONDS", 1)
+    monkeypatch.setattr(routes_api, "MATRIX_PLAN_MARGIN", resilience.REQUEST_DEADLINE)
+    payload = {"locations": [f"{3.0 + i / 100:.2f},101.60" for i in range(30)]}
+    async with AsyncClient(app=app, base_url="http://test") as client:
+        r = await client.post("/api/optimize", json=payload)
+
+    body = r.json()
+    assert r.status_code == 200 and len(calls) == 2
+    assert body["degraded"] is True and body["notice"] == DEGRADED_NOTICE
+    assert body["estimated_tiles"] == 2 and len(body["route"]) == 30
+
+
+@pytest.fixture
+def small_quota(monkeypatch, mock_upstream):
+    # 400 calls/s with a 20-call burst: anything queued past 0.5 s used to be refused
+    monkeypatch.setattr(http_client, "_rate_limits", {"route_matrix": 400, "geocode": 400})
+    monkeypatch.setattr(resilience, "UPSTREAM_BURST_SECONDS", 0.05)
+    monkeypatch.setattr(resilience, "UPSTREAM_QUEUE_SECONDS", 0.5)
+    calls = []
+
+    def handler(request):
+        calls.append(request.url.path)
+        if request.url.path.endswith("/geocode/json"):
+            n = int(request.url.params["address"].split()[-1])
+            return httpx.Response(200, json={"results": [
+                {"geometry": {"location": {"lat": 3.0 + n / 1e4, "lng": 101.5}}}]})
+        body = json.loads(request.content)
+        return httpx.Response(200, json=[
+            {"originIndex": i, "destinationIndex": j, "duration": f"{60 * (i + j) + 60}s",
+             "distanceMeters": 1000}
+            for i in range(len(body["origins"])) for j in range(len(body["destinations"]))])
+
+    mock_upstream(handler)
+    return calls
+
+
+@pytest.mark.asyncio
+async def test_batches_larger_than_the_quota_are_paced_not_refused(small_quota):
+    jobs = [{"locations": [f"3.{i:03d},101.5", f"3.{i:03d},101.6"]} for i in range(400)]
+    async with AsyncClient(app=app, base_url="http://test", timeout=30) as client:
+        r = await client.post("/api/optimize/batch", json={"jobs": jobs})
+
+    results = [json.loads(line) for line in r.text.splitlines()]
+    assert len(results) == 400 and not [res for res in results if "error" in res]
+    assert len(small_quota) == 400
+
+
+@pytest.mark.asyncio
+async def test_batch_jobs_fall_back_to_estimates_while_upstreams_are_unavailable(mock_upstream):
+    mock_upstream(lambda request: pytest.fail("called upstream"))
+    for service in ("geocode", "route_matrix"):
+        http_client._guard(service).breaker._opened_at = time.monotonic()
+    jobs = [{"locations": ["3.10,101.60", "3.30,101.60", "3.20,101.60", "3.40,101.60"]},
+            {"locations": ["3.10,101.60", "Jalan 1", "3.20,101.60"]}]
+    async with AsyncClient(app=app, base_url="http://test") as client:
+        r = await client.post("/api/optimize/batch", json={"jobs": jobs})
+
+    results = {res["index"]: res for res in map(json.loads, r.text.splitlines())}
+    assert all(res["degraded"] is True and res["notice"] == DEGRADED_NOTICE
+               for res in results.values())
+    assert [p["input"] for p in results[0]["route"]][1] == "3.20,101.60"
+    assert [p["input"] for p in results[1]["route"]] == jobs[1]["locations"]
+
+
+def test_imports_larger_than_the_quota_are_paced_not_refused(small_quota, tmp_path):
+    src, dst = tmp_path / "in.csv", tmp_path / "out.csv"
+    src.write_text("address\n" + "".join(f"Jalan {n}\n" for n in range(400)))
+
+    assert geocoding.import_csv(str(src), str(dst), "test-key") == (400, 400, 0)
+    with open(dst) as f:
+        rows = list(csv.DictReader(f))
+    assert all(row["lat"] and row["error"] == "" for row in rows)
+
+
+def test_unavailable_geocodes_are_reported_per_row_not_left_blank(mock_upstream, tmp_path):
+    mock_upstream(lambda request: pytest.fail("called upstream"))
+    src, dst = tmp_path / "in.csv", tmp_path / "out.csv"
+    src.write_text('address\nJalan 0\n"3.1,101.6"\n')
+    # The Geocoding API's breaker is open: the address cannot be looked up at all
+    http_client._guard("geocode").breaker._opened_at = time.monotonic()
+
+    assert geocoding.import_csv(str(src), str(dst), "test-key") == (2, 1, 1)
+    with open(dst) as f:
+        rows = list(csv.DictReader(f))
+    assert rows[0]["lat"] == "" and rows[0]["error"] == "geocode unavailable: circuit_open"
+    assert float(rows[1]["lat"]) == pytest.approx(3.1, abs=1e-4) and rows[1]["error"] == ""
@@ -0,0 +1,97 @@
+import gzip
+import json
+
+import httpx
+import pytest
+from httpx import AsyncClient
+
+import responses
+from main import app
+
+STEP_LINE = "a~l~Fjk~uOwHJy@P" * 20
+
+
+def directions(n_legs):
+    leg = {"duration": "300s", "distanceMeters": 2500, "polyline": {"encodedPolyline": STEP_LINE},
+           "steps": [{"distanceMeters": 250, "staticDuration": "30s",
+                      "polyline": {"encodedPolyline": STEP_LINE},
+                      "navigationInstruction": {"instructions": "Turn left onto Jalan Ampang"}}] * 10}
+    return {"routes": [{"duration": f"{300 * n_legs}s", "distanceMeters": 2500 * n_legs,
+                        "polyline": {"encodedPolyline": STEP_LINE * n_legs},
+                        "legs": [leg] * n_legs}]}
+
+
+@pytest.fixture
+def upstream(mock_upstream):
+    field_masks = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        if request.url.path.endswith("/geocode/json"):
+            seed = len(request.url.params["address"])
+            return httpx.Response(200, json={"results": [
+                {"geometry": {"location": {"lat": 3.1 + seed / 1000, "lng": 101.6}}}
+            ]})
+        body = json.loads(request.content)
+        if request.url.path.endswith(":computeRouteMatrix"):
+            return httpx.Response(200, json=[
+                {"originIndex": i, "destinationIndex": j, "duration": "60s", "distanceMeters": 1000}
+                for i in range(len(body["origins"])) for j in range(len(body["destinations"]))
+            ])
+        if not request.url.path.endswith(":computeRoutes"):
+            return httpx.Response(503)           # the LLM advisory
+        field_masks.append(request.headers["X-Goog-FieldMask"])
+        return httpx.Response(200, json=directions(len(body.get("intermediates", [])) + 1))
+
+    mock_upstream(handler)
+    yield field_masks
+
+
+def test_encode_polyline_matches_reference():
+    # Example from Google's encoded polyline algorithm documentation
+    points = [(38.5, -120.2), (40.7, -120.95), (43.252, -126.453)]
+    assert responses.encode_polyline(points) == "_p~iF~ps|U_ulLnnqC_mqNvxq`@"
+
+
+def test_small_bodies_are_not_compressed():
+    data, headers = responses.encode({"ok": True}, "gzip, br")
+    assert json.loads(data) == {"ok": True} and "Content-Encoding" not in headers
+
+
+def test_refused_encodings_are_not_used():
+    big = {"legs": ["x" * 40] * 100}
+    _, headers = responses.encode(big, "br;q=0, gzip;q=0.5")
+    assert headers["Content-Encoding"] == "gzip"
+    _, headers = responses.encode(big, "gzip;q=0, identity")
+    assert "Content-Encoding" not in headers
+    _, headers = responses.encode(big, "*;q=0.1, gzip;q=0")
+    assert headers.get("Content-Encoding") == ("br" if responses.brotli is not None else None)
+    data, headers = responses.encode(big, "gzip; q=0.8, br; q=0.2")
+    assert headers["Content-Encoding"] == "gzip" and json.loads(gzip.decompress(data)) == big
+
+
+@pytest.mark.asyncio
+async def test_compact_view_is_smaller_and_compressed(upstream):
+    payload = {"locations": ["Bangsar South", "KLCC", "Mid Valley", "Bukit Bintang", "PJ"]}
+    async with AsyncClient(app=app, base_url="http://test") as client:
+        full = await client.post("/api/optimize", json=payload)
+        compact = await client.post("/api/optimize?view=compact", json=payload,
+                                    headers={"Accept-Encoding": "gzip"})
+
+    assert full.status_code == 200 and compact.status_code == 200
+    assert upstream[1] == responses.COMPACT_FIELD_MASK
+    assert compact.headers["content-type"] == responses.COMPACT_MEDIA_TYPE
+    body = compact.json()            # httpx undoes the gzip
+    assert body["order"] == [p["input"] for p in full.json()["route"]]
+    assert len(body["legs"]) == 4 and body["legs"][0] == [300, 2500, STEP_LINE]
+    assert len(gzip.compress(compact.content)) < len(full.content)
+
+
+@pytest.mark.asyncio
+async def test_compact_view_does_not_widen_the_optimize_route_field_mask(upstream):
+    payload = {"start_location": "Bangsar South", "friend_locations": ["KLCC", "Mid Valley"],
+               "final_destination": "PJ"}
+    async with AsyncClient(app=app, base_url="http://test") as client:
+        r = await client.post("/api/optimize_route?view=compact", json=payload)
+
+    assert r.status_code == 200 and upstream == [responses.TOTALS_FIELD_MASK]
+    assert r.json()["order"][0] == "Bangsar South" and r.json()["total_seconds"] == 900
@@ -0,0 +1,114 @@
+import heapq
+import time
+
+import numpy as np
+import pytest
+import requests
+
+import http_client
+import road_graph
+import routes_api
+from road_graph import RoadGraph
+
+
+def grid_network(size=12, seed=3):
+    """Square street grid around KLCC with random speeds and some one-way streets."""
+    rng = np.random.default_rng(seed)
+    lat = np.repeat(3.15 + np.arange(size) * 0.002, size)
+    lng = np.tile(101.70 + np.arange(size) * 0.002, size)
+    src, dst = [], []
+    for r in range(size):
+        for c in range(size):
+            v = r * size + c
+            for w in ([v + 1] if c + 1 < size else []) + ([v + size] if r + 1 < size else []):
+                oneway = rng.random() < 0.2
+                src.append(v), dst.append(w)
+                if not oneway:
+                    src.append(w), dst.append(v)
+    src, dst = np.array(src), np.array(dst)
+    dist = road_graph.haversine_m(lat[src], lng[src], lat[dst], lng[dst])
+    time_s = dist / rng.uniform(4, 20, len(src))
+    return lat, lng, src, dst, time_s, dist
+
+
+def dijkstra(n, src, dst, weight, length, origin):
+    """Fastest times from `origin`, and the length of each fastest path."""
+    adj = [[] for _ in range(n)]
+    for u, w, t, m in zip(src, dst, weight, length):
+        adj[u].append((w, t, m))
+    best, metres = np.full(n, np.inf), np.full(n, np.inf)
+    best[origin] = metres[origin] = 0.0
+    heap = [(0.0, origin)]
+    while heap:
+        d, x = heapq.heappop(heap)
+        if d > best[x]:
+            continue
+        for y, t, m in adj[x]:
+            if d + t < best[y]:
+                best[y], metres[y] = d + t, metres[x] + m
+                heapq.heappush(heap, (d + t, y))
+    return best, metres
+
+
+def test_hierarchy_matches_dijkstra_and_survives_mmap(tmp_path):
+    lat, lng, src, dst, time_s, dist = grid_network()
+    graph = RoadGraph.from_edges(lat, lng, src, dst, time_s, dist)
+    graph.save(str(tmp_path / "index"))
+    loaded = RoadGraph.load(str(tmp_path / "index"))
+    assert isinstance(loaded.up_indices, np.memmap)
+
+    nodes = np.random.default_rng(0).choice(len(lat), 20, replace=False)
+    durations, distances = loaded.matrix(nodes, nodes)
+    for i, s in enumerate(nodes):
+        expected, metres = dijkstra(len(lat), src, dst, time_s, dist, s)
+        assert durations[i] == pytest.approx(expected[nodes], rel=1e-5)
+        assert distances[i] == pytest.approx(metres[nodes], rel=1e-5)
+
+
+def test_fifty_by_fifty_matrix_is_local_and_fast(tmp_path, monkeypatch):
+    lat, lng, src, dst, time_s, dist = grid_network(size=20)
+    RoadGraph.from_edges(lat, lng, src, dst, time_s, dist).save(str(tmp_path / "index"))
+    monkeypatch.setenv("ROUTING_BACKEND", "local")
+    monkeypatch.setenv("ROAD_GRAPH_INDEX", str(tmp_path / "index"))
+    monkeypatch.setattr(road_graph, "_default_loaded", False)
+    monkeypatch.setattr(requests.Session, "post", lambda *a, **k: pytest.fail("network call"))
+
+    rng = np.random.default_rng(1)
+    picks = rng.choice(len(lat), 50, replace=False)
+    stops = [routes_api.resolve_stop(None, f"{lat[p] + 1e-4:.6f},{lng[p]:.6f}") for p in picks]
+    started = time.perf_counter()
+    durations, distances, _ = routes_api.fetch_travel_time_matrix(stops, "unused")
+    assert time.perf_counter() - started < 0.5
+    assert durations.shape == (50, 50) and (np.diag(durations) == 0).all()
+    assert (durations[~np.eye(50, dtype=bool)] > 0).all() and (distances >= 0).all()
+
+
+def test_stops_snap_to_roads_up_to_max_snap_meters():
+    # One two-node road ~580 m north of the first stop, but two grid rows up
+    lat, lng = np.array([3.1601, 3.1601]), np.array([101.7000, 101.7010])
+    graph = RoadGraph.from_edges(lat, lng, np.array([0, 1]), np.array([1, 0]),
+                                 np.array([10.0, 10.0]), np.array([110.0, 110.0]))
+    nodes, snap = graph.nearest_nodes([3.1549, 3.1449], [101.7, 101.7])
+    assert nodes[0] == 0 and 500 < snap[0] < 600
+    assert nodes[1] == -1 or snap[1] > road_graph.MAX_SNAP_METERS
+
+
+def test_read_osm_respects_oneway_and_highway_types(tmp_path):
+    osm = tmp_path / "tiny.osm"
+    osm.write_text("""<?xml version="1.0"?>
+<osm version="0.6">
+  <node id="1" lat="3.1500" lon="101.7000"/>
+  <node id="2" lat="3.1510" lon="101.7000"/>
+  <node id="3" lat="3.1520" lon="101.7000"/>
+  <node id="4" lat="3.1520" lon="101.7010"/>
+  <way id="10"><nd ref="1"/><nd ref="2"/><nd ref="3"/><tag k="highway" v="primary"/></way>
+  <way id="11"><nd ref="3"/><nd ref="4"/><tag k="highway" v="residential"/><tag k="oneway" v="yes"/></way>
+  <way id="12"><nd ref="1"/><nd ref="4"/><tag k="highway" v="footway"/></way>
+</osm>""")
+    lat, lng, src, dst, time_s, dist = road_graph.read_osm(str(osm))
+    assert len(lat) == 4
+    assert len(src) == 5                      # 2 two-way segments + 1 one-way
+    assert dist[0] == pytest.approx(111, abs=2)
+    graph = RoadGraph.from_edges(lat, lng, src, dst, time_s, dist)
+    durations, _ = graph.matrix([0, 3], [0, 3])
+    assert np.isfinite(durations[0, 1]) and np.isinf(durations[1, 0])
@@ -0,0 +1,111 @@
+import json
+import threading
+import time
+
+import httpx
+import pytest
+from httpx import AsyncClient
+
+import http_client
+import sessions
+import solver
+from main import app
+from routes_api import DEGRADED_NOTICE
+
+# Points along a line, so the best order is easy to see: A < B < C < D < E
+POINTS = {"A": 0, "B": 1, "C": 2, "D": 3, "E": 4}
+
+
+@pytest.fixture
+def upstream(mock_upstream):
+    matrix_requests = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        if request.url.path.endswith("/geocode/json"):
+            x = POINTS[request.url.params["address"]]
+            return httpx.Response(200, json={"results": [
+                {"geometry": {"location": {"lat": 3.1, "lng": 101.6 + x / 100}}}
+            ]})
+        body = json.loads(request.content)
+        matrix_requests.append(body)
+        lng = lambda wp: wp["waypoint"]["location"]["latLng"]["longitude"]
+        return httpx.Response(200, json=[
+            {"originIndex": i, "destinationIndex": j,
+             "duration": f"{round(abs(lng(o) - lng(d)) * 60000)}s", "distanceMeters": 1000}
+            for i, o in enumerate(body["origins"]) for j, d in enumerate(body["destinations"])
+        ])
+
+    mock_upstream(handler)
+    yield matrix_requests
+
+
+def inputs(route):
+    return [p["input"] for p in route["route"]]
+
+
+@pytest.mark.asyncio
+async def test_events_repair_the_tour_and_notify_subscribers(upstream):
+    async with AsyncClient(app=app, base_url="http://test") as client:
+        r = await client.post("/api/sessions", json={"locations": ["A", "D", "B", "E"]})
+        created = r.json()
+        assert inputs(created) == ["A", "B", "D", "E"]
+        session_id = created["session_id"]
+        queue = sessions.get(session_id).subscribe()
+
+        r = await client.post(f"/api/sessions/{session_id}/events",
+                              json={"type": "add_stop", "location": "C"})
+        added = r.json()
+        assert inputs(added) == ["A", "B", "C", "D", "E"] and added["version"] == 1
+        # Only the new stop's row and column were fetched
+        assert [len(req["origins"]) * len(req["destinations"]) for req in upstream[1:]] == [4, 4]
+        assert queue.get_nowait()["version"] == 1
+
+        r = await client.post(f"/api/sessions/{session_id}/events",
+                              json={"type": "update_leg", "from_location": "A",
+                                    "to_location": "B", "minutes": 120})
+        assert inputs(r.json())[1] != "B"
+
+        r = await client.post(f"/api/sessions/{session_id}/events",
+                              json={"type": "drop_stop", "location": "D"})
+        assert "D" not in inputs(r.json()) and r.json()["version"] == 3
+
+        r = await client.post(f"/api/sessions/{session_id}/events",
+                              json={"type": "drop_stop", "location": "A"})
+        assert r.status_code == 400          # the start cannot be dropped
+
+        assert (await client.delete(f"/api/sessions/{session_id}")).status_code == 200
+        assert (await client.get(f"/api/sessions/{session_id}")).status_code == 404
+
+
+@pytest.mark.asyncio
+async def test_solving_and_repairs_run_off_the_event_loop(upstream, monkeypatch):
+    threads = []
+    for name in ("solve", "improve"):
+        def spy(*args, _real=getattr(solver, name), **kwargs):
+            threads.append(threading.current_thread())
+            return _real(*args, **kwargs)
+        monkeypatch.setattr(solver, name, spy)
+
+    async with AsyncClient(app=app, base_url="http://test") as client:
+        r = await client.post("/api/sessions", json={"locations": ["A", "D", "B", "E"]})
+        await client.post(f"/api/sessions/{r.json()['session_id']}/events",
+                          json={"type": "add_stop", "location": "C"})
+
+    assert len(threads) >= 2 and threading.main_thread() not in threads
+
+
+@pytest.mark.asyncio
+async def test_sessions_start_and_grow_on_estimates_while_the_matrix_is_unavailable(upstream):
+    http_client._guard("route_matrix").breaker._opened_at = time.monotonic()
+    async with AsyncClient(app=app, base_url="http://test") as client:
+        r = await client.post("/api/sessions", json={"locations": ["A", "D", "B", "E"]})
+        created = r.json()
+        assert r.status_code == 200 and inputs(created) == ["A", "B", "D", "E"]
+        assert created["degraded"] is True and created["notice"] == DEGRADED_NOTICE
+        assert created["estimated_tiles"] == 1
+
+        r = await client.post(f"/api/sessions/{created['session_id']}/events",
+                              json={"type": "add_stop", "location": "C"})
+    assert r.status_code == 200 and inputs(r.json()) == ["A", "B", "C", "D", "E"]
+    assert r.json()["degraded"] is True and r.json()["estimated_tiles"] == 3
+    assert upstream == []
@@ -0,0 +1,53 @@
+import itertools
+
+import numpy as np
+import pytest
+
+import solver
+
+
+def brute_force_cost(matrix):
+    n = len(matrix)
+    return min(
+        solver.route_cost(matrix, [0, *perm, n - 1])
+        for perm in itertools.permutations(range(1, n - 1))
+    )
+
+
+@pytest.mark.parametrize("n", [3, 5, 8])
+def test_held_karp_matches_brute_force(n):
+    rng = np.random.default_rng(n)
+    matrix = rng.random((n, n)) * 600  # asymmetric travel times
+    order = solver.solve(matrix)
+    assert order[0] == 0 and order[-1] == n - 1
+    assert sorted(order) == list(range(n))
+    assert solver.route_cost(matrix, order) == pytest.approx(brute_force_cost(matrix))
+
+
+def test_heuristic_improves_on_nearest_neighbour():
+    rng = np.random.default_rng(42)
+    n = 22  # 20 pickups, beyond the exact solver's range
+    points = rng.random((n, 2))
+    matrix = np.linalg.norm(points[:, None] - points[None, :], axis=2)
+    order = solver.solve(matrix)
+    assert order[0] == 0 and order[-1] == n - 1
+    assert sorted(order) == list(range(n))
+    nn = [0, *solver._nearest_neighbour(matrix, 0, np.arange(1, n - 1)).tolist(), n - 1]
+    assert solver.route_cost(matrix, order) <= solver.route_cost(matrix, nn)
+
+
+def test_trivial_and_invalid_inputs():
+    assert solver.solve([[0, 1], [1, 0]]) == [0, 1]
+    with pytest.raises(ValueError):
+        solver.solve(np.zeros((2, 3)))
+
+
+def test_float32_matrices_are_solved_without_upcasting():
+    rng = np.random.default_rng(7)
+    points = rng.random((40, 2))
+    matrix = np.linalg.norm(points[:, None] - points[None, :], axis=2) * 1000
+    assert solver._as_matrix(matrix.astype(np.float32)).dtype == np.float32
+    order = solver.solve(matrix.astype(np.float32))
+    assert sorted(order) == list(range(40))
+    assert solver.route_cost(matrix, order) == pytest.approx(
+        solver.route_cost(matrix, solver.solve(matrix)), rel=0.05)
@@ -0,0 +1,88 @@
+import importlib.util
+import os
+import subprocess
+import sys
+import threading
+
+import pytest
+from httpx import AsyncClient
+
+import cache
+import solver
+import startup
+from cache import SQLiteStore, TTLCache
+from main import app
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture
+def cold(monkeypatch):
+    monkeypatch.setattr(startup, "_ready", threading.Event())
+    monkeypatch.setattr(startup, "_timings", {})
+    solver._subset_layers.cache_clear()
+
+
+@pytest.mark.asyncio
+async def test_ready_answers_503_until_warm_up_finishes(cold):
+    async with AsyncClient(app=app, base_url="http://test") as client:
+        r = await client.get("/api/ready")
+        assert r.status_code == 503 and r.json() == {"ready": False, "warm_seconds": {}}
+
+        startup.warm(imports=("json",), clients=(lambda: None,))
+        r = await client.get("/api/ready")
+
+    assert r.status_code == 200
+    steps = r.json()["warm_seconds"]
+    assert {"solver_tables", "caches", "tls", "import:json", "solve"} <= set(steps)
+    assert solver._subset_layers.cache_info().currsize == solver.HELD_KARP_MAX_STOPS - 1
+
+
+def test_start_in_background_and_off(cold, monkeypatch):
+    startup.start()
+    startup._thread.join(10)
+    assert startup.is_ready() and "solver_tables" in startup.status()["warm_seconds"]
+
+    monkeypatch.setattr(startup, "_ready", threading.Event())
+    monkeypatch.setattr(startup, "STARTUP_WARM", "off")
+    solver._subset_layers.cache_clear()
+    startup.start()
+    assert startup.is_ready() and solver._subset_layers.cache_info().currsize == 0
+
+
+def test_preload_reads_the_freshest_persisted_entries(tmp_path):
+    store = SQLiteStore(str(tmp_path / "cache.db"))
+    TTLCache("leg", store=store).set("a", 1, ttl=60)
+    TTLCache("leg", store=store).set("b", 2, ttl=600)
+    TTLCache("leg", store=store).set("gone", 3, ttl=-1)
+
+    fresh = TTLCache("leg", maxsize=1, store=store)
+    assert fresh.preload() == 1
+    assert fresh.stats()["size"] == 1 and fresh._data["b"][1] == 2
+    assert fresh.stats()["hits"] == 0
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="needs fork")
+def test_store_reconnects_in_forked_child(tmp_path, monkeypatch):
+    store = SQLiteStore(str(tmp_path / "cache.db"))
+    monkeypatch.setattr(cache, "_store", store)
+    parent_conn = store._conn
+
+    pid = os.fork()
+    if pid == 0:
+        ok = store._conn is not parent_conn
+        store.set("leg", "child", 1, expires_at=4e9)
+        os._exit(0 if ok else 1)
+    _, status = os.waitpid(pid, 0)
+
+    assert os.WEXITSTATUS(status) == 0
+    assert store.get("leg", "child") == (1, 4e9)
+
+
+@pytest.mark.skipif(importlib.util.find_spec("flask") is None,
+                    reason="needs requirements-flask.txt")
+def test_flask_app_does_not_import_the_async_client():
+    script = "import sys, app; print(sorted({'httpx', 'fastapi'} & set(sys.modules)))"
+    out = subprocess.run([sys.executable, "-c", script], cwd=BACKEND, capture_output=True, text=True,
+                         env={**os.environ, "STARTUP_WARM": "off"})
+    assert out.stdout.strip() == "[]", out.stderr
@@ -0,0 +1,63 @@
+import time
+
+import numpy as np
+import pytest
+
+import vrp
+
+
+def euclidean_instance(vehicles, pickups, seed=0):
+    rng = np.random.default_rng(seed)
+    points = rng.random((vehicles + pickups + 1, 2)) * 20000   # metres
+    matrix = np.linalg.norm(points[:, None] - points[None, :], axis=2) / 10  # ~36 km/h
+    starts = list(range(vehicles))
+    pickup_nodes = list(range(vehicles, vehicles + pickups))
+    return matrix, starts, [vehicles + pickups] * vehicles, pickup_nodes
+
+
+def test_event_day_fleet_within_a_second():
+    matrix, starts, ends, pickups = euclidean_instance(20, 200)
+    started = time.perf_counter()
+    routes, unassigned = vrp.solve(matrix, starts, ends, pickups, capacities=[10] * 20)
+    assert time.perf_counter() - started < 1.0
+    assert unassigned == []
+    visited = sorted(node for r in routes for node in r[1:-1])
+    assert visited == pickups
+    assert all(len(r) - 2 <= 10 for r in routes)
+    assert [r[0] for r in routes] == starts and all(r[-1] == ends[0] for r in routes)
+
+    construction, _ = vrp.solve(matrix, starts, ends, pickups, capacities=[10] * 20, time_limit=0)
+    assert vrp.total_cost(matrix, routes) <= vrp.total_cost(matrix, construction)
+
+
+def test_capacity_and_time_windows_are_respected():
+    matrix, starts, ends, pickups = euclidean_instance(3, 12, seed=7)
+    demands = [2, 1, 1, 3, 1, 2, 1, 1, 2, 1, 1, 1]
+    windows = [None] * 12
+    windows[0] = (None, 900.0)          # must be reached within 15 minutes
+    windows[5] = (1800.0, None)         # not before 30 minutes
+    routes, unassigned = vrp.solve(matrix, starts, ends, pickups, demands=demands,
+                                   capacities=[6, 6, 5], windows=windows)
+    load = {p: d for p, d in zip(pickups, demands)}
+    for v, route in enumerate(routes):
+        assert sum(load[n] for n in route[1:-1]) <= [6, 6, 5][v]
+        t = 0.0
+        for prev, node in zip(route[:-2], route[1:-1]):
+            t += matrix[prev, node]
+            window = windows[pickups.index(node)]
+            if window is not None:
+                earliest, latest = window
+                assert latest is None or t <= latest + 1e-6
+                t = max(t, earliest or 0.0)
+    assigned = {n for r in routes for n in r[1:-1]}
+    assert assigned | set(unassigned) == set(pickups)
+
+
+def test_unreachable_demand_is_reported_unassigned():
+    matrix, starts, ends, pickups = euclidean_instance(1, 3)
+    routes, unassigned = vrp.solve(matrix, starts, ends, pickups, demands=[1, 5, 1],
+                                   capacities=[4])
+    assert unassigned == [pickups[1]]
+    assert sorted(routes[0][1:-1]) == [pickups[0], pickups[2]]
+    with pytest.raises(ValueError):
+        vrp.solve(matrix, starts, ends, [0, 1])
@@ -0,0 +1,336 @@
+"""
+Multi-vehicle pickup routing (capacitated VRP with optional time windows).
+
+Every vehicle leaves its own start node and finishes at its own end node
+(usually the shared destination). Each pickup needs some seats and may carry
+an [earliest, latest] arrival window in seconds after departure; a vehicle
+that arrives early waits.
+
+- Construction: asymmetric Clarke-Wright savings joins pickups into chains
+  that fit the largest vehicle, then chains are matched to vehicles and any
+  leftovers are placed by cheapest feasible insertion.
+- Improvement: relocate moves within and between routes, pairwise swaps
+  between routes (both vectorised with NumPy) and per-route 2-opt from
+  `solver.py`, until no move improves or the time budget runs out.
+
+Works on the same travel-time matrices as `solver.py`.
+"""
+import time
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+
+import solver
+
+# Wall-clock budget for construction plus local search.
+DEFAULT_TIME_LIMIT = 0.8
+
+_EPS = 1e-9
+
+
+class _Problem:
+    def __init__(self, m, starts, ends, pickups, demands, capacities, windows):
+        n = m.shape[0]
+        self.m = m
+        self.starts = list(starts)
+        self.ends = list(ends)
+        self.pickups = list(pickups)
+        self.capacity = np.asarray(capacities, dtype=np.float64)
+        self.demand = np.zeros(n)
+        self.demand[self.pickups] = demands
+        self.early = np.zeros(n)
+        self.late = np.full(n, np.inf)
+        self.has_windows = False
+        for node, window in zip(self.pickups, windows):
+            if window is None:
+                continue
+            earliest, latest = window
+            self.early[node] = earliest if earliest is not None else 0.0
+            self.late[node] = latest if latest is not None else np.inf
+            self.has_windows = True
+
+    def path(self, v: int, seq: Sequence[int]) -> List[int]:
+        return [self.starts[v], *seq, self.ends[v]]
+
+    def load(self, seq: Sequence[int]) -> float:
+        return float(self.demand[list(seq)].sum()) if len(seq) else 0.0
+
+    def on_time(self, start: int, seq: Sequence[int]) -> bool:
+        if not self.has_windows:
+            return True
+        t, prev = 0.0, start
+        for node in seq:
+            t += self.m[prev, node]
+            if t > self.late[node] + _EPS:
+                return False
+            t = max(t, self.early[node])
+            prev = node
+        return True
+
+    def feasible(self, v: int, seq: Sequence[int]) -> bool:
+        return self.load(seq) <= self.capacity[v] + _EPS and self.on_time(self.starts[v], seq)
+
+
+def total_cost(matrix, routes: List[List[int]]) -> float:
+    """Summed travel time of every vehicle route (as returned by `solve`)."""
+    return sum(solver.route_cost(matrix, r) for r in routes)
+
+
+def solve(matrix, starts: Sequence[int], ends: Sequence[int], pickups: Sequence[int],
+          demands: Optional[Sequence[float]] = None,
+          capacities: Optional[Sequence[float]] = None,
+          windows: Optional[Sequence[Optional[Tuple[Optional[float], Optional[float]]]]] = None,
+          time_limit: float = DEFAULT_TIME_LIMIT) -> Tuple[List[List[int]], List[int]]:
+    """
+    Return (routes, unassigned). `routes[v]` is the full node list for vehicle v,
+    from `starts[v]` to `ends[v]`; `unassigned` lists pickups that no vehicle can
+    take within its capacity and the time windows.
+    """
+    m = np.asarray(matrix, dtype=np.float64)
+    if m.ndim != 2 or m.shape[0] != m.shape[1]:
+        raise ValueError("Travel-time matrix must be square")
+    if len(starts) != len(ends) or not len(starts):
+        raise ValueError("Provide one start and one end node per vehicle")
+    if len(set(pickups)) != len(pickups) or set(pickups) & set(starts) | set(pickups) & set(ends):
+        raise ValueError("Pickups must be distinct and separate from vehicle start/end nodes")
+    k = len(starts)
+    demands = [1.0] * len(pickups) if demands is None else demands
+    capacities = [np.inf] * k if capacities is None else capacities
+    windows = [None] * len(pickups) if windows is None else windows
+    if not (len(demands) == len(windows) == len(pickups)) or len(capacities) != k:
+        raise ValueError("demands/windows must match pickups and capacities must match vehicles")
+
+    deadline = time.perf_counter() + time_limit
+    p = _Problem(m, starts, ends, pickups, demands, capacities, windows)
+    routes, pending = _construct(p)
+    unassigned = _insert_all(p, routes, pending)
+    unassigned = _improve(p, routes, unassigned, deadline)
+    return [p.path(v, seq) for v, seq in enumerate(routes)], unassigned
+
+
+def _construct(p: _Problem) -> Tuple[List[List[int]], List[int]]:
+    """Clarke-Wright savings chains matched to vehicles. Returns (routes, leftovers)."""
+    nodes = np.asarray(p.pickups, dtype=np.intp)
+    if len(nodes) == 0:
+        return [[] for _ in p.starts], []
+    m = p.m
+    to_first = m[np.ix_(p.starts, nodes)]                # (k, P)
+    from_last = m[np.ix_(nodes, p.ends)]                 # (P, k)
+    nearest_start = np.asarray(p.starts)[np.argmin(to_first, axis=0)]
+    a = to_first.min(axis=0)
+    b = from_last.min(axis=1)
+    max_cap = float(p.capacity.max())
+
+    # Joining chain ...i with chain j... saves i->end and start->j, costs i->j.
+    savings = b[:, None] + a[None, :] - m[np.ix_(nodes, nodes)]
+    np.fill_diagonal(savings, -np.inf)
+    flat = np.argsort(savings, axis=None)[::-1]
+    flat = flat[savings.flat[flat] > 0]
+
+    chain_of = {int(node): [int(node)] for node in nodes}
+    index_of = {int(node): i for i, node in enumerate(nodes)}
+
+    def try_merge(i: int, j: int) -> bool:
+        left, right = chain_of[i], chain_of[j]
+        if left is right or left[-1] != i or right[0] != j:
+            return False
+        merged = left + right
+        if p.load(merged) > max_cap + _EPS:
+            return False
+        if not p.on_time(int(nearest_start[index_of[merged[0]]]), merged):
+            return False
+        for node in merged:
+            chain_of[node] = merged
+        return True
+
+    for f in flat:
+        r, c = divmod(int(f), len(nodes))
+        try_merge(int(nodes[r]), int(nodes[c]))
+
+    chains = list({id(ch): ch for ch in chain_of.values()}.values())
+    # More chains than vehicles: keep joining the cheapest pairs, even at a loss.
+    while len(chains) > len(p.starts):
+        heads = np.array([ch[0] for ch in chains])
+        tails = np.array([ch[-1] for ch in chains])
+        join = b[[index_of[t] for t in tails]][:, None] + a[[index_of[h] for h in heads]][None, :] \
+            - m[np.ix_(tails, heads)]
+        np.fill_diagonal(join, -np.inf)
+        merged_any = False
+        for f in np.argsort(join, axis=None)[::-1]:
+            r, c = divmod(int(f), len(chains))
+            if r == c:
+                continue
+            if try_merge(int(tails[r]), int(heads[c])):
+                merged_any = True
+                break
+        if not merged_any:
+            break
+        chains = list({id(ch): ch for ch in chain_of.values()}.values())
+
+    routes: List[List[int]] = [[] for _ in p.starts]
+    free = set(range(len(p.starts)))
+    leftovers: List[int] = []
+    for chain in sorted(chains, key=p.load, reverse=True):
+        best_v, best_cost = None, np.inf
+        for v in free:
+            if not p.feasible(v, chain):
+                continue
+            c = m[p.starts[v], chain[0]] + m[chain[-1], p.ends[v]] - m[p.starts[v], p.ends[v]]
+            if c < best_cost:
+                best_v, best_cost = v, c
+        if best_v is None:
+            leftovers.extend(chain)
+        else:
+            routes[best_v] = list(chain)
+            free.discard(best_v)
+    return routes, leftovers
+
+
+def _insertion_candidates(p: _Problem, routes: List[List[int]], node: int,
+                          skip: Optional[int] = None):
+    """Vectorised insertion deltas of `node` into every gap of every route."""
+    prevs, nexts, owner, pos = [], [], [], []
+    for v, seq in enumerate(routes):
+        if v == skip:
+            continue
+        path = p.path(v, seq)
+        prevs.extend(path[:-1])
+        nexts.extend(path[1:])
+        owner.extend([v] * (len(path) - 1))
+        pos.extend(range(len(path) - 1))
+    if not prevs:
+        return np.empty(0), np.empty(0, dtype=np.intp), np.empty(0, dtype=np.intp)
+    prevs, nexts = np.asarray(prevs), np.asarray(nexts)
+    owner, pos = np.asarray(owner), np.asarray(pos)
+    delta = p.m[prevs, node] + p.m[node, nexts] - p.m[prevs, nexts]
+    loads = np.array([p.load(seq) for seq in routes])
+    fits = loads[owner] + p.demand[node] <= p.capacity[owner] + _EPS
+    return delta[fits], owner[fits], pos[fits]
+
+
+def _place(p: _Problem, routes: List[List[int]], node: int, limit: float = np.inf,
+           skip: Optional[int] = None) -> bool:
+    """Insert `node` at the cheapest time-feasible gap with delta below `limit`."""
+    delta, owner, pos = _insertion_candidates(p, routes, node, skip)
+    for c in np.argsort(delta):
+        if delta[c] >= limit:
+            return False
+        v, at = int(owner[c]), int(pos[c])
+        seq = routes[v][:at] + [node] + routes[v][at:]
+        if p.on_time(p.starts[v], seq):
+            routes[v] = seq
+            return True
+    return False
+
+
+def _insert_all(p: _Problem, routes: List[List[int]], pending: List[int]) -> List[int]:
+    # Most demanding pickups first: they are the hardest to fit late.
+    unassigned = []
+    for node in sorted(pending, key=lambda n: -p.demand[n]):
+        if not _place(p, routes, node):
+            unassigned.append(node)
+    return unassigned
+
+
+def _two_opt_route(p: _Problem, v: int, seq: List[int]) -> List[int]:
+    path = np.asarray(p.path(v, seq), dtype=np.intp)
+    while True:
+        trial = path.copy()
+        if not solver._two_opt_move(p.m, trial) or not p.on_time(p.starts[v], trial[1:-1]):
+            return path[1:-1].tolist()
+        path = trial
+
+
+def _positions(p: _Problem, routes: List[List[int]]):
+    """Per-node route index (-1 if unassigned) and predecessor/successor nodes."""
+    n = p.m.shape[0]
+    route_of = np.full(n, -1, dtype=np.intp)
+    prev_of = np.zeros(n, dtype=np.intp)
+    next_of = np.zeros(n, dtype=np.intp)
+    for v, seq in enumerate(routes):
+        path = p.path(v, seq)
+        for at, node in enumerate(seq, start=1):
+            route_of[node] = v
+            prev_of[node] = path[at - 1]
+            next_of[node] = path[at + 1]
+    return route_of, prev_of, next_of
+
+
+def _swap_pass(p: _Problem, routes: List[List[int]], deadline: float) -> bool:
+    """Exchange pickups between routes; works even when every vehicle is full."""
+    m = p.m
+    nodes = np.asarray(p.pickups, dtype=np.intp)
+    route_of, prev_of, next_of = _positions(p, routes)
+    loads = np.array([p.load(seq) for seq in routes])
+    improved = False
+    for i in p.pickups:
+        if time.perf_counter() >= deadline:
+            break
+        v = int(route_of[i])
+        if v < 0:
+            continue
+        js = nodes[(route_of[nodes] >= 0) & (route_of[nodes] != v)]
+        if not len(js):
+            continue
+        w = route_of[js]
+        pi, ni, pj, nj = prev_of[i], next_of[i], prev_of[js], next_of[js]
+        delta = (m[pi, js] + m[js, ni] - m[pi, i] - m[i, ni]
+                 + m[pj, i] + m[i, nj] - m[pj, js] - m[js, nj])
+        fits = ((loads[v] - p.demand[i] + p.demand[js] <= p.capacity[v] + _EPS)
+                & (loads[w] - p.demand[js] + p.demand[i] <= p.capacity[w] + _EPS))
+        delta = np.where(fits, delta, np.inf)
+        for c in np.argsort(delta):
+            if delta[c] >= -_EPS:
+                break
+            j, u = int(js[c]), int(w[c])
+            seq_v = [j if x == i else x for x in routes[v]]
+            seq_u = [i if x == j else x for x in routes[u]]
+            if p.on_time(p.starts[v], seq_v) and p.on_time(p.starts[u], seq_u):
+                routes[v], routes[u] = seq_v, seq_u
+                route_of, prev_of, next_of = _positions(p, routes)
+                loads[v], loads[u] = p.load(seq_v), p.load(seq_u)
+                improved = True
+                break
+    return improved
+
+
+def _improve(p: _Problem, routes: List[List[int]], unassigned: List[int],
+             deadline: float) -> List[int]:
+    m = p.m
+    improved = True
+    while improved and time.perf_counter() < deadline:
+        improved = False
+        for v in range(len(routes)):
+            best = _two_opt_route(p, v, routes[v])
+            if best != routes[v]:
+                routes[v] = best
+                improved = True
+
+        for node in list(p.pickups):
+            if time.perf_counter() >= deadline:
+                break
+            v = next((w for w, seq in enumerate(routes) if node in seq), None)
+            if v is None:
+                continue
+            seq = routes[v]
+            at = seq.index(node)
+            path = p.path(v, seq)
+            prev, nxt = path[at], path[at + 2]
+            gain = m[prev, node] + m[node, nxt] - m[prev, nxt]
+            without = seq[:at] + seq[at + 1:]
+            if not p.on_time(p.starts[v], without):
+                continue
+            routes[v] = without
+            if _place(p, routes, node, limit=gain - _EPS):
+                improved = True
+            else:
+                routes[v] = seq
+
+        if _swap_pass(p, routes, deadline):
+            improved = True
+
+        if unassigned:
+            still = _insert_all(p, routes, unassigned)
+            improved = improved or len(still) < len(unassigned)
+            unassigned = still
+    return unassigned
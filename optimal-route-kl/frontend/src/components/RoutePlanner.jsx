@@ -1,14 +1,16 @@
-import React, { useState } from "react";
-import api from "../utils/api";
+import React, { useEffect, useState } from "react";
 import { useNavigate } from "react-router-dom";
+import { createSession, sendSessionEvent, subscribeToSession } from "../utils/routeSession";
 
 /**
  * Simple Route Planner UI:
  * - Add/remove addresses
- * - Submit to POST /api/optimize with { locations: [ ... ] }
+ * - Submit to POST /api/sessions with { locations: [ ... ] }
+ * - Stops can then be added or dropped on the way; the updated route is pushed
+ *   back over the session's event stream
  * - Displays simple results and links to Map view
  *
- * Backend contract assumed: POST /api/optimize returns { route: {...} } or { error }
+ * Backend contract assumed: returns { session_id, version, route, legs, ... } or { error }
  */
 
 export default function RoutePlanner() {
@@ -16,8 +18,20 @@ export default function RoutePlanner() {
   const [loading, setLoading] = useState(false);
   const [result, setResult] = useState(null);
   const [error, setError] = useState(null);
+  const [sessionId, setSessionId] = useState(null);
+  const [newStop, setNewStop] = useState("");
   const navigate = useNavigate();
 
+  // Event replies and the stream can arrive in either order; keep the newest route
+  function showRoute(data) {
+    setResult((prev) => (!prev || data.version >= prev.version ? data : prev));
+  }
+
+  useEffect(() => {
+    if (!sessionId) return undefined;
+    return subscribeToSession(sessionId, showRoute);
+  }, [sessionId]);
+
   function updateLocation(idx, value) {
     const copy = [...locations];
     copy[idx] = value;
@@ -36,25 +50,42 @@ export default function RoutePlanner() {
     e.preventDefault();
     setError(null);
     setResult(null);
+    setSessionId(null);
     setLoading(true);
     try {
-      const payload = { locations: locations.filter(Boolean) };
-      const res = await api.post("/optimize", payload);
-      if (res?.data?.route) {
-        setResult(res.data.route);
+      const data = await createSession(locations.filter(Boolean));
+      if (data?.route) {
+        setResult(data);
+        setSessionId(data.session_id);
       } else {
         setError("Unexpected response from server");
       }
     } catch (err) {
-      setError(err?.response?.data?.message || err.message || "Request failed");
+      setError(err?.response?.data?.error || err.message || "Request failed");
     } finally {
       setLoading(false);
     }
   }
 
+  async function applyEvent(event) {
+    setError(null);
+    try {
+      showRoute(await sendSessionEvent(sessionId, event));
+    } catch (err) {
+      setError(err?.response?.data?.error || err.message || "Request failed");
+    }
+  }
+
+  function addStop() {
+    if (newStop) {
+      applyEvent({ type: "add_stop", location: newStop });
+      setNewStop("");
+    }
+  }
+
   function openMap() {
     if (result) {
-      navigate("/map", { state: { route: result } });
+      navigate("/map", { state: { route: result.route, sessionId } });
     }
   }
 
@@ -137,11 +168,40 @@ export default function RoutePlanner() {
                         {idx + 1}
                       </span>
                       <span className="text-gray-800 font-medium">{point.input}</span>
+                      {sessionId && idx !== 0 && idx !== result.route.length - 1 && (
+                        <button
+                          type="button"
+                          onClick={() => applyEvent({ type: "drop_stop", location: point.input })}
+                          className="px-2 py-1 text-xs text-red-600"
+                        >
+                          Drop
+                        </button>
+                      )}
                     </div>
                   ))}
                 </div>
               </div>
 
+              {/* Add a stop to the live route */}
+              {sessionId && (
+                <div className="mb-4 flex gap-2">
+                  <input
+                    type="text"
+                    value={newStop}
+                    onChange={(e) => setNewStop(e.target.value)}
+                    placeholder="Add a pickup on the way (address or lat,lng)"
+                    className="flex-1 p-2 border rounded text-sm"
+                  />
+                  <button
+                    type="button"
+                    onClick={addStop}
+                    className="px-3 py-2 bg-indigo-600 text-white rounded text-sm"
+                  >
+                    Add Stop
+                  </button>
+                </div>
+              )}
+
               {/* Leg-by-Leg Breakdown */}
               {result.legs && result.legs.length > 0 && (
                 <div className="mb-4">
@@ -1,6 +1,7 @@
 import React, { useEffect, useState } from "react";
 import { useLocation } from "react-router-dom";
 import MapboxMap from "../components/MapboxMap";
+import { subscribeToSession } from "../utils/routeSession";
 
 /**
  * Map view loads route from location.state or fetches it from backend (if an ID were provided).
@@ -8,7 +9,14 @@ import MapboxMap from "../components/MapboxMap";
  */
 export default function MapView() {
   const { state } = useLocation();
-  const route = state?.route ?? null;
+  const [route, setRoute] = useState(state?.route ?? null);
+  const sessionId = state?.sessionId;
+
+  // Follow live session updates so the map redraws when stops change
+  useEffect(() => {
+    if (!sessionId) return undefined;
+    return subscribeToSession(sessionId, (data) => setRoute(data.route));
+  }, [sessionId]);
 
   return (
     <div>
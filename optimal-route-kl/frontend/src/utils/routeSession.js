@@ -0,0 +1,24 @@
+import api from "./api";
+
+/**
+ * Live route sessions (backend /api/sessions). The server keeps the travel-time
+ * matrix and current order, repairs it when a stop is added or dropped, and
+ * pushes every new route over server-sent events.
+ */
+
+export async function createSession(locations) {
+  const res = await api.post("/sessions", { locations });
+  return res.data;
+}
+
+export async function sendSessionEvent(sessionId, event) {
+  const res = await api.post(`/sessions/${sessionId}/events`, event);
+  return res.data;
+}
+
+// Calls onRoute with each route pushed by the server; returns an unsubscribe function.
+export function subscribeToSession(sessionId, onRoute) {
+  const source = new EventSource(`${api.defaults.baseURL}/sessions/${sessionId}/stream`);
+  source.onmessage = (e) => onRoute(JSON.parse(e.data));
+  return () => source.close();
+}